@@ -13,8 +13,8 @@ from ricecooker.classes.nodes import TopicNode
 from ricecooker.config import LOGGER
 from ricecooker.utils.caching import CacheControlAdapter
 from ricecooker.utils.caching import CacheForeverHeuristic
-from ricecooker.utils.caching import FileCache
 from ricecooker.utils.html import download_file
+from ricecooker.utils.metadata_cache import get_cache_backend
 from ricecooker.utils.zip import create_predictable_zip
 
 
@@ -26,7 +26,7 @@ CHANNEL_LANGUAGE = "en"  # language of channel
 
 
 sess = requests.Session()
-cache = FileCache(".webcache")
+cache = get_cache_backend(".webcache")
 basic_adapter = CacheControlAdapter(cache=cache)
 forever_adapter = CacheControlAdapter(heuristic=CacheForeverHeuristic(), cache=cache)
 
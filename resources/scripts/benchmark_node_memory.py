@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Benchmark the memory used by the nodes of a synthetic channel.
+
+Builds a channel of document, exercise and topic nodes the way a chef does
+(license strings, one file per document, a few questions per exercise) and
+reports the bytes allocated per node, measured with tracemalloc. Files are not
+processed, so this is the memory held by the tree before the pipeline runs.
+
+Usage:
+    python resources/scripts/benchmark_node_memory.py [--nodes 100000]
+"""
+
+import argparse
+import gc
+import tracemalloc
+
+from ricecooker.classes.files import DocumentFile
+from ricecooker.classes.nodes import ChannelNode
+from ricecooker.classes.nodes import DocumentNode
+from ricecooker.classes.nodes import ExerciseNode
+from ricecooker.classes.nodes import TopicNode
+from ricecooker.classes.questions import SingleSelectQuestion
+
+
+def build_tree(count):
+    """Return a channel with `count` nodes, one topic per 100 nodes."""
+    channel = ChannelNode(
+        "benchmark", "benchmark.example.com", "Benchmark", language="en"
+    )
+    topic = None
+    for i in range(count):
+        if i % 100 == 0:
+            topic = TopicNode("topic-{}".format(i), "Topic {}".format(i))
+            channel.add_child(topic)
+        elif i % 10 == 0:
+            exercise = ExerciseNode(
+                "exercise-{}".format(i),
+                "Exercise {}".format(i),
+                license="CC BY",
+                copyright_holder="Learning Equality",
+            )
+            for q in range(3):
+                exercise.add_question(
+                    SingleSelectQuestion(
+                        "question-{}-{}".format(i, q),
+                        "What is {} + {}?".format(i, q),
+                        str(i + q),
+                        [str(i + q), str(i), str(q)],
+                    )
+                )
+            topic.add_child(exercise)
+        else:
+            topic.add_child(
+                DocumentNode(
+                    "document-{}".format(i),
+                    "Document {}".format(i),
+                    license="CC BY",
+                    copyright_holder="Learning Equality",
+                    files=[
+                        DocumentFile("https://benchmark.example.com/{}.pdf".format(i))
+                    ],
+                )
+            )
+    return channel
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=100000)
+    args = parser.parse_args()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    channel = build_tree(args.nodes)
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    nodes = channel.count()
+    print("{:>12} {:>16} {:>16}".format("nodes", "bytes", "bytes per node"))
+    print("{:>12,} {:>16,} {:>16,.0f}".format(nodes, used, used / nodes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+"""
+Benchmark the work FilePipeline does around its handlers for each file.
+
+Runs a pipeline of stub stages that do the context handling of a FileHandler
+(building the context and the kwargs of handle_file) without any file I/O, and
+reports the time spent per file and stage.
+
+Usage:
+    python resources/scripts/benchmark_pipeline_overhead.py [--files 5000] [--stages 3]
+"""
+
+import argparse
+import time
+
+from ricecooker.utils.pipeline import FilePipeline
+from ricecooker.utils.pipeline.context import FileMetadata
+from ricecooker.utils.pipeline.convert import SubtitleContextMetadata
+from ricecooker.utils.pipeline.file_handler import FileHandler
+from ricecooker.utils.pipeline.file_handler import Handler
+
+
+class SubtitleHandler(FileHandler):
+    CONTEXT_CLASS = SubtitleContextMetadata
+
+    def should_handle(self, path):
+        return True
+
+    def handle_file(self, path, **kwargs):
+        return None
+
+
+class StubStage(Handler):
+    """Stage doing the context work of a FileHandler, without any file I/O."""
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def should_handle(self, path):
+        return True
+
+    def execute(self, path, context=None, skip_cache=False):
+        self.handler.get_file_kwargs(self.handler._get_context(context))
+        return [FileMetadata(path=path, preset="document")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--stages", type=int, default=3)
+    args = parser.parse_args()
+
+    stages = [StubStage(SubtitleHandler()) for _ in range(args.stages)]
+    pipeline = FilePipeline(
+        children=stages, default_context={"video_settings": {"crf": 32}}
+    )
+    start = time.perf_counter()
+    for i in range(args.files):
+        pipeline.execute("file-{}.pdf".format(i), context={"language": "en"})
+    elapsed = time.perf_counter() - start
+    print(
+        "{} files x {} stages: {:.1f} us per file and stage".format(
+            args.files, args.stages, elapsed / args.files / args.stages * 1e6
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
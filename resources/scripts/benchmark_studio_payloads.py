@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""
+Benchmark the serialization of add_nodes payloads for a synthetic channel.
+
+Builds a channel of 10,000 exercise, document and topic nodes, serializes
+every node the way ChannelManager.add_nodes does, and reports the time taken
+and the bytes on the wire with and without gzip, for the standard library json
+module and for orjson (when installed).
+
+Usage:
+    python resources/scripts/benchmark_studio_payloads.py [--nodes 10000]
+"""
+
+import argparse
+import gzip
+import time
+import uuid
+
+from ricecooker import config
+from ricecooker.utils import studio_api
+
+
+def synthetic_node(i):
+    """Return a dict shaped like Node.to_dict() for node number `i`."""
+    node = {
+        "title": "Node {} — título ñ".format(i),
+        "language": "en",
+        "description": "A synthetic node used to benchmark payloads. " * 4,
+        "node_id": uuid.uuid4().hex,
+        "content_id": uuid.uuid4().hex,
+        "source_domain": "benchmark.example.com",
+        "source_id": "node-{}".format(i),
+        "author": "Benchmark",
+        "license": "CC BY",
+        "copyright_holder": "Learning Equality",
+        "files": [
+            {
+                "size": 123456,
+                "preset": "document",
+                "filename": "{}.pdf".format(uuid.uuid4().hex),
+                "original_filename": "doc-{}.pdf".format(i),
+                "language": "en",
+                "source_url": "https://benchmark.example.com/doc-{}.pdf".format(i),
+            }
+        ],
+        "tags": ["benchmark", "synthetic"],
+        "extra_fields": {},
+    }
+    if i % 3 == 0:
+        node["kind"] = "exercise"
+        node["questions"] = [
+            {
+                "assessment_id": uuid.uuid4().hex,
+                "type": "single_selection",
+                "question": "What is {} + {}? ![](${{☣ CONTENTSTORAGE}}/img.png)".format(
+                    i, q
+                ),
+                "answers": [
+                    {"answer": str(i + q + a), "correct": a == 0, "order": a}
+                    for a in range(4)
+                ],
+                "hints": [{"hint": "Add them up", "order": 1}],
+                "files": [],
+            }
+            for q in range(10)
+        ]
+    else:
+        node["kind"] = "document" if i % 3 == 1 else "topic"
+    return node
+
+
+def run(nodes, use_orjson):
+    config.STUDIO_USE_ORJSON = use_orjson
+    start = time.perf_counter()
+    payloads = [studio_api.dumps(node) for node in nodes]
+    body = b'{"root_id": "root", "content_data": [%s]}' % b", ".join(payloads)
+    serialize_time = time.perf_counter() - start
+    start = time.perf_counter()
+    compressed = gzip.compress(body, compresslevel=config.STUDIO_GZIP_LEVEL)
+    compress_time = time.perf_counter() - start
+    return serialize_time, len(body), compress_time, len(compressed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--nodes", type=int, default=10000)
+    args = parser.parse_args()
+    nodes = [synthetic_node(i) for i in range(args.nodes)]
+
+    serializers = [("json", False)]
+    if studio_api.orjson is not None:
+        serializers.append(("orjson", True))
+    print(
+        "{:<8} {:>12} {:>14} {:>12} {:>14}".format(
+            "", "serialize", "bytes", "gzip", "gzip bytes"
+        )
+    )
+    for name, use_orjson in serializers:
+        serialize_time, size, compress_time, compressed_size = run(nodes, use_orjson)
+        print(
+            "{:<8} {:>11.3f}s {:>14,} {:>11.3f}s {:>14,}".format(
+                name, serialize_time, size, compress_time, compressed_size
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
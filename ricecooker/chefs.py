@@ -8,6 +8,7 @@ import sys
 from datetime import datetime
 from warnings import warn
 
+from ricecooker.utils.host_limits import configure_download_limits
 from ricecooker.utils.pipeline import FilePipeline
 from ricecooker.utils.pipeline.exceptions import ExpectedFileException
 from ricecooker.utils.pipeline.exceptions import InvalidFileException
@@ -47,6 +48,7 @@ class SushiChef(object):
     CHEF_RUN_DATA = config.CHEF_DATA_DEFAULT  # loaded from chefdata/chef_data.json
     TREES_DATA_DIR = config.TREES_DATA_DIR  # tree archives and JsonTreeChef inputs
     DOMAIN_AUTH_HEADERS = {}  # dict of {domain: {header: env var name}} for requests auth
+    DOWNLOAD_HOST_LIMITS = {}  # dict of {domain pattern: HostLimit kwargs} for downloads
 
     channel_node_class = nodes.ChannelNode
 
@@ -147,6 +149,51 @@ class SushiChef(object):
             action="store_true",
             help="Prompt user to open the channel after the chef run.",
         )
+        parser.add_argument(
+            "--download-workers",
+            type=int,
+            help="Number of files downloaded at the same time (default: 4 per CPU, at most 32).",
+        )
+        parser.add_argument(
+            "--convert-workers",
+            type=int,
+            help="Number of files converted or compressed at the same time (default: one per CPU).",
+        )
+        parser.add_argument(
+            "--metadata-workers",
+            type=int,
+            help="Number of files whose metadata is extracted at the same time (default: one per CPU).",
+        )
+        parser.add_argument(
+            "--stream-uploads",
+            action="store_true",
+            help="Upload files to Studio while the rest of the channel is still being processed.",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue creating the channel tree where the last interrupted run stopped.",
+        )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help="Skip processing the nodes that did not change since the last run.",
+        )
+        parser.add_argument(
+            "--recheck-remote",
+            action="store_true",
+            help="Ask Studio again for every file instead of trusting the local index of uploaded files.",
+        )
+        parser.add_argument(
+            "--revalidate",
+            action="store_true",
+            help="Ask the source servers whether cached downloads changed (ETag / Last-Modified) and download only those that did.",
+        )
+        parser.add_argument(
+            "--gc-storage",
+            action="store_true",
+            help="After the run, remove the files in storage/ the channel does not use (see RICECOOKER_STORAGE_BUDGET).",
+        )
         parser.add_argument(
             "--deploy",
             dest="stage",
@@ -497,6 +544,7 @@ class SushiChef(object):
             }
         self.file_pipeline = FilePipeline(default_context=default_context)
         self.auth = DomainSpecificAuth(self.DOMAIN_AUTH_HEADERS)
+        configure_download_limits(self.DOWNLOAD_HOST_LIMITS)
         # TODO(Kevin): move self.download_content() call here
         self.pre_run(args, options)
         uploadchannel_wrapper(self, args, options)
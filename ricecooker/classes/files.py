@@ -10,6 +10,7 @@ from requests import HTTPError
 
 from ricecooker.utils.caching import FILECACHE
 from ricecooker.utils.caching import get_cache_filename
+from ricecooker.utils.host_limits import limit_download
 from ricecooker.utils.images import create_image_from_epub
 from ricecooker.utils.images import create_image_from_pdf_page
 from ricecooker.utils.images import create_image_from_zip
@@ -24,7 +25,11 @@ from ricecooker.utils.pipeline.convert import VideoCompressionHandler
 from ricecooker.utils.pipeline.exceptions import ExpectedFileException
 from ricecooker.utils.pipeline.exceptions import InvalidFileException
 from ricecooker.utils.pipeline.transfer import CatchAllWebResourceDownloadHandler
+from ricecooker.utils.remote_index import confirm_remote
+from ricecooker.utils.remote_index import forget_remote
+from ricecooker.utils.remote_index import get_confirmed_remote_size
 from ricecooker.utils.storage import copy_file_to_storage
+from ricecooker.utils.storage import get_storage_metadata
 from ricecooker.utils.videos import extract_thumbnail_from_video
 from ricecooker.utils.youtube import get_language_with_alpha2_fallback
 
@@ -38,6 +43,25 @@ fallback_pipeline = FilePipeline()
 CONVERTIBLE_FORMATS = {p.id: p.convertible_formats for p in format_presets.PRESETLIST}
 
 
+def get_attributes(obj, exclude=()):
+    """
+    Return the attributes of `obj` as a dict: those kept in the __slots__ of its
+    classes (None if unset) and those in its __dict__. Used to describe files
+    and questions, whose __dict__ alone leaves out their slots.
+    """
+    attributes = {}
+    for cls in type(obj).__mro__:
+        for name in getattr(cls, "__slots__", ()):
+            if name not in ("__dict__", "__weakref__") and name not in exclude:
+                attributes[name] = getattr(obj, name, None)
+    attributes.update(
+        (name, value)
+        for name, value in getattr(obj, "__dict__", {}).items()
+        if name not in exclude
+    )
+    return attributes
+
+
 class ThumbnailPresetMixin(object):
     def get_preset(self):
         thumbnail_preset = self.node.get_thumbnail_preset()
@@ -47,18 +71,27 @@ class ThumbnailPresetMixin(object):
 
 
 class File(object):
-    original_filename = None
-    node = None
     error = None
     default_ext = None
-    filename = None
-    language = None
     assessment_item = None
     is_primary = False
-    duration = None
     skip_upload = False
     default_preset = None
 
+    # Attributes every file has are kept in slots rather than in a per-file
+    # dict; __dict__ is only created for files that set other attributes.
+    __slots__ = (
+        "preset",
+        "language",
+        "source_url",
+        "duration",
+        "original_filename",
+        "filename",
+        "node",
+        "__dict__",
+        "__weakref__",
+    )
+
     def __init__(
         self,
         preset=None,
@@ -70,12 +103,15 @@ class File(object):
         filename=None,
     ):
         self.preset = preset
+        self.language = None
         self.set_language(language)
-        self.default_ext = default_ext or self.default_ext
+        if default_ext:
+            self.default_ext = default_ext
         self.source_url = source_url
         self.duration = duration
         self.original_filename = original_filename
         self.filename = filename
+        self.node = None
 
     def set_language(self, language):
         """Set self.language to internal lang. repr. code from str or Language object."""
@@ -114,7 +150,12 @@ class File(object):
 
     @property
     def size(self):
-        return os.path.getsize(config.get_existing_storage_path(self.get_filename()))
+        filename = self.get_filename()
+        metadata = get_storage_metadata(filename)
+        if metadata is None:
+            # Raises a descriptive FileNotFoundException
+            return os.path.getsize(config.get_existing_storage_path(filename))
+        return metadata.size
 
     def truncate_fields(self):
         if (
@@ -162,7 +203,7 @@ class File(object):
         # If file was successfully downloaded, return dict
         # Otherwise return None
         if filename:
-            if os.path.isfile(config.get_storage_path(filename)):
+            if get_storage_metadata(filename) is not None:
                 return self.file_dict(filename=filename)
             else:
                 config.LOGGER.warning(
@@ -178,6 +219,7 @@ class File(object):
 class DownloadFile(File):
     ext = None
     allowed_formats = None
+    __slots__ = ("path", "context")
 
     def __init__(self, path, context=None, **kwargs):
         self.path = path.strip()
@@ -468,10 +510,11 @@ class _ExerciseGraphieFile(File):
         delimiter = bytes(exercises.GRAPHIE_DELIMITER, "UTF-8")
         config.LOGGER.info("\tDownloading graphie {}".format(self.original_filename))
         # Write to graphie file
-        r = config.DOWNLOAD_SESSION.get(self.path + ".svg", stream=True)
-        r.raise_for_status()
-        for chunk in r.iter_content():
-            tempf.write(chunk)
+        with limit_download(self.path):
+            r = config.DOWNLOAD_SESSION.get(self.path + ".svg", stream=True)
+            r.raise_for_status()
+            for chunk in r.iter_content():
+                tempf.write(chunk)
         tempf.write(delimiter)
         # Separate the path into these components, splitting on the final /
         # in the same way that the KA frontend code does for localization here:
@@ -482,17 +525,20 @@ class _ExerciseGraphieFile(File):
             base_path, _, file_hash = self.path.rpartition("/")
             json_path_base = base_path + "/" + self.ka_language + "/" + file_hash
         should_cache = True
-        try:
-            r = config.DOWNLOAD_SESSION.get(json_path_base + "-data.json", stream=True)
-            r.raise_for_status()
-        except HTTPError:
-            if self.ka_language == "en":
-                raise
-            r = config.DOWNLOAD_SESSION.get(self.path + "-data.json", stream=True)
-            r.raise_for_status()
-            should_cache = False
-        for chunk in r.iter_content():
-            tempf.write(chunk)
+        with limit_download(self.path):
+            try:
+                r = config.DOWNLOAD_SESSION.get(
+                    json_path_base + "-data.json", stream=True
+                )
+                r.raise_for_status()
+            except HTTPError:
+                if self.ka_language == "en":
+                    raise
+                r = config.DOWNLOAD_SESSION.get(self.path + "-data.json", stream=True)
+                r.raise_for_status()
+                should_cache = False
+            for chunk in r.iter_content():
+                tempf.write(chunk)
         tempf.close()
         filename = copy_file_to_storage(tempf.name, ext=file_formats.GRAPHIE)
         os.unlink(tempf.name)
@@ -633,17 +679,25 @@ class StudioFile(File):
 
     def validate(self):
         if not self._validated:
+            # Skip the HEAD request for files a previous run already confirmed
+            size = get_confirmed_remote_size(self.filename)
+            if size is not None:
+                self.size = size
+                self._validated = True
+                return
             file_url = config.get_storage_url(self.filename)
             response = config.DOWNLOAD_SESSION.head(file_url)
             try:
                 response.raise_for_status()
             except Exception as e:
+                forget_remote(self.filename)
                 raise ValueError(
                     "Could not find remote file {} for reason {}".format(
                         self.filename, e
                     )
                 )
             self.size = int(response.headers.get("Content-Length", 0))
+            confirm_remote(self.filename, size=self.size)
             self._validated = True
 
     def to_dict(self):
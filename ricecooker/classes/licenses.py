@@ -1,4 +1,7 @@
 # License models
+import copy
+import functools
+
 from le_utils.constants import licenses
 
 from .. import config
@@ -34,6 +37,19 @@ def get_license(license_id, copyright_holder=None, description=None):
         )
 
 
+@functools.lru_cache(maxsize=1024)
+def get_shared_license(license_id, copyright_holder=None, description=None):
+    """
+    Same as get_license, but returns the same License object every time it is
+    called with the same arguments, so that the nodes of a channel share a few
+    License objects instead of holding one each. Don't modify the result: use
+    License.truncated instead of License.truncate_fields on it.
+    """
+    return get_license(
+        license_id, copyright_holder=copyright_holder, description=description
+    )
+
+
 class License(object):
     license_id = None  # (str): content's license based on le_utils.constants.licenses
     copyright_holder = (
@@ -78,6 +94,23 @@ class License(object):
                 : config.MAX_COPYRIGHT_HOLDER_LENGTH
             ]
 
+    def truncated(self):
+        """
+        Return the license if its fields fit the lengths Studio accepts, or else
+        a truncated copy, leaving the license itself (maybe shared) unchanged.
+        """
+        if (
+            not self.description
+            or len(self.description) <= config.MAX_LICENSE_DESCRIPTION_LENGTH
+        ) and (
+            not self.copyright_holder
+            or len(self.copyright_holder) <= config.MAX_COPYRIGHT_HOLDER_LENGTH
+        ):
+            return self
+        truncated_license = copy.copy(self)
+        truncated_license.truncate_fields()
+        return truncated_license
+
     def as_dict(self):
         return {
             "license_id": self.license_id,
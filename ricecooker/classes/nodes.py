@@ -70,6 +70,94 @@ inheritable_metadata_label_fields = [
 ]
 
 
+class _LazyDefault(object):
+    """
+    Node attribute that is empty for most nodes. Nothing is allocated for it
+    until it is first read, so large trees don't hold an empty list or dict per
+    node and field. The value is stored in the slot of the same name prefixed
+    with an underscore, where None stands for empty.
+    """
+
+    def __init__(self, factory=list):
+        self.factory = factory
+
+    def __set_name__(self, owner, name):
+        self.slot = "_" + name
+
+    def __get__(self, node, owner=None):
+        if node is None:
+            return self
+        value = getattr(node, self.slot)
+        if value is None:
+            value = self.factory()
+            setattr(node, self.slot, value)
+        return value
+
+    def __set__(self, node, value):
+        setattr(node, self.slot, value)
+
+
+class _ChildList(list):
+    """
+    List of the children of a node that forgets the cached descendant counts
+    of the node and its ancestors whenever it is changed, so chef code can
+    append, insert or remove children directly.
+    """
+
+    def __init__(self, owner, children=()):
+        super().__init__(children)
+        self.owner = owner
+
+    def __reduce__(self):
+        return _ChildList, (self.owner, list(self))
+
+    def _changed(self):
+        self.owner._invalidate_count()
+
+    def append(self, item):
+        super().append(item)
+        self._changed()
+
+    def extend(self, items):
+        super().extend(items)
+        self._changed()
+
+    def insert(self, index, item):
+        super().insert(index, item)
+        self._changed()
+
+    def remove(self, item):
+        super().remove(item)
+        self._changed()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._changed()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._changed()
+
+    def __iadd__(self, items):
+        result = super().__iadd__(items)
+        self._changed()
+        return result
+
+    def __imul__(self, n):
+        result = super().__imul__(n)
+        self._changed()
+        return result
+
+
 class Node(object):
     """Base model representing all nodes in the content tree.
 
@@ -105,14 +193,60 @@ class Node(object):
     """
 
     kind = None
-    license = None
-    language = None
-    valid = False
     # Nodes with questions (ExerciseNode, UnitNode) set this True.
     # This gates Node._validate() to allow a non-empty `questions` list,
     # which TreeNode.to_dict() serializes for the Studio API.
     _allows_questions = False
 
+    # Attributes every node has are kept in slots rather than in a per-node
+    # dict; other attributes, e.g. those set by subclasses, go in __dict__,
+    # which is only created for nodes that use it.
+    __slots__ = (
+        "source_id",
+        "title",
+        "description",
+        "language",
+        "license",
+        "author",
+        "aggregator",
+        "provider",
+        "role",
+        "domain_ns",
+        "node_id",
+        "content_id",
+        "parent",
+        "files",
+        "_descendants",
+        "thumbnail",
+        "derive_thumbnail",
+        "node_modifications",
+        "suggested_duration",
+        "_tags",
+        "valid",
+        "_children",
+        "_descendant_count",
+        "_questions",
+        "_extra_fields",
+        "_grade_levels",
+        "_resource_types",
+        "_learning_activities",
+        "_accessibility_labels",
+        "_categories",
+        "_learner_needs",
+        "__dict__",
+        "__weakref__",
+    )
+    descendants = _LazyDefault()
+    tags = _LazyDefault()
+    questions = _LazyDefault()
+    extra_fields = _LazyDefault(dict)
+    grade_levels = _LazyDefault()
+    resource_types = _LazyDefault()
+    learning_activities = _LazyDefault()
+    accessibility_labels = _LazyDefault()
+    categories = _LazyDefault()
+    learner_needs = _LazyDefault()
+
     def __init__(
         self,
         source_id,
@@ -145,16 +279,19 @@ class Node(object):
         self.source_id = source_id
 
         self.files = []
-        self.children = []
-        self.descendants = []
         self.parent = None
+        self._descendant_count = None  # cached by count()
+        self.children = []
+        self.descendants = None
         self.node_id = None
         self.content_id = None
+        self.valid = False
         self.title = title
+        self.language = None
         self.set_language(language)
         self.description = description or ""
         self.derive_thumbnail = derive_thumbnail
-        self.extra_fields = extra_fields or {}
+        self.extra_fields = extra_fields or None
 
         for f in files or []:
             self.add_file(f)
@@ -166,19 +303,18 @@ class Node(object):
         self.author = author or ""
         self.aggregator = aggregator or ""
         self.provider = provider or ""
-        self.tags = tags or []
+        self.tags = tags or None
         self.domain_ns = domain_ns
         self.suggested_duration = suggested_duration
-        self.questions = (
-            self.questions if hasattr(self, "questions") else []
-        )  # Needed for to_dict method
-
-        self.grade_levels = grade_levels or []
-        self.resource_types = resource_types or []
-        self.learning_activities = learning_activities or []
-        self.accessibility_labels = accessibility_labels or []
-        self.categories = categories or []
-        self.learner_needs = learner_needs or []
+        if not hasattr(self, "_questions"):  # ExerciseNode sets questions first
+            self.questions = None
+
+        self.grade_levels = grade_levels or None
+        self.resource_types = resource_types or None
+        self.learning_activities = learning_activities or None
+        self.accessibility_labels = accessibility_labels or None
+        self.categories = categories or None
+        self.learner_needs = learner_needs or None
         self.role = role
 
         self.set_license(
@@ -211,6 +347,45 @@ class Node(object):
     def __repr__(self):
         return self.__str__()
 
+    @property
+    def children(self):
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = _ChildList(self, children)
+        self._invalidate_count()
+
+    def _invalidate_count(self):
+        """Forget the cached descendant counts of this node and its ancestors."""
+        node = self
+        while node is not None and node._descendant_count is not None:
+            node._descendant_count = None
+            node = node.parent
+
+    def walk(self, post_order=False):
+        """walk: iterate over this node and all its descendants without recursion
+        Args: post_order (bool): yield each node after its descendants instead of before
+        Returns: iterator of (depth, node) tuples, depth being 0 for this node
+        """
+        if not post_order:
+            stack = [(0, self)]
+            while stack:
+                depth, node = stack.pop()
+                yield depth, node
+                stack.extend((depth + 1, child) for child in reversed(node.children))
+            return
+        stack = [(0, self, False)]
+        while stack:
+            depth, node, expanded = stack.pop()
+            if expanded:
+                yield depth, node
+            else:
+                stack.append((depth, node, True))
+                stack.extend(
+                    (depth + 1, child, False) for child in reversed(node.children)
+                )
+
     def truncate_fields(self):
         if len(self.title) > config.MAX_TITLE_LENGTH:
             config.print_truncate("title", self.source_id, self.title, kind=self.kind)
@@ -238,7 +413,7 @@ class Node(object):
         """
         assert isinstance(node, Node), "Child node must be a subclass of Node"
         node.parent = self
-        self.children += [node]
+        self.children.append(node)
 
     def copy(self, parent=None):
         """Return a recursive clone for placing this node under ``parent``.
@@ -247,13 +422,23 @@ class Node(object):
         from its own parent chain, while keeping source_id (and thus content_id)
         identical. File objects are shared, not copied.
         """
+        root = self._copy_node(parent)
+        stack = [(self, root)]
+        while stack:
+            node, clone = stack.pop()
+            clone.children = [child._copy_node(clone) for child in node.children]
+            stack.extend(zip(node.children, clone.children))
+        return root
+
+    def _copy_node(self, parent):
         clone = copy.copy(self)
         clone.parent = parent
         clone.node_id = None
         clone.content_id = None
-        clone.descendants = []
+        clone.descendants = None
         clone.files = list(self.files)
-        clone.children = [child.copy(parent=clone) for child in self.children]
+        clone._descendant_count = None
+        clone._children = _ChildList(clone)
         return clone
 
     def add_file(self, file_to_add):
@@ -278,6 +463,11 @@ class Node(object):
         """
         return None
 
+    def get_thumbnail_dependencies(self):
+        """Return the nodes whose processed files generate_thumbnail uses, and
+        that must therefore be processed before this node."""
+        return []
+
     def has_thumbnail(self):
         from .files import ThumbnailFile
 
@@ -344,13 +534,23 @@ class Node(object):
 
     def count(self):
         """count: get number of nodes in tree
+        The counts of every node in the tree are cached until its children change.
         Args: None
         Returns: int
         """
-        total = len(self.children)
-        for child in self.children:
-            total += child.count()
-        return total
+        stack = [(self, False)]
+        while stack:
+            node, expanded = stack.pop()
+            if node._descendant_count is not None:
+                continue
+            if expanded:
+                node._descendant_count = sum(
+                    1 + child._descendant_count for child in node.children
+                )
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children)
+        return self._descendant_count
 
     def get_topic_count(self):
         """get_topic_count: get number of topics in tree
@@ -358,17 +558,21 @@ class Node(object):
         Returns: int
         """
         total = 0
-        if self.kind == content_kinds.TOPIC or self.kind == "Channel":
-            total = 1
-            for child in self.children:
-                total += child.get_topic_count()
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.kind == content_kinds.TOPIC or node.kind == "Channel":
+                total += 1
+                stack.extend(node.children)
         return total
 
     def get_non_topic_descendants(self):
         if len(self.descendants) == 0:
-            for child_node in self.children:
+            stack = list(reversed(self.children))
+            while stack:
+                child_node = stack.pop()
                 if child_node.kind == content_kinds.TOPIC:
-                    self.descendants += child_node.get_non_topic_descendants()
+                    stack.extend(reversed(child_node.children))
                 elif child_node not in self.descendants:
                     self.descendants.append(child_node)
         return self.descendants
@@ -378,22 +582,37 @@ class Node(object):
         Args: indent (int): What level of indentation at which to start printing
         Returns: None
         """
-        config.LOGGER.info(
-            "{indent}{data}".format(indent="   " * indent, data=str(self))
-        )
-        for child in self.children:
-            child.print_tree(indent + 1)
+        for depth, node in self.walk():
+            config.LOGGER.info(
+                "{indent}{data}".format(indent="   " * (indent + depth), data=str(node))
+            )
 
     def get_json_tree(self):
-        tree = self.to_dict()
-        if len(self.children) > 0:
-            tree["children"] = []
-            for child in self.children:
-                tree["children"].append(child.get_json_tree())
-
-        return tree
+        root = None
+        stack = [(self, None)]
+        while stack:
+            node, siblings = stack.pop()
+            tree = node.to_dict()
+            if siblings is None:
+                root = tree
+            else:
+                siblings.append(tree)
+            if len(node.children) > 0:
+                tree["children"] = []
+                stack.extend(
+                    (child, tree["children"]) for child in reversed(node.children)
+                )
+        return root
 
     def save_channel_children_to_csv(self, metadata_csv, structure_string=""):
+        stack = [(self, structure_string)]
+        while stack:
+            node, structure = stack.pop()
+            structure = node._save_to_csv(metadata_csv, structure)
+            stack.extend((child, structure) for child in reversed(node.children))
+
+    def _save_to_csv(self, metadata_csv, structure_string):
+        """Write this node's row and return the structure string of its children."""
         # Not including channel title in topic structure
         is_channel = isinstance(self, ChannelNode)
         if not is_channel:
@@ -424,8 +643,7 @@ class Node(object):
                 structure_string = self.title
             else:
                 structure_string += "/" + self.title
-        for child in self.children:
-            child.save_channel_children_to_csv(metadata_csv, structure_string)
+        return structure_string
 
     def _validate_values(self, assertion, error_message):
         if assertion:
@@ -433,17 +651,15 @@ class Node(object):
 
     def infer_learning_activities(self):
         # learning_activities can be set to a default based on the kind if not provided directly
-        if not self.learning_activities and self.kind in kind_activity_map:
+        if not self._learning_activities and self.kind in kind_activity_map:
             self.learning_activities = [kind_activity_map[self.kind]]
 
     def set_license(self, license, copyright_holder=None, description=None):
         # Add license (create model if it's just a path)
         if isinstance(license, str):
-            from .licenses import get_license
+            from .licenses import get_shared_license
 
-            license = get_license(
-                license, copyright_holder=copyright_holder, description=description
-            )
+            license = get_shared_license(license, copyright_holder, description)
         self.license = license
 
     def _validate(self):  # noqa: C901
@@ -457,7 +673,7 @@ class Node(object):
             )
             if not self._allows_questions:
                 self._validate_values(
-                    bool(self.questions),
+                    bool(self._questions),
                     f"{self.__class__.__name__} should not have questions",
                 )
 
@@ -494,14 +710,16 @@ class Node(object):
         )
         self._validate_values(not isinstance(self.files, list), "Files is not a list")
         self._validate_values(
-            not isinstance(self.questions, list), "Questions is not a list"
+            not isinstance(self._questions or [], list), "Questions is not a list"
+        )
+        self._validate_values(
+            not isinstance(self._extra_fields or {}, dict), "Extra fields is not a dict"
         )
         self._validate_values(
-            not isinstance(self.extra_fields, dict), "Extra fields is not a dict"
+            not isinstance(self._tags or [], list), "Tags is not a list"
         )
-        self._validate_values(not isinstance(self.tags, list), "Tags is not a list")
 
-        for tag in self.tags:
+        for tag in self._tags or []:
             self._validate_values(not isinstance(tag, str), "Tag is not a string")
             self._validate_values(
                 len(tag) > 30,
@@ -521,58 +739,58 @@ class Node(object):
             self.role not in ROLES, f"Role must be one of the following: {ROLES}"
         )
 
-        if self.grade_levels is not None:
-            for grade in self.grade_levels:
+        if self._grade_levels is not None:
+            for grade in self._grade_levels:
                 self._validate_values(
                     grade not in levels.LEVELSLIST,
                     f"Grade levels must be one of the following: {levels.LEVELSLIST}",
                 )
 
-        if self.resource_types is not None:
-            for res_type in self.resource_types:
+        if self._resource_types is not None:
+            for res_type in self._resource_types:
                 self._validate_values(
                     res_type not in resource_type.RESOURCETYPELIST,
                     f"Resource types must be one of the following: {resource_type.RESOURCETYPELIST}",
                 )
 
-        if self.learning_activities is not None:
+        if self._learning_activities is not None:
             self._validate_values(
-                not isinstance(self.learning_activities, list),
+                not isinstance(self._learning_activities, list),
                 "Learning activities must be list",
             )
-            for learn_act in self.learning_activities:
+            for learn_act in self._learning_activities:
                 self._validate_values(
                     learn_act not in learning_activities.LEARNINGACTIVITIESLIST,
                     f"Learning activities must be one of the following: {learning_activities.LEARNINGACTIVITIESLIST}",
                 )
 
-        if self.accessibility_labels is not None:
+        if self._accessibility_labels is not None:
             self._validate_values(
-                not isinstance(self.accessibility_labels, list),
+                not isinstance(self._accessibility_labels, list),
                 "Accessibility label must be list",
             )
-            for access_label in self.accessibility_labels:
+            for access_label in self._accessibility_labels:
                 self._validate_values(
                     access_label
                     not in accessibility_categories.ACCESSIBILITYCATEGORIESLIST,
                     f"Accessibility label must be one of the following: {accessibility_categories.ACCESSIBILITYCATEGORIESLIST}",
                 )
 
-        if self.categories is not None:
+        if self._categories is not None:
             self._validate_values(
-                not isinstance(self.categories, list), "Categories must be list"
+                not isinstance(self._categories, list), "Categories must be list"
             )
-            for category in self.categories:
+            for category in self._categories:
                 self._validate_values(
                     category not in subjects.SUBJECTSLIST,
                     f"Categories must be one of the following: {subjects.SUBJECTSLIST}",
                 )
 
-        if self.learner_needs is not None:
+        if self._learner_needs is not None:
             self._validate_values(
-                not isinstance(self.learner_needs, list), "Learner needs must be list"
+                not isinstance(self._learner_needs, list), "Learner needs must be list"
             )
-            for learner_need in self.learner_needs:
+            for learner_need in self._learner_needs:
                 self._validate_values(
                     learner_need not in needs.NEEDSLIST,
                     f"Learner needs must be one of the following: {needs.NEEDSLIST}",
@@ -595,7 +813,7 @@ class Node(object):
         for field in inheritable_metadata_label_fields:
             # These fields, if not set, will be empty list
             ancestor_values = metadata.get(field, [])
-            node_values = getattr(self, field)
+            node_values = getattr(self, "_" + field) or []
             final_values = set()
             # Get a list of all keys in reverse order of length so we can remove any less specific values
             all_values = sorted(
@@ -625,6 +843,7 @@ class ChannelNode(Node):
     """
 
     kind = "Channel"
+    __slots__ = ("source_domain", "tagline")
 
     def __init__(self, source_id, source_domain, title, tagline=None, **kwargs):
         # Map parameters to model variables
@@ -701,7 +920,15 @@ class TreeNode(Node):
 
     def get_domain_namespace(self):
         if not self.domain_ns:
-            self.domain_ns = self.parent.get_domain_namespace()
+            # Walk up to the nearest known namespace instead of recursing
+            ancestors = []
+            node = self
+            while isinstance(node, TreeNode) and not node.domain_ns:
+                ancestors.append(node)
+                node = node.parent
+            domain_ns = node.get_domain_namespace()
+            for ancestor in ancestors:
+                ancestor.domain_ns = domain_ns
         return self.domain_ns
 
     def get_content_id(self):
@@ -714,9 +941,19 @@ class TreeNode(Node):
             "Parent not found: node id must be calculated based on parent"
         )
         if not self.node_id:
-            self.node_id = uuid.uuid5(
-                self.parent.get_node_id(), self.get_content_id().hex
-            )
+            # Compute the missing node_ids from the nearest ancestor that has one
+            ancestors = []
+            node = self
+            while isinstance(node, TreeNode) and not node.node_id:
+                assert node.parent, (
+                    "Parent not found: node id must be calculated based on parent"
+                )
+                ancestors.append(node)
+                node = node.parent
+            node_id = node.get_node_id()
+            for ancestor in reversed(ancestors):
+                ancestor.node_id = uuid.uuid5(node_id, ancestor.get_content_id().hex)
+                node_id = ancestor.node_id
         return self.node_id
 
     def truncate_fields(self):
@@ -736,7 +973,8 @@ class TreeNode(Node):
             )
             self.provider = self.provider[: config.MAX_PROVIDER_LENGTH]
 
-        self.license and self.license.truncate_fields()
+        if self.license:
+            self.license = self.license.truncated()
 
         super(TreeNode, self).truncate_fields()
 
@@ -781,29 +1019,36 @@ class TreeNode(Node):
             "files": [
                 f.to_dict() for f in self.files if f and f.filename
             ],  # Filter out failed downloads
-            "tags": self.node_modifications.get("New Tags") or self.tags,
+            "tags": self.node_modifications.get("New Tags") or self._tags or [],
             "kind": self.kind,
             "license": None,
             "license_description": None,
             "copyright_holder": "",
             "questions": [],
-            "extra_fields": json.dumps(self.extra_fields),
-            "grade_levels": self.grade_levels,
-            "resource_types": self.resource_types,
-            "learning_activities": self.learning_activities,
-            "accessibility_labels": self.accessibility_labels,
-            "categories": self.categories,
-            "learner_needs": self.learner_needs,
+            "extra_fields": json.dumps(self._extra_fields or {}),
+            "grade_levels": self._grade_levels or [],
+            "resource_types": self._resource_types or [],
+            "learning_activities": self._learning_activities or [],
+            "accessibility_labels": self._accessibility_labels or [],
+            "categories": self._categories or [],
+            "learner_needs": self._learner_needs or [],
             "role": self.role,
         }
 
     def gather_ancestor_metadata(self):
-        if not self.parent:
-            raise InvalidNodeException(
-                "Parent not found: cannot gather ancestor metadata if no parent exists"
-            )
-        metadata = self.parent.gather_ancestor_metadata()
-        return self.get_metadata_dict(metadata)
+        ancestors = []
+        node = self
+        while isinstance(node, TreeNode):
+            if not node.parent:
+                raise InvalidNodeException(
+                    "Parent not found: cannot gather ancestor metadata if no parent exists"
+                )
+            ancestors.append(node)
+            node = node.parent
+        metadata = node.gather_ancestor_metadata()
+        for ancestor in reversed(ancestors):
+            metadata = ancestor.get_metadata_dict(metadata)
+        return metadata
 
 
 class TopicNode(TreeNode):
@@ -825,6 +1070,12 @@ class TopicNode(TreeNode):
 
         return TiledThumbnailFile(self.get_non_topic_descendants())
 
+    def get_thumbnail_dependencies(self):
+        # The tiled thumbnail is made of the thumbnails of the descendants
+        if self.has_thumbnail() or not (config.THUMBNAILS or self.derive_thumbnail):
+            return []
+        return self.get_non_topic_descendants()
+
 
 class ContentNode(TreeNode):
     """Model representing content nodes (non-topic leaf nodes) in the channel's tree.
@@ -842,13 +1093,15 @@ class ContentNode(TreeNode):
     """
 
     required_presets = tuple()
+    __slots__ = ("uri", "_pipeline", "_context", "_files_processed")
+    context = _LazyDefault(dict)
 
     def __init__(
         self, source_id, title, license, uri=None, pipeline=None, context=None, **kwargs
     ):
         self.uri = uri
         self._pipeline = pipeline
-        self.context = context or {}
+        self.context = context or None
         # Flag here to say that files haven't been processed.
         # Until files have been processed we can't be sure that the files are actually valid
         # for example, once we download a file we may discover it doesn't exist, that it's
@@ -1207,13 +1460,24 @@ class ExerciseNode(ContentNode):
         )
         downloaded = super(ExerciseNode, self).process_files()
         for question in self.questions:
-            downloaded += question.process_question()
+            downloaded += self.process_question(question)
 
         self.process_exercise_data()
 
         config.LOGGER.info("\t*** Images for {} have been processed".format(self.title))
         return downloaded
 
+    def process_question(self, question):
+        """Process the images of `question`, unless that was already done
+        (ChannelManager processes the questions of an exercise in parallel).
+        Returns: content-hash based filenames of the question's files
+        """
+        if question._processed:
+            return [f.filename for f in question.files]
+        filenames = question.process_question()
+        question._processed = True
+        return filenames
+
     def process_exercise_data(self):
         mastery_model = self.extra_fields["mastery_model"]
 
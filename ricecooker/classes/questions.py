@@ -14,6 +14,7 @@ from ..exceptions import InvalidQuestionException
 from .files import _ExerciseBase64ImageFile
 from .files import _ExerciseGraphieFile
 from .files import _ExerciseImageFile
+from .files import get_attributes
 
 # Reusable protocol and path pattern for Perseus questions
 PERSEUS_PROTOCOL_PATH = (
@@ -50,6 +51,24 @@ class BaseQuestion:
         raw_data (str): raw data for perseus file
     """
 
+    # Attributes every question has are kept in slots; __dict__ is only
+    # created for questions that set other attributes.
+    __slots__ = (
+        "id",
+        "question",
+        "question_type",
+        "files",
+        "answers",
+        "hints",
+        "raw_data",
+        "source_id",
+        "source_url",
+        "randomize",
+        "_processed",
+        "__dict__",
+        "__weakref__",
+    )
+
     def __init__(
         self,
         id,
@@ -72,6 +91,7 @@ class BaseQuestion:
         self.source_id = id
         self.source_url = source_url
         self.randomize = randomize
+        self._processed = False
         self.id = uuid.uuid5(uuid.NAMESPACE_DNS, id)
 
     @property
@@ -261,6 +281,8 @@ class PerseusQuestion(BaseQuestion):
         images (dict): maps image string to replace to path to image `{key: str, ...}`
     """
 
+    __slots__ = ("ka_language",)
+
     def __init__(self, id, raw_data, ka_language, source_url=None, **kwargs):
         raw_data = raw_data if isinstance(raw_data, str) else json.dumps(raw_data)
         self.ka_language = ka_language
@@ -293,7 +315,7 @@ class PerseusQuestion(BaseQuestion):
             super(PerseusQuestion, self).validate()
         except AssertionError:
             raise InvalidQuestionException(
-                "Invalid question: {0}".format(self.__dict__)
+                "Invalid question: {0}".format(get_attributes(self))
             )
 
     def _replace_image(self, match):
@@ -411,7 +433,7 @@ class MultipleSelectQuestion(BaseQuestion):
             super(MultipleSelectQuestion, self).validate()
         except AssertionError:
             raise InvalidQuestionException(
-                "Invalid question: {0}".format(self.__dict__)
+                "Invalid question: {0}".format(get_attributes(self))
             )
 
 
@@ -477,7 +499,7 @@ class SingleSelectQuestion(BaseQuestion):
             super(SingleSelectQuestion, self).validate()
         except AssertionError:
             raise InvalidQuestionException(
-                "Invalid question: {0}".format(self.__dict__)
+                "Invalid question: {0}".format(get_attributes(self))
             )
 
 
@@ -534,5 +556,5 @@ class InputQuestion(BaseQuestion):
             super(InputQuestion, self).validate()
         except AssertionError:
             raise InvalidQuestionException(
-                "Invalid question: {0}".format(self.__dict__)
+                "Invalid question: {0}".format(get_attributes(self))
             )
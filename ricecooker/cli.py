@@ -0,0 +1,65 @@
+"""
+Command line interface of ricecooker's maintenance commands, installed as the
+``ricecooker`` console script:
+
+    ricecooker storage gc [--budget SIZE] [--tree PATH] [--dry-run]
+
+Each group of commands is a subparser; each command sets ``func`` to the
+function that runs it with the parsed arguments.
+"""
+
+import argparse
+
+from ricecooker import config
+from ricecooker.utils.storage_gc import collect_storage_garbage
+from ricecooker.utils.storage_gc import get_latest_tree_archive
+from ricecooker.utils.storage_gc import parse_size
+
+
+def storage_gc(parser, args):
+    tree_paths = args.tree
+    if not tree_paths:
+        latest = get_latest_tree_archive()
+        if latest is None:
+            parser.error(
+                "no tree archive found in {}; run the chef first or use --tree".format(
+                    config.DATA_PATH
+                )
+            )
+        tree_paths = [latest]
+    collect_storage_garbage(tree_paths, budget=args.budget, dry_run=args.dry_run)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog="ricecooker")
+    groups = parser.add_subparsers(title="commands", dest="group", required=True)
+
+    storage = groups.add_parser("storage", help="Manage the storage/ directory.")
+    storage_commands = storage.add_subparsers(dest="command", required=True)
+    gc = storage_commands.add_parser(
+        "gc", help="Remove the files in storage/ the last run's tree does not use."
+    )
+    gc.add_argument(
+        "--budget",
+        type=parse_size,
+        default=None,
+        help="Size storage/ may use, e.g. 50G (default: RICECOOKER_STORAGE_BUDGET, or no limit)",
+    )
+    gc.add_argument(
+        "--tree",
+        action="append",
+        default=[],
+        help="Tree archive whose files must be kept (default: the last run's, from chefdata/)",
+    )
+    gc.add_argument(
+        "--dry-run", action="store_true", help="Only report what would be removed."
+    )
+    gc.set_defaults(func=storage_gc)
+    return parser
+
+
+def main(argv=None):
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    config.setup_logging()
+    args.func(parser, args)
@@ -1,4 +1,3 @@
-import json
 import random
 import sys
 import webbrowser
@@ -10,7 +9,10 @@ from . import __version__
 from . import config
 from .classes.nodes import ChannelNode
 from .managers.tree import ChannelManager
+from .utils import studio_api
+from .utils.run_report import start_run_report
 from .utils.slack import send_slack_notification
+from .utils.storage_gc import collect_storage_garbage
 
 
 def uploadchannel_wrapper(chef, args, options):
@@ -36,6 +38,15 @@ def uploadchannel(  # noqa: C901
     publish=False,
     compress=False,
     stage=False,
+    stream_uploads=False,
+    recheck_remote=False,
+    resume=False,
+    incremental=False,
+    download_workers=None,
+    convert_workers=None,
+    metadata_workers=None,
+    gc_storage=False,
+    revalidate=False,
     **kwargs,
 ):
     """uploadchannel: Upload channel to Kolibri Studio
@@ -50,6 +61,15 @@ def uploadchannel(  # noqa: C901
         publish (bool): indicates whether to automatically publish channel (optional)
         compress (bool): indicates whether to compress larger files (optional)
         stage (bool): indicates whether to stage rather than deploy channel (optional)
+        stream_uploads (bool): indicates whether to upload files while the tree is being processed (optional)
+        recheck_remote (bool): indicates whether to ignore the local index of files already on Studio (optional)
+        resume (bool): indicates whether to continue creating the tree of the last interrupted run (optional)
+        incremental (bool): indicates whether to skip processing nodes unchanged since the last run (optional)
+        download_workers (int): number of files to download at the same time (optional)
+        convert_workers (int): number of files to convert at the same time (optional)
+        metadata_workers (int): number of files to extract metadata from at the same time (optional)
+        gc_storage (bool): indicates whether to remove the files in storage the channel does not use once it is created on Studio (optional)
+        revalidate (bool): indicates whether to check with the source servers that cached downloads are up to date (optional)
         kwargs (dict): extra keyword args will be passed to construct_channel (optional)
     Returns: (str) link to access newly created channel
     """
@@ -61,14 +81,21 @@ def uploadchannel(  # noqa: C901
     config.STAGE = stage
     config.PUBLISH = publish
     config.FILE_PIPELINE = chef.file_pipeline
-
-    # Set max retries for downloading
-    config.DOWNLOAD_SESSION.mount(
-        "http://", requests.adapters.HTTPAdapter(max_retries=int(download_attempts))
-    )
-    config.DOWNLOAD_SESSION.mount(
-        "https://", requests.adapters.HTTPAdapter(max_retries=int(download_attempts))
+    config.RECHECK_REMOTE = recheck_remote
+    config.REVALIDATE = revalidate
+    config.DOWNLOAD_WORKERS = download_workers or config.DOWNLOAD_WORKERS
+    config.CONVERT_WORKERS = convert_workers or config.CONVERT_WORKERS
+    config.METADATA_WORKERS = metadata_workers or config.METADATA_WORKERS
+    report = start_run_report()
+    # One pooled connection to Studio for each worker thread
+    config.SESSION.configure_pool(max(config.TASK_THREADS, config.ADD_NODES_THREADS))
+
+    # Set max retries for downloading, with a pooled connection for each download worker
+    download_adapter = requests.adapters.HTTPAdapter(
+        max_retries=int(download_attempts), pool_maxsize=config.DOWNLOAD_WORKERS
     )
+    config.DOWNLOAD_SESSION.mount("http://", download_adapter)
+    config.DOWNLOAD_SESSION.mount("https://", download_adapter)
 
     config.DOWNLOAD_SESSION.auth = chef.auth
 
@@ -94,7 +121,8 @@ def uploadchannel(  # noqa: C901
 
     # Construct channel
     config.LOGGER.info("Calling construct_channel... ")
-    channel = chef.construct_channel(**kwargs)
+    with report.phase("construct_channel"):
+        channel = chef.construct_channel(**kwargs)
     if "sample" in kwargs and kwargs["sample"]:
         channel = select_sample_nodes(channel, size=kwargs["sample"])
 
@@ -105,37 +133,64 @@ def uploadchannel(  # noqa: C901
     # This will fail fast if the user lacks edit permissions
     # Fixes issues #95 and #434 by avoiding wasted downloads/uploads
     if command != "dryrun":
-        config.LOGGER.info("Checking channel permissions...")
-        try:
-            tree.root_id, tree.channel_id = tree.add_channel()
-        except Exception:
-            sys.exit(1)
+        # Record created nodes so that an interrupted run can be resumed
+        tree.start_journal(resume=resume)
+        # A resumed run keeps adding to the Studio tree of the interrupted run
+        if tree.root_id is None:
+            config.LOGGER.info("Checking channel permissions...")
+            try:
+                tree.root_id, tree.channel_id = tree.add_channel()
+            except Exception:
+                sys.exit(1)
+
+    # Upload files as soon as they are processed instead of after all downloads
+    stream_uploads = stream_uploads and command != "dryrun"
+    if stream_uploads:
+        tree.start_upload_stream()
+
+    # Reuse the processed files of nodes that did not change since the last run,
+    # unless --update asks for every file to be regenerated
+    if incremental and config.UPDATE:
+        config.LOGGER.info("--update is set, processing every node")
+    elif incremental:
+        tree.start_incremental(chef.CHEF_RUN_DATA["tree_archives"]["current"])
 
     # Download files
     config.LOGGER.info("")
     config.LOGGER.info("Downloading files...")
-    files_to_diff = process_tree_files(tree)
+    with report.phase("process_tree_files"):
+        files_to_diff = process_tree_files(tree)
 
     # Apply any modifications to chef
     chef.apply_modifications(channel, metadata_dict)
     # Save the data about the current run in chefdata/
     chef.save_channel_tree_as_json(channel)
+    tree.save_input_fingerprints(chef.CHEF_RUN_DATA["tree_archives"]["current"])
 
     chef.save_channel_metadata_as_csv(channel)
 
     if command == "dryrun":
         config.LOGGER.info("Command is dryrun so we are not uploading channel.")
+        save_run_report(report)
         return
 
-    # Get file diff
-    config.LOGGER.info("")
-    config.LOGGER.info("Getting file diff...")
-    file_diff = get_file_diff(tree, files_to_diff)
+    if stream_uploads:
+        # Files were diffed and uploaded while processing; create_tree waits
+        # for any uploads still in flight.
+        config.LOGGER.info("")
+        config.LOGGER.info("Files are being uploaded in the background...")
+    else:
+        # Get file diff
+        config.LOGGER.info("")
+        config.LOGGER.info("Getting file diff...")
+        with report.phase("get_file_diff"):
+            file_diff = get_file_diff(tree, files_to_diff)
 
-    # Upload files
-    config.LOGGER.info("")
-    config.LOGGER.info("Uploading files...")
-    upload_files(tree, file_diff)
+        # Upload files
+        config.LOGGER.info("")
+        config.LOGGER.info("Uploading files...")
+        with report.phase("upload_files"):
+            upload_files(tree, file_diff)
 
     # Create channel on Kolibri Studio
     config.LOGGER.info("")
@@ -148,6 +203,18 @@ def uploadchannel(  # noqa: C901
         config.LOGGER.info("Publishing channel...")
         publish_tree(tree, channel_id)
 
+    # Only once the files are on Studio and the tree is committed
+    if gc_storage:
+        config.LOGGER.info("")
+        config.LOGGER.info("Removing unused files from storage...")
+        result = collect_storage_garbage(
+            [chef.CHEF_RUN_DATA["tree_archives"]["current"]]
+        )
+        report.count("storage_files_removed", result.files_removed)
+        report.count("storage_bytes_freed", result.bytes_freed)
+
+    save_run_report(report)
+
     # Open link on web browser (if specified) and return new link
     config.LOGGER.info("\n\nDONE: Channel created at {0}\n".format(channel_link))
     if prompt and prompt_yes_or_no("Would you like to open your channel now?"):
@@ -160,6 +227,20 @@ def uploadchannel(  # noqa: C901
     return channel_link
 
 
+def save_run_report(report):
+    """save_run_report: write the timing and throughput report of the run to chefdata/
+    Args:
+        report (RunReport): report of the current run
+    Returns: None
+    """
+    try:
+        path = report.save()
+    except OSError as e:
+        config.LOGGER.warning("Could not save run report: {}".format(e))
+        return
+    config.LOGGER.info("Run report saved to {}".format(path))
+
+
 def authenticate_user(token):
     """
     This function adds the studio Authorization `token` header to `config.SESSION`
@@ -174,7 +255,7 @@ def authenticate_user(token):
     try:
         response = config.SESSION.post(auth_endpoint)
         response.raise_for_status()
-        user = json.loads(response._content.decode("utf-8"))
+        user = studio_api.loads_response(response)
         return user["username"], token
     except HTTPError:
         config.LOGGER.error("Studio token rejected by server " + auth_endpoint)
@@ -182,11 +263,9 @@ def authenticate_user(token):
 
 
 def check_version_number():
-    response = config.SESSION.post(
-        config.check_version_url(), data=json.dumps({"version": __version__})
-    )
+    response = studio_api.post(config.check_version_url(), {"version": __version__})
     response.raise_for_status()
-    result = json.loads(response._content.decode("utf-8"))
+    result = studio_api.loads_response(response)
 
     if result["status"] == 0:
         config.LOGGER.info(result["message"])
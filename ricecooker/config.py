@@ -16,8 +16,11 @@ from requests_file import FileAdapter
 from urllib3.util.retry import Retry
 
 from .exceptions import FileNotFoundException
+from .utils.studio_client import StudioSession
 
 UPDATE = False
+# When set (--revalidate), ask the source servers whether cached downloads changed
+REVALIDATE = False
 VIDEO_HEIGHT = None
 THUMBNAILS = False
 PUBLISH = False
@@ -168,6 +171,103 @@ try:
 except (ValueError, TypeError):
     TASK_THREADS = 5
 
+# Maximum number of concurrent add_nodes requests when creating the tree on Studio
+try:
+    ADD_NODES_THREADS = int(os.environ.get("ADD_NODES_THREADS"))
+except (ValueError, TypeError):
+    ADD_NODES_THREADS = TASK_THREADS
+
+# Size of the worker pools the stages of the file pipeline run on (see
+# ricecooker.utils.pipeline.workers). Downloads wait on the network, so there
+# are more of them than CPUs; conversions (ffmpeg, Pillow, zip) and metadata
+# extraction use the CPU, so there is about one per CPU.
+CPU_COUNT = os.cpu_count() or 1
+try:
+    DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS"))
+except (ValueError, TypeError):
+    DOWNLOAD_WORKERS = min(32, CPU_COUNT * 4)
+try:
+    CONVERT_WORKERS = int(os.environ.get("CONVERT_WORKERS"))
+except (ValueError, TypeError):
+    CONVERT_WORKERS = CPU_COUNT
+try:
+    METADATA_WORKERS = int(os.environ.get("METADATA_WORKERS"))
+except (ValueError, TypeError):
+    METADATA_WORKERS = CPU_COUNT
+
+# Number of worker processes running the CPU-bound handlers of the file
+# pipeline (handlers with CPU_BOUND = True), 0 to run them in threads. Off by
+# default: the worker processes only get the settings in
+# pipeline.workers.PROCESS_SETTINGS, not other config set by the chef at runtime
+try:
+    PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS"))
+except (ValueError, TypeError):
+    PROCESS_WORKERS = 0
+
+# Initial size (in bytes of serialized nodes) of add_nodes requests. The size
+# is then adapted to Studio's response times, see managers.tree.ChunkSizer.
+try:
+    ADD_NODES_CHUNK_BYTES = int(os.environ.get("ADD_NODES_CHUNK_BYTES"))
+except (ValueError, TypeError):
+    ADD_NODES_CHUNK_BYTES = 256 * 1024
+
+# Studio API request bodies of at least this many bytes are gzip-compressed
+# (0 disables compression, see ricecooker.utils.studio_api)
+try:
+    STUDIO_GZIP_THRESHOLD = int(os.environ.get("STUDIO_GZIP_THRESHOLD"))
+except (ValueError, TypeError):
+    STUDIO_GZIP_THRESHOLD = 64 * 1024
+STUDIO_GZIP_LEVEL = 6
+
+# Serialize Studio API payloads with orjson when it is installed
+STUDIO_USE_ORJSON = True
+
+# Maximum number of processed files waiting for upload when streaming uploads
+# (--stream-uploads). Node processing blocks while the queue is full.
+try:
+    UPLOAD_QUEUE_SIZE = int(os.environ.get("UPLOAD_QUEUE_SIZE"))
+except (ValueError, TypeError):
+    UPLOAD_QUEUE_SIZE = 100
+
+# Use resumable upload sessions even when Studio's upload_url response does not
+# say its storage supports them (see ricecooker.utils.resumable_upload)
+RESUMABLE_UPLOADS = os.environ.get("RESUMABLE_UPLOADS", "").lower() in ("1", "true")
+
+# Files of at least this many bytes are uploaded in parts through a resumable
+# upload session (see ricecooker.utils.resumable_upload)
+try:
+    RESUMABLE_UPLOAD_THRESHOLD = int(os.environ.get("RESUMABLE_UPLOAD_THRESHOLD"))
+except (ValueError, TypeError):
+    RESUMABLE_UPLOAD_THRESHOLD = 64 * 1024 * 1024
+
+# Size of each part of a resumable upload (a multiple of 256KB)
+try:
+    RESUMABLE_UPLOAD_CHUNK_SIZE = int(os.environ.get("RESUMABLE_UPLOAD_CHUNK_SIZE"))
+except (ValueError, TypeError):
+    RESUMABLE_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Attempts per part of a resumable upload, waiting RESUMABLE_UPLOAD_BACKOFF
+# seconds after the first failure and doubling the wait after each one
+RESUMABLE_UPLOAD_ATTEMPTS = 5
+RESUMABLE_UPLOAD_BACKOFF = 1
+
+# Order in which upload_files sends files: "largest-first", or "mixed" to send
+# small files smallest first next to the large ones (see UploadScheduler)
+UPLOAD_ORDER = os.environ.get("UPLOAD_ORDER", "largest-first")
+
+# Maximum number of files of at least RESUMABLE_UPLOAD_THRESHOLD bytes
+# uploaded at the same time
+try:
+    MAX_LARGE_UPLOADS = int(os.environ.get("MAX_LARGE_UPLOADS"))
+except (ValueError, TypeError):
+    MAX_LARGE_UPLOADS = 2
+
+# Optional limit of the upload rate of the whole chef, in bytes per second
+try:
+    UPLOAD_BANDWIDTH_LIMIT = int(os.environ.get("UPLOAD_BANDWIDTH_LIMIT"))
+except (ValueError, TypeError):
+    UPLOAD_BANDWIDTH_LIMIT = None
+
 CURRENT_CWD = os.getcwd()
 
 # URL for authenticating user on Kolibri Studio
@@ -202,14 +302,65 @@ STORAGE_DIRECTORY = os.getenv(
     "RICECOOKER_STORAGE", os.path.join(CURRENT_CWD, "storage")
 )
 
-# Session for communicating to Kolibri Studio
-SESSION = requests.Session()
+# Size in bytes storage/ may use after garbage collection (`ricecooker storage gc`
+# or --gc-storage): processed files the last run's tree does not use are removed,
+# least recently used first, until it fits. 0 keeps all the cached files.
+try:
+    STORAGE_BUDGET = int(os.environ.get("RICECOOKER_STORAGE_BUDGET"))
+except (ValueError, TypeError):
+    STORAGE_BUDGET = 0
+
+# Session for communicating to Kolibri Studio, with a connection pool for
+# every worker thread, retries and adaptive concurrency (see StudioSession)
+SESSION = StudioSession(pool_size=max(TASK_THREADS, ADD_NODES_THREADS))
 
 # Cache for filenames
 FILECACHE_DIRECTORY = os.getenv(
     "RICECOOKER_FILECACHE", os.path.join(CURRENT_CWD, ".ricecookerfilecache")
 )
 
+# Backend of the file cache: "sqlite" (a single database in FILECACHE_DIRECTORY)
+# or "file" (one file per entry, as cachecontrol's FileCache stores them)
+FILECACHE_BACKEND = os.getenv("RICECOOKER_FILECACHE_BACKEND", "sqlite")
+
+# Index of files already confirmed to exist on Studio, so unchanged re-runs
+# can skip the HEAD request per file (see ricecooker.utils.remote_index)
+REMOTE_INDEX_PATH = os.getenv(
+    "RICECOOKER_REMOTE_INDEX",
+    os.path.join(
+        os.path.dirname(os.path.abspath(FILECACHE_DIRECTORY)),
+        ".ricecookerremoteindex.sqlite3",
+    ),
+)
+
+# MD5 hashes of files by path and stat, so that checking a cached file does not
+# read it again while it is unchanged (see ricecooker.utils.hash_memo)
+HASH_MEMO_PATH = os.getenv(
+    "RICECOOKER_HASH_MEMO",
+    os.path.join(
+        os.path.dirname(os.path.abspath(FILECACHE_DIRECTORY)),
+        ".ricecookerhashes.sqlite3",
+    ),
+)
+
+# Seconds a remote confirmation stays valid before the file is checked again
+try:
+    REMOTE_INDEX_TTL = int(os.environ.get("RICECOOKER_REMOTE_INDEX_TTL"))
+except (ValueError, TypeError):
+    REMOTE_INDEX_TTL = 7 * 24 * 60 * 60
+
+# When set (--recheck-remote), ignore the remote index and ask Studio again
+RECHECK_REMOTE = False
+
+# Progress of partial resumable uploads, so a restarted chef continues them
+UPLOAD_SESSIONS_DIRECTORY = os.getenv(
+    "RICECOOKER_UPLOAD_SESSIONS",
+    os.path.join(
+        os.path.dirname(os.path.abspath(FILECACHE_DIRECTORY)),
+        ".ricecookeruploadsessions",
+    ),
+)
+
 FAILED_FILES = []
 
 # Session for downloading files. Retry transient failures (connection resets,
@@ -228,6 +379,18 @@ DOWNLOAD_SESSION.mount("http://", HTTPAdapter(max_retries=_download_retry))
 DOWNLOAD_SESSION.mount("https://", HTTPAdapter(max_retries=_download_retry))
 DOWNLOAD_SESSION.mount("file://", FileAdapter())
 
+# Limits of the downloads from each host that no pattern of
+# SushiChef.DOWNLOAD_HOST_LIMITS matches (see ricecooker.utils.host_limits):
+# downloads at the same time and requests per second, 0 for no limit
+try:
+    DOWNLOAD_HOST_CONCURRENCY = int(os.environ.get("DOWNLOAD_HOST_CONCURRENCY"))
+except (ValueError, TypeError):
+    DOWNLOAD_HOST_CONCURRENCY = 0
+try:
+    DOWNLOAD_HOST_RATE = float(os.environ.get("DOWNLOAD_HOST_RATE"))
+except (ValueError, TypeError):
+    DOWNLOAD_HOST_RATE = 0
+
 # Environment variable indicating we should use a proxy for yt_dlp downloads
 USEPROXY = False
 USEPROXY = (
@@ -310,6 +473,14 @@ CHEF_DATA_DEFAULT = {
     "tree_archives": {"previous": None, "current": None},
 }
 TREES_DATA_DIR = os.path.join(DATA_DIR, "trees")
+# Checkpoints of the nodes created on Studio, used by --resume
+TREE_JOURNAL_DIR = os.path.join(DATA_DIR, "journals")
+# Timing and throughput report of each run (see ricecooker.utils.run_report)
+RUN_REPORTS_DIR = os.path.join(DATA_DIR, "reports")
+# Number of slowest files and nodes listed in the run report
+RUN_REPORT_SLOWEST = 20
+# Optional path of a Prometheus textfile to also write the run report to
+PROMETHEUS_TEXTFILE = os.getenv("RICECOOKER_PROMETHEUS_TEXTFILE")
 
 
 # Character limits based on Kolibri models
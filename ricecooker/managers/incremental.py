@@ -0,0 +1,182 @@
+"""
+Incremental rebuilds: skip processing the nodes that did not change since the
+previous run (--incremental).
+
+Before a node is processed, ChannelManager takes a fingerprint of what the
+processing depends on: the node's kind and source metadata and the inputs of
+its files (paths, presets, languages, conversion settings, and the size and
+modification time of local files), and the default context of the file pipeline
+(the --compress settings). The fingerprints are saved next to the tree
+archive of the run, as ``chefdata/trees/<run>.inputs.json``, along with the
+storage filename produced for each file of the node. On the next incremental
+run, a node whose fingerprint is unchanged gets the files recorded in the
+previous run's tree archive instead of going through the file pipeline, as long
+as those files are still in storage. Files are matched by their class, preset,
+language and path, not by their position in the node.
+"""
+
+import hashlib
+import json
+import os
+
+from .. import config
+from ..classes.files import get_attributes
+from ..classes.nodes import ContentNode
+from ..utils.storage import get_storage_metadata
+
+# Fields of the file dicts in the tree archive that processing fills in
+REUSED_FILE_FIELDS = ("filename", "preset", "original_filename", "language", "duration")
+
+
+def fingerprints_path(tree_path):
+    """Return the path of the fingerprints saved for the tree archive `tree_path`."""
+    return os.path.splitext(tree_path)[0] + ".inputs.json"
+
+
+def _file_inputs(file_obj):
+    inputs = {"class": type(file_obj).__name__}
+    inputs.update(get_attributes(file_obj, exclude=("node",)))
+    path = inputs.get("path")
+    if isinstance(path, str) and os.path.isfile(path):
+        # Local files can be edited in place without changing their path
+        stat = os.stat(path)
+        inputs["stat"] = [stat.st_size, stat.st_mtime_ns]
+    return inputs
+
+
+def file_identity(file_obj):
+    """Return what tells the files of a node apart across runs: class, preset, language and path."""
+    return [
+        type(file_obj).__name__,
+        file_obj.preset or file_obj.default_preset,
+        file_obj.language,
+        getattr(file_obj, "path", None),
+    ]
+
+
+def node_inputs(fingerprint, identities, node):
+    """
+    Return the entry saved for a processed node: its `fingerprint`, and the
+    filename produced for each of its files, by file identity (`identities`,
+    taken before processing, as file_identity may change during it).
+    """
+    return {
+        "fingerprint": fingerprint,
+        "files": [
+            [identity, file_obj.filename]
+            for identity, file_obj in zip(identities, node.files)
+        ],
+    }
+
+
+def node_fingerprint(node):
+    """
+    Return a hash of everything processing `node` depends on, or None if the
+    node cannot be skipped because its files are only created while it is
+    processed (nodes with a uri or with questions).
+    """
+    if getattr(node, "uri", None) or node._questions:
+        return None
+    pipeline = getattr(node, "pipeline", None)
+    inputs = {
+        "class": type(node).__name__,
+        "source_id": node.source_id,
+        "title": node.title,
+        "description": node.description,
+        "language": node.language,
+        "license": node.license.as_dict() if node.license else None,
+        "derive_thumbnail": node.derive_thumbnail,
+        "thumbnails": config.THUMBNAILS,
+        # Compression settings of --compress
+        "pipeline_context": pipeline.default_context if pipeline else None,
+        "files": [_file_inputs(f) for f in node.files],
+    }
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def save_fingerprints(tree_path, fingerprints):
+    """Save `fingerprints` (dict of node_id -> node_inputs) for the tree archive `tree_path`."""
+    path = fingerprints_path(tree_path)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fingerprints_file:
+        json.dump(fingerprints, fingerprints_file)
+    os.replace(tmp_path, path)
+
+
+class PreviousTree(object):
+    """
+    The tree archive and fingerprints of the previous run, used to reuse the
+    processed files of unchanged nodes.
+    """
+
+    def __init__(self, tree_path):
+        """
+        Args:
+            tree_path (str): path of the previous run's tree archive
+        Raises OSError or ValueError if the archive or its fingerprints cannot be read.
+        """
+        with open(fingerprints_path(tree_path)) as fingerprints_file:
+            self.fingerprints = json.load(fingerprints_file)
+        with open(tree_path) as tree_file:
+            tree = json.load(tree_file)
+        self.files = {}  # node_id -> file dicts recorded for the node
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            # The channel's id is its node_id
+            node_id = node.get("node_id") or node.get("id")
+            if node_id:
+                self.files[node_id] = node.get("files") or []
+            stack.extend(node.get("children", []))
+
+    @classmethod
+    def load(cls, tree_path):
+        """Return the PreviousTree of `tree_path`, or None if it cannot be used."""
+        if not tree_path:
+            return None
+        try:
+            return cls(tree_path)
+        except (OSError, ValueError):
+            return None
+
+    def reuse(self, node, fingerprint):
+        """
+        Give `node` the files recorded for it in the previous run if its
+        `fingerprint` is unchanged and all of them are still in storage.
+        Returns: True if the node was brought up to date without processing it
+        """
+        if fingerprint is None:
+            return False
+        node_id = node.get_node_id().hex
+        previous = self.fingerprints.get(node_id)
+        if not isinstance(previous, dict) or previous["fingerprint"] != fingerprint:
+            return False
+        recorded_files = {
+            recorded["filename"]: recorded
+            for recorded in self.files.get(node_id) or []
+            if recorded and recorded.get("filename")
+        }
+        filenames = {
+            tuple(identity): filename for identity, filename in previous["files"]
+        }
+        identities = [tuple(file_identity(file_obj)) for file_obj in node.files]
+        if (
+            len(set(identities)) != len(identities)
+            or set(identities) != set(filenames)
+            or len(recorded_files) != len(node.files)
+        ):
+            return False
+        matched = [recorded_files.get(filenames[identity]) for identity in identities]
+        if not all(
+            recorded and get_storage_metadata(recorded["filename"]) is not None
+            for recorded in matched
+        ):
+            return False
+        for file_obj, recorded in zip(node.files, matched):
+            for field in REUSED_FILE_FIELDS:
+                setattr(file_obj, field, recorded.get(field))
+        if isinstance(node, ContentNode):
+            node._files_processed = True
+            node.validate()
+        return True
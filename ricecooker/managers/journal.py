@@ -0,0 +1,112 @@
+"""
+Checkpoint journal of the nodes created on Studio by ChannelManager.upload_tree.
+
+Every confirmed ``node_id -> Studio root_id`` mapping returned by add_nodes is
+appended to ``chefdata/journals/<channel_id>/<run_id>.jsonl`` as soon as the
+response arrives, so a run that dies halfway through creating the tree can be
+resumed (--resume) without sending the nodes that already exist again.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+
+from .. import config
+
+
+class TreeJournal(object):
+    """
+    Append-only log of one tree creation run. Each line is a JSON object that is
+    one of ``{"root": <root_id>}`` (the staging tree the nodes are added to),
+    ``{"node_id": <node_id>, "root_id": <root_id>}`` (a node created on Studio),
+    or ``{"complete": true}`` (the channel was committed).
+    """
+
+    def __init__(self, channel_id, run_id=None, directory=None):
+        """
+        Args:
+            channel_id (str): id of the channel on Studio
+            run_id (str): id of the run (default: a new timestamp-based id)
+            directory (str): where journals are kept (default config.TREE_JOURNAL_DIR)
+        """
+        self.channel_id = channel_id
+        self.run_id = run_id or datetime.now().strftime("%Y-%m-%d__%H%M%S")
+        directory = directory or config.TREE_JOURNAL_DIR
+        self.path = os.path.join(directory, channel_id, self.run_id + ".jsonl")
+        self.root_id = None
+        self.root_ids = {}
+        self.complete = False
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # last line was cut short when the run died
+                if "root" in entry:
+                    self.root_id = entry["root"]
+                elif entry.get("complete"):
+                    self.complete = True
+                else:
+                    self.root_ids[entry["node_id"]] = entry["root_id"]
+
+    def _append(self, entries):
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "a") as journal_file:
+                journal_file.write(lines)
+                journal_file.flush()
+
+    def start(self, root_id):
+        """Record the id of the Studio tree that nodes are being added to."""
+        self.root_id = root_id
+        self._append([{"root": root_id}])
+
+    def record(self, root_ids):
+        """Record the `root_ids` (dict of node_id -> Studio id) of created nodes."""
+        if not root_ids:
+            return
+        self.root_ids.update(root_ids)
+        self._append(
+            [
+                {"node_id": node_id, "root_id": root_id}
+                for node_id, root_id in root_ids.items()
+            ]
+        )
+
+    def finish(self):
+        """Mark the run as complete so it will not be resumed."""
+        self.complete = True
+        self._append([{"complete": True}])
+
+    def get_root_id(self, node_id):
+        """Return the Studio id of `node_id` if it was created in this run."""
+        return self.root_ids.get(node_id)
+
+    @classmethod
+    def latest(cls, channel_id, directory=None):
+        """
+        Return the journal of the most recent run for `channel_id` that started
+        creating the tree but did not finish, or None if there is none.
+        """
+        directory = directory or config.TREE_JOURNAL_DIR
+        channel_dir = os.path.join(directory, channel_id)
+        if not os.path.isdir(channel_dir):
+            return None
+        run_ids = sorted(
+            filename[: -len(".jsonl")]
+            for filename in os.listdir(channel_dir)
+            if filename.endswith(".jsonl")
+        )
+        if not run_ids:
+            return None
+        journal = cls(channel_id, run_id=run_ids[-1], directory=directory)
+        if journal.complete or journal.root_id is None:
+            return None
+        return journal
@@ -0,0 +1,84 @@
+"""
+Dependency-aware scheduling of the tasks that process a channel tree.
+
+A TaskGraph holds tasks and the tasks each of them depends on, and runs them on
+a thread pool: a task is started as soon as all its dependencies finished, so
+independent tasks run in parallel while, for example, a topic's tiled thumbnail
+is only generated once the thumbnails of its descendants exist.
+"""
+
+import collections
+import concurrent.futures
+
+
+class TaskGraph(object):
+    """
+    Tasks to run on a thread pool, each after the tasks it depends on.
+    Tasks can only depend on tasks added before them, so the graph has no cycles.
+    """
+
+    def __init__(self):
+        self._tasks = {}  # key -> (function, args)
+        self._dependents = collections.defaultdict(list)  # key -> keys waiting on it
+        self._waiting_on = {}  # key -> number of unfinished dependencies
+
+    def __contains__(self, key):
+        return key in self._tasks
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def add(self, key, function, *args, depends_on=()):
+        """
+        Add the task `key` that calls `function(*args)`.
+        Args:
+            key (hashable): unique name of the task
+            function (callable): work of the task
+            depends_on (iterable): keys of tasks that must finish before this one starts
+        Returns: None
+        """
+        if key in self._tasks:
+            raise ValueError("Task {} was already added".format(key))
+        dependencies = set(depends_on)
+        for dependency in dependencies:
+            if dependency not in self._tasks:
+                raise ValueError(
+                    "Task {} depends on unknown task {}".format(key, dependency)
+                )
+            self._dependents[dependency].append(key)
+        self._tasks[key] = (function, args)
+        self._waiting_on[key] = len(dependencies)
+
+    def run(self, max_workers):
+        """
+        Run every task on `max_workers` threads, each as soon as its
+        dependencies finished, yielding `(key, result)` as tasks finish.
+        If a task raises, no more tasks are started and the exception is
+        raised once the tasks already running have finished.
+        """
+        waiting_on = dict(self._waiting_on)
+        ready = collections.deque(key for key, count in waiting_on.items() if not count)
+        # A few more tasks than workers are submitted, so workers never wait
+        # for this thread to hand them the next task
+        max_pending = max_workers * 2
+        running = {}  # future -> key
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while ready or running:
+                while ready and len(running) < max_pending:
+                    key = ready.popleft()
+                    function, args = self._tasks[key]
+                    running[executor.submit(function, *args)] = key
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    key = running.pop(future)
+                    if future.exception() is not None:
+                        ready.clear()
+                        concurrent.futures.wait(running)
+                        raise future.exception()
+                    for dependent in self._dependents.get(key, ()):
+                        waiting_on[dependent] -= 1
+                        if not waiting_on[dependent]:
+                            ready.append(dependent)
+                    yield key, future.result()
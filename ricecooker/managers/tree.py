@@ -1,14 +1,146 @@
 import codecs
 import concurrent.futures
-import json
 import os
+import queue
 import sys
+import threading
+import time
 
 from requests.exceptions import RequestException
 
+from ricecooker.classes.files import get_attributes
+from ricecooker.classes.nodes import ExerciseNode
+from ricecooker.classes.nodes import TreeNode
 from ricecooker.exceptions import InvalidNodeException
+from ricecooker.utils import studio_api
+from ricecooker.utils.bandwidth import throttle_upload
+from ricecooker.utils.pipeline.workers import get_pipeline_threads
+from ricecooker.utils.remote_index import confirm_remote
+from ricecooker.utils.remote_index import forget_remote
+from ricecooker.utils.remote_index import is_confirmed_remote
+from ricecooker.utils.resumable_upload import ResumableUpload
+from ricecooker.utils.resumable_upload import ResumableUploadNotSupported
+from ricecooker.utils.run_report import get_run_report
 
 from .. import config
+from .incremental import file_identity
+from .incremental import node_fingerprint
+from .incremental import node_inputs
+from .incremental import PreviousTree
+from .incremental import save_fingerprints
+from .journal import TreeJournal
+from .scheduler import TaskGraph
+
+
+class ChunkSizer(object):
+    """
+    Decides how many bytes of serialized nodes go into each add_nodes request.
+
+    The byte budget grows additively while Studio answers quickly and is halved
+    (multiplicative decrease) when a request is slow or fails with a 5xx error
+    such as a 504 gateway timeout. Topic nodes with tiny payloads are thus sent
+    in large batches, while exercises carrying hundreds of questions are sent
+    a few at a time.
+    """
+
+    MIN_BYTES = 16 * 1024
+    MAX_BYTES = 4 * 1024 * 1024
+    INCREASE_BYTES = 64 * 1024
+    MAX_CHILDREN = 100  # cap on children per request, whatever their size
+    TARGET_LATENCY = 10  # seconds
+    # Errors after which Studio has not created any of the nodes, so the chunk
+    # can be sent again in smaller chunks. add_nodes is not idempotent: after a
+    # 500 or a 504, the nodes may have been created anyway.
+    RETRY_STATUSES = (502, 503)
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or config.ADD_NODES_CHUNK_BYTES
+        self._lock = threading.Lock()
+
+    def record_success(self, latency):
+        """Adjust the budget after a successful request that took `latency` seconds."""
+        with self._lock:
+            if latency > self.TARGET_LATENCY:
+                self.max_bytes = max(self.MIN_BYTES, self.max_bytes // 2)
+            else:
+                self.max_bytes = min(
+                    self.MAX_BYTES, self.max_bytes + self.INCREASE_BYTES
+                )
+
+    def record_failure(self):
+        """Halve the budget after a request failed with a server error."""
+        with self._lock:
+            self.max_bytes = max(self.MIN_BYTES, self.max_bytes // 2)
+
+
+class UploadScheduler(object):
+    """
+    Hands out the files to upload to a pool of workers, ordered by size.
+
+    Files of at least `large_size` bytes are given out largest first, and never
+    more than `max_large` of them at once, so a few multi-GB videos cannot take
+    every worker while thousands of thumbnails wait. The other files are given
+    out largest first (``"largest-first"``) or smallest first (``"mixed"``, so
+    small files keep flowing next to the large uploads).
+    """
+
+    ORDERS = ("largest-first", "mixed")
+
+    def __init__(self, sizes, max_large=None, large_size=None, order=None):
+        """
+        Args:
+            sizes (dict): filename -> size in bytes of the files to upload
+            max_large (int): large files uploaded at once (default config.MAX_LARGE_UPLOADS)
+            large_size (int): size of large files (default config.RESUMABLE_UPLOAD_THRESHOLD)
+            order (str): one of ORDERS (default config.UPLOAD_ORDER)
+        """
+        max_large = max_large or config.MAX_LARGE_UPLOADS
+        large_size = large_size or config.RESUMABLE_UPLOAD_THRESHOLD
+        order = order or config.UPLOAD_ORDER
+        if order not in self.ORDERS:
+            raise ValueError("Unknown upload order {}".format(order))
+        # Files are popped from the end of the lists
+        by_size = sorted(sizes, key=lambda f: sizes[f])
+        self._large = [f for f in by_size if sizes[f] >= large_size]
+        self._small = [f for f in by_size if sizes[f] < large_size]
+        if order == "mixed":
+            self._small.reverse()
+        self._large_slots = max_large
+        self._in_flight = {}  # filename -> True if large
+        self._cancelled = False
+        self._condition = threading.Condition()
+
+    def next(self):
+        """Return the next file to upload, blocking while only capped large
+        files are left. Returns None when there is nothing left to upload."""
+        with self._condition:
+            while not self._cancelled:
+                if self._large and self._large_slots > 0:
+                    self._large_slots -= 1
+                    filename = self._large.pop()
+                    self._in_flight[filename] = True
+                    return filename
+                if self._small:
+                    filename = self._small.pop()
+                    self._in_flight[filename] = False
+                    return filename
+                if not self._large:
+                    return None
+                self._condition.wait()
+            return None
+
+    def done(self, filename):
+        """Mark `filename` as uploaded (or failed), freeing its slot."""
+        with self._condition:
+            if self._in_flight.pop(filename, False):
+                self._large_slots += 1
+            self._condition.notify_all()
+
+    def cancel(self):
+        """Stop handing out files, e.g. after running out of storage on Studio."""
+        with self._condition:
+            self._cancelled = True
+            self._condition.notify_all()
 
 
 class InsufficientStorageException(Exception):
@@ -33,6 +165,18 @@ class ChannelManager:
         self.all_nodes = []
         self.root_id = None  # Will be set during early permission check
         self.channel_id = None  # Will be set during early permission check
+        # Streaming upload state, see start_upload_stream
+        self._upload_queue = None
+        self._upload_workers = []
+        self._upload_error = None
+        self._streamed_files = set()
+        self._stream_lock = threading.Lock()
+        self._add_nodes_lock = threading.Lock()
+        self._chunk_sizer = ChunkSizer()
+        self._node_payloads = {}  # id(node) -> serialized node, while it is sent
+        self.journal = None  # Checkpoints of created nodes, see start_journal
+        self.previous_tree = None  # Previous run's tree, see start_incremental
+        self.input_fingerprints = {}  # node_id -> node_inputs of processed nodes
 
     def validate(self):
         """Validate every node in the tree. Raises InvalidNodeException in strict mode; returns None."""
@@ -56,19 +200,44 @@ class ChannelManager:
 
     def process_tree(self):
         """
-        Returns a list of all file names associated with a tree. Profiling suggests using a global list with `extend`
-        is faster than using a global set or deque.
+        Returns a list of all file names associated with a tree. Nodes are
+        processed in parallel, each as soon as the nodes it depends on are done
+        (see build_task_graph), while their files are downloaded and converted
+        on the pipeline's stage pools (see ricecooker.utils.pipeline.workers).
         :return: The list of unique file names in `channel_node`.
         """
         if not self.all_nodes:
             self.all_nodes = self.gather_tree_recur([], self.channel)
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=config.TASK_THREADS
-        ) as executor:
-            for data in executor.map(self.process_node, self.all_nodes):
+        graph = self.build_task_graph()
+        # The threads mostly wait for the file pipeline's stage pools
+        for (kind, _), data in graph.run(get_pipeline_threads()):
+            if kind == "node":
                 self.file_map.update(data)
+        if self.previous_tree is not None:
+            config.LOGGER.info(
+                "\tSkipped processing {} unchanged nodes".format(
+                    get_run_report().counters["nodes_skipped"]
+                )
+            )
         return list(self.file_map.keys())
 
+    def start_incremental(self, previous_tree_path):
+        """start_incremental: skip processing nodes unchanged since the previous run
+        Args:
+            previous_tree_path (str): tree archive saved by the previous run
+        Returns: None
+        """
+        self.previous_tree = PreviousTree.load(previous_tree_path)
+        if self.previous_tree is None:
+            config.LOGGER.info(
+                "\tNo usable tree from a previous run, processing every node"
+            )
+
+    def save_input_fingerprints(self, tree_path):
+        """Save the fingerprints of the processed nodes next to the tree archive `tree_path`."""
+        if tree_path:
+            save_fingerprints(tree_path, self.input_fingerprints)
+
     def deduplicate_shared_nodes(self):
         """Clone nodes reused under multiple parents so each gets a distinct node_id (issue #354).
 
@@ -79,30 +248,59 @@ class ChannelManager:
         self._deduplicate_recur(self.channel, set())
 
     def _deduplicate_recur(self, node, seen):
+        # Iterative depth-first walk; a node's children are finished before its
+        # next sibling is looked at, so `seen` grows in the same order as a
+        # recursive walk would fill it.
         seen.add(id(node))
-        local_seen = set()
-        new_children = []
-        for child in node.children:
-            if id(child) in local_seen:
-                # same-parent duplicate: leave untouched for validate() to reject
-                new_children.append(child)
-            elif id(child) in seen:
-                # cross-parent reuse: clone so this placement gets its own node_id
-                new_children.append(child.copy(parent=node))
+        stack = [(node, iter(node.children), set(), [])]
+        while stack:
+            node, children, local_seen, new_children = stack[-1]
+            for child in children:
+                if id(child) in local_seen:
+                    # same-parent duplicate: leave untouched for validate() to reject
+                    new_children.append(child)
+                elif id(child) in seen:
+                    # cross-parent reuse: clone so this placement gets its own node_id
+                    new_children.append(child.copy(parent=node))
+                else:
+                    local_seen.add(id(child))
+                    child.parent = node  # fix parent overwritten during construction
+                    new_children.append(child)
+                    seen.add(id(child))
+                    stack.append((child, iter(child.children), set(), []))
+                    break
             else:
-                local_seen.add(id(child))
-                child.parent = node  # fix parent overwritten during construction
-                new_children.append(child)
-                self._deduplicate_recur(child, seen)
-        node.children = new_children
+                node.children = new_children
+                stack.pop()
+
+    def build_task_graph(self):
+        """
+        Returns a TaskGraph processing every node of the tree, where:
+          - a node whose thumbnail is generated from other nodes (a topic's
+            tiled thumbnail) depends on those nodes,
+          - each question of an exercise is processed by its own task, and the
+            exercise depends on its questions.
+        """
+        graph = TaskGraph()
+        for node in self.all_nodes:
+            key = ("node", id(node))
+            if key in graph:
+                continue  # same node listed twice, validate() rejects it
+            depends_on = [
+                ("node", id(source)) for source in node.get_thumbnail_dependencies()
+            ]
+            if isinstance(node, ExerciseNode):
+                for question in node._questions or []:
+                    question_key = ("question", id(question))
+                    if question_key not in graph:
+                        graph.add(question_key, self.process_question, node, question)
+                        depends_on.append(question_key)
+            graph.add(key, self.process_node, node, depends_on=depends_on)
+        return graph
 
     def gather_tree_recur(self, nodes, node):
-        # Process node's children
-        for child_node in node.children:
-            self.gather_tree_recur(
-                nodes, child_node
-            )  # Defer insert until after all descendants in case a tiled thumbnail is needed
-        nodes.append(node)
+        # Each node comes after all its descendants in case a tiled thumbnail is needed
+        nodes.extend(descendant for _, descendant in node.walk(post_order=True))
         return nodes
 
     def process_node(self, node):
@@ -110,27 +308,146 @@ class ChannelManager:
         :param node: The root of the current sub-tree being processed
         :return: None.
         """
+        start = time.monotonic()
+        report = get_run_report()
         try:
-            node.process_files()
+            self._process_or_reuse(node, report)
         except (InvalidNodeException, ValueError) as e:
             if config.STRICT:
                 raise
             else:
                 node._error = str(e)
                 config.LOGGER.warning(node._error)
+        report.count("nodes_processed")
+        report.record_node(
+            "{} ({})".format(node.source_id, node.title), time.monotonic() - start
+        )
 
         output = {}
 
         for node_file in node.files:
             if node_file.get_filename():
                 output[node_file.get_filename()] = node_file
-        if hasattr(node, "questions"):
+        if node._questions:
             for question in node.questions:
                 for question_file in question.files:
                     if question_file.get_filename():
                         output[question_file.get_filename()] = question_file
+        report.count("files_processed", len(output))
+        if self._upload_queue is not None:
+            self._queue_uploads(output)
         return output
 
+    def process_question(self, node, question):
+        """Process the images of `question`, one of the questions of the exercise `node`."""
+        try:
+            node.process_question(question)
+        except (InvalidNodeException, ValueError) as e:
+            if config.STRICT:
+                raise
+            else:
+                node._error = str(e)
+                config.LOGGER.warning(node._error)
+
+    def _process_or_reuse(self, node, report):
+        """Process the files of `node`, unless the previous run's files can be reused."""
+        fingerprint = node_fingerprint(node)
+        identities = [file_identity(file_obj) for file_obj in node.files]
+        reuse = self.previous_tree is not None and not config.UPDATE
+        if reuse and self.previous_tree.reuse(node, fingerprint):
+            report.count("nodes_skipped")
+        else:
+            node.process_files()
+        if fingerprint is not None:
+            self.input_fingerprints[node.get_node_id().hex] = node_inputs(
+                fingerprint, identities, node
+            )
+
+    def start_upload_stream(self, max_pending=None):
+        """start_upload_stream: diff and upload files while the tree is still being processed
+        Once started, process_node hands every finished file to a bounded queue that
+        a pool of upload workers drains, so uploads overlap with downloads and
+        conversions. Call wait_for_uploads to block until the queue is empty.
+        Args:
+            max_pending (int): files allowed in the queue before process_node blocks (optional)
+        Returns: None
+        """
+        self._upload_queue = queue.Queue(
+            maxsize=max_pending or config.UPLOAD_QUEUE_SIZE
+        )
+        self._upload_error = None
+        self._upload_workers = [
+            threading.Thread(target=self._upload_worker, daemon=True)
+            for _ in range(config.TASK_THREADS)
+        ]
+        for worker in self._upload_workers:
+            worker.start()
+
+    def _queue_uploads(self, files):
+        for filename, file_obj in files.items():
+            if self._upload_error is not None:
+                # Stop processing the tree, nothing more can be uploaded
+                raise self._upload_error
+            with self._stream_lock:
+                self.file_map[filename] = file_obj
+                if filename in self._streamed_files:
+                    continue
+                self._streamed_files.add(filename)
+            # Blocks while the queue is full, so processing never runs too far ahead
+            self._upload_queue.put(filename)
+
+    def _upload_worker(self):
+        while True:
+            filename = self._upload_queue.get()
+            try:
+                if filename is None:
+                    return
+                if self._upload_error is None:
+                    self._stream_upload(filename)
+            finally:
+                self._upload_queue.task_done()
+
+    def _stream_upload(self, filename):
+        try:
+            if self.check_file_exists(filename):
+                return
+        except RequestException as e:
+            config.LOGGER.warning(
+                "Could not check if {} exists on Studio: {}".format(filename, e)
+            )
+        try:
+            uploaded = self._handle_upload(filename)
+        except InsufficientStorageException as e:
+            self._upload_error = e
+            return
+        if uploaded is not None:
+            config.LOGGER.info(
+                "\tUploaded {0} ({count} so far)".format(
+                    uploaded, count=len(self.uploaded_files)
+                )
+            )
+
+    def wait_for_uploads(self):
+        """wait_for_uploads: block until all streamed files have been uploaded
+        Args: None
+        Returns: None
+        """
+        if self._upload_queue is None:
+            return
+        config.LOGGER.info(
+            "   Waiting for {} file upload(s) still in flight...".format(
+                self._upload_queue.qsize()
+            )
+        )
+        for _ in self._upload_workers:
+            self._upload_queue.put(None)
+        for worker in self._upload_workers:
+            worker.join()
+        self._upload_queue = None
+        self._upload_workers = []
+        if self._upload_error is not None:
+            raise self._upload_error
+
     def check_for_files_failed(self):
         """check_for_files_failed: print any files that failed during download process
         Args: None
@@ -149,7 +466,9 @@ class ChannelManager:
                     info = "{0} {id}".format("Question", id=f.assessment_item.source_id)
                 else:  # files not associated with a node or an assessment item
                     info = f.__class__.__name__
-                file_identifier = f.__dict__
+                file_identifier = dict(
+                    get_attributes(f), filename=f.filename, source_url=f.source_url
+                )
                 if hasattr(f, "path") and f.path:
                     file_identifier = f.path
                 elif hasattr(f, "youtube_url") and f.youtube_url:
@@ -163,8 +482,16 @@ class ChannelManager:
             config.LOGGER.info("   All files were successfully downloaded")
 
     def check_file_exists(self, filename):
+        if is_confirmed_remote(filename):
+            return True
         head_response = config.DOWNLOAD_SESSION.head(config.get_storage_url(filename))
-        return head_response.status_code == 200
+        if head_response.status_code == 200:
+            size = head_response.headers.get("Content-Length")
+            confirm_remote(filename, size=int(size) if size else None)
+            return True
+        # An expired (or --recheck-remote) confirmation must not outlive the file
+        forget_remote(filename)
+        return False
 
     def get_file_diff(self, files_to_diff):
         """get_file_diff: retrieves list of files that do not exist on content curation server
@@ -212,16 +539,37 @@ class ChannelManager:
                 might_skip = response_data["might_skip"]
                 if might_skip and self.check_file_exists(filename):
                     return
+                # Studio does not have the file: forget any earlier confirmation
+                # so that a failed upload is not taken as present on the next run
+                forget_remote(filename)
                 b64checksum = (
                     codecs.encode(codecs.decode(file_data.checksum, "hex"), "base64")
                     .decode()
                     .strip()
                 )
                 headers = {"Content-Type": content_type, "Content-MD5": b64checksum}
+                resumable = response_data.get("resumable") or config.RESUMABLE_UPLOADS
+                if resumable and data["size"] >= config.RESUMABLE_UPLOAD_THRESHOLD:
+                    try:
+                        ResumableUpload(
+                            filename,
+                            storage_path,
+                            upload_url,
+                            headers={"Content-Type": content_type},
+                            size=data["size"],
+                            checksum=file_data.checksum,
+                        ).upload()
+                        self._record_upload(filename, data["size"])
+                        return
+                    except ResumableUploadNotSupported as e:
+                        config.LOGGER.debug("{}, uploading in one request".format(e))
                 response = config.SESSION.put(
-                    upload_url, headers=headers, data=file_obj
+                    upload_url,
+                    headers=headers,
+                    data=throttle_upload(file_obj, data["size"]),
                 )
                 if response.status_code == 200:
+                    self._record_upload(filename, data["size"])
                     return
                 raise RequestException(
                     "Error uploading file {}, response code: {} - {}".format(
@@ -235,6 +583,12 @@ class ChannelManager:
                     )
                 )
 
+    def _record_upload(self, filename, size):
+        confirm_remote(filename, size=size)
+        report = get_run_report()
+        report.count("files_uploaded")
+        report.count("bytes_uploaded", size)
+
     def _handle_upload(self, f):
         try:
             self.do_file_upload(f)
@@ -253,21 +607,51 @@ class ChannelManager:
             file_list (str): list of files to upload
         Returns: None
         """
-        counter = 0
-        files_to_upload = list(set(file_list) - set(self.uploaded_files))
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=config.TASK_THREADS
-        ) as executor:
-            # Start the upload operations
-            for filename in executor.map(self._handle_upload, files_to_upload):
-                if filename is not None:
-                    counter += 1
+        files_to_upload = set(file_list) - set(self.uploaded_files)
+        scheduler = UploadScheduler(
+            {filename: self._upload_size(filename) for filename in files_to_upload}
+        )
+        counter = {"uploaded": 0}
+        counter_lock = threading.Lock()
+
+        def upload_worker():
+            while True:
+                filename = scheduler.next()
+                if filename is None:
+                    return
+                try:
+                    uploaded = self._handle_upload(filename)
+                except InsufficientStorageException:
+                    scheduler.cancel()
+                    raise
+                finally:
+                    scheduler.done(filename)
+                if uploaded is not None:
+                    with counter_lock:
+                        counter["uploaded"] += 1
+                        count = counter["uploaded"]
                     config.LOGGER.info(
                         "\tUploaded {0} ({count}/{total}) ".format(
-                            filename, count=counter, total=len(files_to_upload)
+                            uploaded, count=count, total=len(files_to_upload)
                         )
                     )
 
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.TASK_THREADS
+        ) as executor:
+            workers = [
+                executor.submit(upload_worker) for _ in range(config.TASK_THREADS)
+            ]
+            for worker in workers:
+                worker.result()
+
+    def _upload_size(self, filename):
+        file_data = self.file_map.get(filename)
+        try:
+            return file_data.size or 0
+        except (AttributeError, OSError):
+            return 0
+
     def reattempt_upload_fails(self):
         """reattempt_upload_fails: uploads failed files to server
         Args: None
@@ -289,19 +673,31 @@ class ChannelManager:
         from datetime import datetime
 
         start_time = datetime.now()
+        # Files streamed during processing must be on Studio before nodes reference them
+        report = get_run_report()
+        if self._upload_queue is not None:
+            with report.phase("upload_files"):
+                self.wait_for_uploads()
+                self.reattempt_upload_fails()
         # Use cached root_id and channel_id if already set (from early permission check)
         if self.root_id is not None and self.channel_id is not None:
             root, channel_id = self.root_id, self.channel_id
         else:
             root, channel_id = self.add_channel()
+        if self.journal is not None and self.journal.root_id != root:
+            self.journal.start(root)
         self.node_count_dict = {"upload_count": 0, "total_count": self.channel.count()}
 
         config.LOGGER.info("\tPreparing fields...")
         self.truncate_fields(self.channel)
 
-        self.add_nodes(root, self.channel)
+        with report.phase("add_nodes"):
+            self.add_nodes(root, self.channel)
         self.check_failed()
-        channel_id, channel_link = self.commit_channel(channel_id)
+        with report.phase("commit"):
+            channel_id, channel_link = self.commit_channel(channel_id)
+        if self.journal is not None:
+            self.journal.finish()
         end_time = datetime.now()
         config.LOGGER.info(
             "Upload time: {time}s".format(time=(end_time - start_time).total_seconds())
@@ -309,9 +705,15 @@ class ChannelManager:
         return channel_id, channel_link
 
     def truncate_fields(self, node):
-        node.truncate_fields()
-        for child in node.children:
-            self.truncate_fields(child)
+        """
+        Truncate the fields of `node` and its descendants in one top-down pass,
+        computing each node's node_id and content_id right after its source_id
+        is final, so add_nodes finds them cached.
+        """
+        for _, descendant in node.walk():
+            descendant.truncate_fields()
+            if isinstance(descendant, TreeNode) and descendant.parent:
+                descendant.get_node_id()
 
     def check_failed(self):
         if len(self.failed_node_builds) > 0:
@@ -326,6 +728,28 @@ class ChannelManager:
         else:
             config.LOGGER.info("All nodes were created successfully.")
 
+    def start_journal(self, resume=False):
+        """start_journal: record the nodes created on Studio in a TreeJournal
+        Args:
+            resume (bool): continue the latest unfinished run for this channel, reusing
+                its Studio tree and skipping the nodes it already created (optional)
+        Returns: None
+        """
+        channel_id = self.channel.get_node_id().hex
+        journal = TreeJournal.latest(channel_id) if resume else None
+        if journal is not None:
+            config.LOGGER.info(
+                "   Resuming run {0} ({1} nodes already created)".format(
+                    journal.run_id, len(journal.root_ids)
+                )
+            )
+            self.root_id, self.channel_id = journal.root_id, channel_id
+        else:
+            if resume:
+                config.LOGGER.info("   No unfinished run to resume, starting over")
+            journal = TreeJournal(channel_id)
+        self.journal = journal
+
     def add_channel(self):
         """add_channel: sends processed channel data to server to create tree
         Args: None
@@ -334,101 +758,209 @@ class ChannelManager:
         config.LOGGER.info("   Creating channel {0}".format(self.channel.title))
         self.channel.truncate_fields()
         payload = {"channel_data": self.channel.to_dict()}
-        response = config.SESSION.post(
-            config.create_channel_url(), data=json.dumps(payload)
-        )
+        response = studio_api.post(config.create_channel_url(), payload)
         try:
             response.raise_for_status()
         except Exception:
             config.LOGGER.error("Error connecting to API: {}".format(response.text))
             raise
-        new_channel = json.loads(response._content.decode("utf-8"))
+        new_channel = studio_api.loads_response(response)
 
         return new_channel["root"], new_channel["channel_id"]
 
-    def add_nodes(self, root_id, current_node, indent=1):  # noqa: C901
+    def add_nodes(self, root_id, current_node, indent=1):
         """add_nodes: adds processed nodes to tree
+        Children are sent in chunks on a pool of config.ADD_NODES_THREADS workers.
+        A subtree is started as soon as its root exists on Studio, so independent
+        subtrees are created concurrently, while the chunks under one parent are
+        sent one after another to keep the children in order. Chunks are sized
+        by serialized bytes, see ChunkSizer.
         Args:
             root_id (str): id of parent node on Kolibri Studio
             current_node (Node): node to publish children
             indent (int): level of indentation for printing
-        Returns: link to uploadedchannel
+        Returns: None
+        """
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.ADD_NODES_THREADS
+        ) as executor:
+            pending = {
+                executor.submit(self._add_chunk, root_id, current_node, 0, indent)
+            }
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    for task in future.result():
+                        pending.add(executor.submit(self._add_chunk, *task))
+
+    def _add_chunk(  # noqa: C901
+        self, root_id, current_node, start, indent, max_children=None
+    ):
+        """
+        Send the chunk of `current_node`'s children that begins at `start`.
+        Returns the follow-up chunks to send: the first chunk of every child
+        that was created and has children of its own, and the next chunk of
+        `current_node` (if any). A chunk that fails with a 502 or 503 error is
+        retried with half as many children before it is reported as failed.
         """
         # if the current node has no children, no need to continue
         if not current_node.children:
-            return
+            return []
 
-        config.LOGGER.info(
-            "({count} of {total} uploaded) {indent}Processing {title} ({kind})".format(
-                count=self.node_count_dict["upload_count"],
-                total=self.node_count_dict["total_count"],
-                indent="   " * indent,
-                title=current_node.title,
-                kind=current_node.__class__.__name__,
+        if start == 0 and max_children is None:
+            config.LOGGER.info(
+                "({count} of {total} uploaded) {indent}Processing {title} ({kind})".format(
+                    count=self.node_count_dict["upload_count"],
+                    total=self.node_count_dict["total_count"],
+                    indent="   " * indent,
+                    title=current_node.title,
+                    kind=current_node.__class__.__name__,
+                )
             )
-        )
 
-        # Send children in chunks to avoid gateway errors
+        tasks = []
+        if self.journal is not None:
+            start = self._skip_created_children(current_node, start, indent, tasks)
+            if start >= len(current_node.children):
+                return tasks
+        chunk, payload_children = self._next_chunk(current_node, start, max_children)
+        retrying = False
         try:
-            chunks = [
-                current_node.children[x : x + 10]
-                for x in range(0, len(current_node.children), 10)
-            ]
-            for chunk in chunks:
-                payload_children = []
-
-                for child in chunk:
-                    failed = [
-                        f
-                        for f in child.files
-                        if f.is_primary
-                        and (not f.filename or self.failed_uploads.get(f.filename))
-                    ]
-                    if failed or not child.valid:
-                        node_id = child.get_node_id().hex
-                        if not self.failed_node_builds.get(node_id):
-                            error_message = ""
-                            for fail in failed:
-                                reason = (
-                                    fail.filename
-                                    + ": "
-                                    + self.failed_uploads.get(fail.filename)
-                                    if fail.filename
-                                    else "File failed to download"
-                                )
-                                error_message = error_message + reason + ", "
-                            if hasattr(child, "_error"):
-                                error_message = error_message + child._error + ", "
-                            self.failed_node_builds[node_id] = {
-                                "node": child,
-                                "error": error_message[:-2],
-                            }
-                    else:
-                        payload_children.append(child.to_dict())
-                payload = {"root_id": root_id, "content_data": payload_children}
-
-                response = config.SESSION.post(
-                    config.add_nodes_url(), data=json.dumps(payload)
+            payload = b'{"root_id": %s, "content_data": [%s]}' % (
+                studio_api.dumps(root_id),
+                b", ".join(payload_children),
+            )
+            request_start = time.monotonic()
+            response = studio_api.post(config.add_nodes_url(), payload)
+            if response.status_code in ChunkSizer.RETRY_STATUSES and len(chunk) > 1:
+                self._chunk_sizer.record_failure()
+                config.LOGGER.warning(
+                    "\tCreating {} children of {} failed ({}), retrying in smaller chunks".format(
+                        len(chunk), current_node.title, response.status_code
+                    )
                 )
-                if response.status_code != 200:
-                    self.failed_node_builds[root_id] = {
-                        "node": current_node,
-                        "error": response.reason,
-                        "content": response.content,
-                    }
-                else:
-                    response_json = json.loads(response._content.decode("utf-8"))
+                retrying = True
+                # Keep the subtrees of the children skipped from the journal
+                return tasks + [(root_id, current_node, start, indent, len(chunk) // 2)]
+            if response.status_code != 200:
+                if response.status_code >= 500:
+                    self._chunk_sizer.record_failure()
+                self.failed_node_builds[root_id] = {
+                    "node": current_node,
+                    "error": response.reason,
+                    "content": response.content,
+                }
+            else:
+                self._chunk_sizer.record_success(time.monotonic() - request_start)
+                response_json = studio_api.loads_response(response)
+                with self._add_nodes_lock:
                     self.node_count_dict["upload_count"] += len(chunk)
-
-                    if response_json["root_ids"].get(child.get_node_id().hex):
-                        for child in chunk:
-                            self.add_nodes(
-                                response_json["root_ids"].get(child.get_node_id().hex),
-                                child,
-                                indent + 1,
-                            )
+                created = {}
+                for child in chunk:
+                    node_id = child.get_node_id().hex
+                    child_root_id = response_json["root_ids"].get(node_id)
+                    if child_root_id:
+                        created[node_id] = child_root_id
+                        tasks.append((child_root_id, child, 0, indent + 1))
+                if self.journal is not None:
+                    self.journal.record(created)
         except ConnectionError as ce:
             self.failed_node_builds[root_id] = {"node": current_node, "error": ce}
+            return tasks
+        finally:
+            if not retrying:
+                for child in chunk:
+                    self._node_payloads.pop(id(child), None)
+
+        end = start + len(chunk)
+        if end < len(current_node.children):
+            tasks.append((root_id, current_node, end, indent))
+        return tasks
+
+    def _skip_created_children(self, current_node, start, indent, tasks):
+        """
+        Skip the children from `start` that the journal says were already created,
+        adding their subtrees to `tasks`. Returns the index of the first child
+        that still has to be sent.
+        """
+        children = current_node.children
+        while start < len(children):
+            child_root_id = self.journal.get_root_id(children[start].get_node_id().hex)
+            if child_root_id is None:
+                break
+            tasks.append((child_root_id, children[start], 0, indent + 1))
+            with self._add_nodes_lock:
+                self.node_count_dict["upload_count"] += 1
+            start += 1
+        return start
+
+    def _next_chunk(self, current_node, start, max_children=None):
+        """
+        Collect the children of `current_node` from `start` that fit in the current
+        byte budget (always at least one child, at most `max_children`).
+        Returns: (children in chunk, serialized payloads of the valid ones)
+        """
+        limit = min(max_children or ChunkSizer.MAX_CHILDREN, ChunkSizer.MAX_CHILDREN)
+        max_bytes = self._chunk_sizer.max_bytes
+        chunk = []
+        payload_children = []
+        size = 0
+        for child in current_node.children[start : start + limit]:
+            data = self._serialize_child(child)
+            if chunk and data and size + len(data) > max_bytes:
+                break
+            chunk.append(child)
+            if data:
+                payload_children.append(data)
+                size += len(data)
+        return chunk, payload_children
+
+    def _serialize_child(self, child):
+        """
+        Return the JSON payload for `child`, or None if it cannot be created on
+        Studio. Payloads are kept until the child is sent so that retries and
+        chunk boundaries don't serialize the same node twice.
+        """
+        key = id(child)
+        if key not in self._node_payloads:
+            self._node_payloads[key] = (
+                studio_api.dumps(child.to_dict())
+                if self._check_node_build(child)
+                else None
+            )
+        return self._node_payloads[key]
+
+    def _check_node_build(self, child):
+        """
+        Return True if `child` can be sent to Studio. Otherwise register it in
+        failed_node_builds along with the reasons it cannot be created.
+        """
+        failed = [
+            f
+            for f in child.files
+            if f.is_primary and (not f.filename or self.failed_uploads.get(f.filename))
+        ]
+        if not failed and child.valid:
+            return True
+        node_id = child.get_node_id().hex
+        if not self.failed_node_builds.get(node_id):
+            error_message = ""
+            for fail in failed:
+                reason = (
+                    fail.filename + ": " + self.failed_uploads.get(fail.filename)
+                    if fail.filename
+                    else "File failed to download"
+                )
+                error_message = error_message + reason + ", "
+            if hasattr(child, "_error"):
+                error_message = error_message + child._error + ", "
+            self.failed_node_builds[node_id] = {
+                "node": child,
+                "error": error_message[:-2],
+            }
+        return False
 
     def commit_channel(self, channel_id):
         """commit_channel: commits channel to Kolibri Studio
@@ -437,9 +969,7 @@ class ChannelManager:
         Returns: channel id and link to uploadedchannel
         """
         payload = {"channel_id": channel_id, "stage": config.STAGE}
-        response = config.SESSION.post(
-            config.finish_channel_url(), data=json.dumps(payload)
-        )
+        response = studio_api.post(config.finish_channel_url(), payload)
         if response.status_code != 200:
             config.LOGGER.error("")
             config.LOGGER.error(
@@ -455,7 +985,7 @@ class ChannelManager:
                 )
                 sys.exit()
         response.raise_for_status()
-        new_channel = json.loads(response._content.decode("utf-8"))
+        new_channel = studio_api.loads_response(response)
         channel_link = config.open_channel_url(new_channel["new_channel"])
         return channel_id, channel_link
 
@@ -466,7 +996,5 @@ class ChannelManager:
         Returns: None
         """
         payload = {"channel_id": channel_id}
-        response = config.SESSION.post(
-            config.publish_channel_url(), data=json.dumps(payload)
-        )
+        response = studio_api.post(config.publish_channel_url(), payload)
         response.raise_for_status()
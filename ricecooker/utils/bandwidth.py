@@ -0,0 +1,80 @@
+"""
+Global limit on the upload rate, so a chef can share its network link with
+other production traffic. Set ``UPLOAD_BANDWIDTH_LIMIT`` (bytes per second) to
+enable it; every upload then reads its data through one shared RateLimiter.
+"""
+
+import threading
+import time
+
+from ricecooker import config
+
+
+class RateLimiter(object):
+    """
+    Spaces out reads so that, across all threads, at most `rate` bytes per
+    second are handed out. Time spent idle is not saved up for later bursts.
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._next_free = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Block until `amount` bytes may be sent."""
+        with self._lock:
+            now = time.monotonic()
+            self._next_free = max(now, self._next_free) + amount / self.rate
+            delay = self._next_free - now
+        # The first `rate` bytes of a burst are sent right away
+        if delay > 1:
+            time.sleep(delay - 1)
+
+
+class ThrottledReader(object):
+    """File-like wrapper of `file_obj` whose reads are paced by `limiter`."""
+
+    def __init__(self, file_obj, limiter, length):
+        """
+        Args:
+            file_obj: object with a read method, positioned where sending starts
+            limiter (RateLimiter): shared limiter
+            length (int): number of bytes left to read, used as Content-Length
+        """
+        self.file_obj = file_obj
+        self.limiter = limiter
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        data = self.file_obj.read(size)
+        self.limiter.consume(len(data))
+        self.length -= len(data)
+        return data
+
+
+_upload_limiter = None
+_upload_limiter_lock = threading.Lock()
+
+
+def get_upload_limiter():
+    """Return the shared RateLimiter for uploads, or None when uploads are not limited."""
+    global _upload_limiter
+    rate = config.UPLOAD_BANDWIDTH_LIMIT
+    if not rate:
+        return None
+    with _upload_limiter_lock:
+        if _upload_limiter is None or _upload_limiter.rate != rate:
+            _upload_limiter = RateLimiter(rate)
+        return _upload_limiter
+
+
+def throttle_upload(file_obj, length):
+    """Wrap `file_obj` so that reading it honours UPLOAD_BANDWIDTH_LIMIT, if set."""
+    limiter = get_upload_limiter()
+    if limiter is None:
+        return file_obj
+    return ThrottledReader(file_obj, limiter, length)
@@ -4,17 +4,17 @@ from datetime import datetime
 from datetime import timedelta
 
 from cachecontrol import CacheControlAdapter
-from cachecontrol.caches.file_cache import FileCache
 from cachecontrol.heuristics import BaseHeuristic
 from cachecontrol.heuristics import datetime_to_header
 from cachecontrol.heuristics import expire_after
 
 from ricecooker import config
-from ricecooker.utils.storage import get_hash
+from ricecooker.utils.hash_memo import get_memoized_hash
+from ricecooker.utils.metadata_cache import get_cache_backend
 from ricecooker.utils.validators import is_valid_url
 
-# Cache for filenames
-FILECACHE = FileCache(config.FILECACHE_DIRECTORY, forever=True)
+# Cache for filenames (see ricecooker.utils.metadata_cache)
+FILECACHE = get_cache_backend(config.FILECACHE_DIRECTORY, config.FILECACHE_BACKEND)
 
 
 class NeverCache(BaseHeuristic):
@@ -92,11 +92,7 @@ def set_cache_data(key, file_metadata):
     FILECACHE.set(key, bytes(json.dumps(file_metadata), "utf-8"))
 
 
-def get_cache_data(key):
-    if not key:
-        return None
-    file_metadata = FILECACHE.get(key)
-
+def _decode_cache_data(file_metadata):
     if not file_metadata:
         return None
     file_metadata = file_metadata.decode("utf-8")
@@ -112,6 +108,26 @@ def get_cache_data(key):
     return file_metadata
 
 
+def get_cache_data(key):
+    if not key:
+        return None
+    return _decode_cache_data(FILECACHE.get(key))
+
+
+def get_cache_data_many(keys):
+    """
+    Look up the cache data of several keys, in one query when the cache backend
+    supports batched lookups. Returns: dict of key -> file metadata (or None)
+    """
+    keys = [key for key in keys if key]
+    get_many = getattr(FILECACHE, "get_many", None)
+    if get_many is None:
+        values = {key: FILECACHE.get(key) for key in keys}
+    else:
+        values = get_many(keys)
+    return {key: _decode_cache_data(value) for key, value in values.items()}
+
+
 def get_cache_filename(key):
     cache_file = get_cache_data(key)
     if not cache_file:
@@ -129,7 +145,7 @@ def cache_is_outdated(path, cache_file):
         outdated = False
     else:
         # check if the on disk file has changed
-        cache_hash = get_hash(path)
+        cache_hash = get_memoized_hash(path)
         outdated = not cache_hash or not cache_file.startswith(cache_hash)
 
     return outdated
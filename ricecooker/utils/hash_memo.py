@@ -0,0 +1,115 @@
+"""
+Persistent memo of the MD5 hashes of files, keyed by their stat fingerprint.
+
+Checking whether a cached file is still valid used to hash the whole file on
+every lookup, so a fully cached re-run of a channel of local videos still read
+every byte of them. The memo records, for each path, the size, modification
+time (in nanoseconds) and inode the file had when it was hashed. As long as the
+file's stat matches, its hash is taken from the memo; any change to the stat
+makes the memo hash the file again and replace the entry. Storage garbage
+collection removes the entries of the files it deletes, and of any other file
+that no longer exists.
+"""
+
+import os
+import sqlite3
+import threading
+
+from ricecooker import config
+from ricecooker.utils.storage import get_hash
+
+
+class FileHashMemo(object):
+    """
+    SQLite-backed mapping of path -> (size, mtime_ns, inode, md5).
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): location of the SQLite database file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS file_hashes ("
+                " path TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " mtime_ns INTEGER NOT NULL,"
+                " inode INTEGER NOT NULL,"
+                " md5 TEXT NOT NULL)"
+            )
+            self._connection.commit()
+
+    def get_hash(self, filepath):
+        """
+        Return the MD5 hash of the file at `filepath`, only reading the file if
+        its stat changed since it was last hashed. Raises OSError if the file
+        does not exist.
+        """
+        filepath = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        fingerprint = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT size, mtime_ns, inode, md5 FROM file_hashes WHERE path = ?",
+                (filepath,),
+            ).fetchone()
+        if row is not None and tuple(row[:3]) == fingerprint:
+            return row[3]
+        md5 = get_hash(filepath)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, inode, md5)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (filepath, *fingerprint, md5),
+            )
+            self._connection.commit()
+        return md5
+
+    def forget(self, filepaths):
+        """Remove the entries of `filepaths`, e.g. after the files were deleted."""
+        with self._lock:
+            self._connection.executemany(
+                "DELETE FROM file_hashes WHERE path = ?",
+                [(os.path.abspath(filepath),) for filepath in filepaths],
+            )
+            self._connection.commit()
+
+    def prune(self):
+        """Remove the entries of files that no longer exist. Returns: number of entries removed"""
+        with self._lock:
+            paths = [
+                row[0]
+                for row in self._connection.execute("SELECT path FROM file_hashes")
+            ]
+        missing = [path for path in paths if not os.path.exists(path)]
+        self.forget(missing)
+        return len(missing)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_hash_memo = None
+_hash_memo_lock = threading.Lock()
+
+
+def get_hash_memo():
+    """Return the shared FileHashMemo stored at ``config.HASH_MEMO_PATH``."""
+    global _hash_memo
+    with _hash_memo_lock:
+        if _hash_memo is None or _hash_memo.path != config.HASH_MEMO_PATH:
+            _hash_memo = FileHashMemo(config.HASH_MEMO_PATH)
+        return _hash_memo
+
+
+def get_memoized_hash(filepath):
+    """Return the MD5 hash of `filepath`, from the memo when its stat is unchanged."""
+    return get_hash_memo().get_hash(filepath)
@@ -0,0 +1,167 @@
+"""
+Per-host limits on the downloads made through ``config.DOWNLOAD_SESSION``.
+
+Every download handler shares one session, so without limits the number of
+requests a host receives depends only on how many files are processed at once:
+small partner servers answer with 429s while CDNs could take much more. A
+``HostLimiter`` gives each host a ``HostLimit``, which combines a semaphore (how
+many downloads from the host may run at the same time) with a token bucket (how
+many requests per second may start). Limits are configured by domain pattern,
+e.g. ``SushiChef.DOWNLOAD_HOST_LIMITS = {"*.example.org": {"max_concurrent": 2,
+"requests_per_second": 1}}``; other hosts get ``config.DOWNLOAD_HOST_CONCURRENCY``
+and ``config.DOWNLOAD_HOST_RATE`` (0 for no limit). The time downloads waited
+for their host is recorded per host in the run report.
+"""
+
+import fnmatch
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from ricecooker import config
+from ricecooker.utils.run_report import get_run_report
+
+
+class HostLimit(object):
+    """
+    Concurrency limit and token bucket rate limit of the requests to one host.
+    """
+
+    def __init__(self, max_concurrent=None, requests_per_second=None, burst=1):
+        """
+        Args:
+            max_concurrent (int): downloads from the host at the same time (None or 0 for no limit)
+            requests_per_second (float): requests started per second (None or 0 for no limit)
+            burst (int): requests that may start at once after the host was idle
+        """
+        self.max_concurrent = max_concurrent or None
+        self.requests_per_second = requests_per_second or None
+        self.burst = max(1, burst)
+        self._semaphore = (
+            threading.BoundedSemaphore(self.max_concurrent)
+            if self.max_concurrent
+            else None
+        )
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _take_token(self):
+        if not self.requests_per_second:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (now - self._updated) * self.requests_per_second,
+            )
+            self._updated = now
+            # Tokens may go negative: each waiting request reserves the next one
+            self._tokens -= 1
+            delay = -self._tokens / self.requests_per_second
+        if delay > 0:
+            time.sleep(delay)
+
+    @contextmanager
+    def acquire(self):
+        """
+        Wait until a request to the host may start, and hold one of its
+        concurrency slots until the block exits. Yields: seconds waited
+        """
+        start = time.monotonic()
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            self._take_token()
+            yield time.monotonic() - start
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+
+class HostLimiter(object):
+    """
+    Selects the HostLimit of each request based on its host, like DomainSpecificAuth
+    selects headers. Each host matching a pattern gets its own HostLimit.
+    """
+
+    def __init__(self, domain_to_limits=None, default_limits=None):
+        """
+        Args:
+            domain_to_limits (dict): mapping of domain pattern (str, may use * and ?)
+                to HostLimit arguments (dict); the first matching pattern is used
+            default_limits (dict): HostLimit arguments for hosts matching no pattern
+                (default config.DOWNLOAD_HOST_CONCURRENCY and config.DOWNLOAD_HOST_RATE)
+        """
+        self.domain_to_limits = dict(domain_to_limits or {})
+        if default_limits is None:
+            default_limits = {
+                "max_concurrent": config.DOWNLOAD_HOST_CONCURRENCY,
+                "requests_per_second": config.DOWNLOAD_HOST_RATE,
+            }
+        self.default_limits = default_limits
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _limits_for_host(self, host):
+        for pattern, limits in self.domain_to_limits.items():
+            if fnmatch.fnmatch(host, pattern):
+                return limits
+        return self.default_limits
+
+    def get_limit(self, url):
+        """Return the HostLimit of the host of `url`, or None if it is not limited."""
+        host = urlparse(url).netloc.lower()
+        if not host:
+            return None
+        with self._lock:
+            if host not in self._hosts:
+                limits = self._limits_for_host(host)
+                if limits.get("max_concurrent") or limits.get("requests_per_second"):
+                    self._hosts[host] = HostLimit(**limits)
+                else:
+                    self._hosts[host] = None
+            return self._hosts[host]
+
+    @contextmanager
+    def limit(self, url):
+        """Run the block (a request to `url` and the reading of its response) within the limits of its host."""
+        host_limit = self.get_limit(url)
+        if host_limit is None:
+            yield
+            return
+        with host_limit.acquire() as waited:
+            get_run_report().record_host_wait(urlparse(url).netloc.lower(), waited)
+            yield
+
+
+_download_limiter = None
+_download_limiter_lock = threading.Lock()
+
+
+def configure_download_limits(domain_to_limits=None):
+    """Set the per-host limits of the downloads, e.g. from SushiChef.DOWNLOAD_HOST_LIMITS."""
+    global _download_limiter
+    with _download_limiter_lock:
+        _download_limiter = HostLimiter(domain_to_limits)
+        return _download_limiter
+
+
+def get_download_limiter():
+    """Return the shared HostLimiter of the downloads."""
+    global _download_limiter
+    with _download_limiter_lock:
+        if _download_limiter is None:
+            _download_limiter = HostLimiter()
+        return _download_limiter
+
+
+def limit_download(url):
+    """
+    Context manager holding the download of `url` within the limits of its host:
+        with limit_download(url):
+            response = config.DOWNLOAD_SESSION.get(url, stream=True)
+            ...
+    """
+    return get_download_limiter().limit(url)
@@ -8,15 +8,17 @@ from urllib.request import pathname2url
 import chardet
 import requests
 
+from ricecooker.config import FILECACHE_BACKEND
 from ricecooker.config import LOGGER
 from ricecooker.config import STRICT
 
 from .caching import CacheControlAdapter
-from .caching import FileCache
+from .host_limits import limit_download
+from .metadata_cache import get_cache_backend
 
 # create a default session with basic caching mechanisms (similar to what a browser would do)
 sess = requests.Session()
-cache = FileCache(".webcache")
+cache = get_cache_backend(".webcache", FILECACHE_BACKEND, forever=False)
 basic_adapter = CacheControlAdapter(cache=cache)
 sess.mount("http://", basic_adapter)
 sess.mount("https://", basic_adapter)
@@ -163,9 +165,10 @@ def download_file(  # noqa: C901
     fulldestpath = os.path.join(destpath, *subpath)
     os.makedirs(fulldestpath, exist_ok=True)
 
-    # make the actual request to the URL
-    response = request_fn(url)
-    content = response.content
+    # make the actual request to the URL, within the download limits of its host
+    with limit_download(url):
+        response = request_fn(url)
+        content = response.content
 
     if STRICT:
         response.raise_for_status()
@@ -0,0 +1,250 @@
+"""
+Backends for the cache of processed files (see ricecooker.utils.caching).
+
+The cache maps a key describing how a file was produced (its source path and
+processing settings) to the metadata of the file written to storage. It used to
+be a cachecontrol ``FileCache``, which stores one file per key under hashed
+directories: large channels end up with hundreds of thousands of small files
+that are slow to read cold and to back up. ``SQLiteCache`` keeps the same keys
+and values in a single SQLite database instead, and imports the entries of an
+existing ``FileCache`` directory the first time it is opened.
+
+A backend implements the cachecontrol ``BaseCache`` interface (``get``, ``set``,
+``delete`` and ``close``, with bytes values), so any cachecontrol cache can be
+used; ``get_many`` and ``set_many`` are optional batched versions.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+from cachecontrol.cache import BaseCache
+from cachecontrol.caches.file_cache import FileCache
+
+from ricecooker import config
+
+# Name of the database file, inside the cache directory
+SQLITE_CACHE_FILENAME = "cache.sqlite3"
+
+# Most keys looked up in one query (SQLite limits the number of parameters)
+_BATCH_SIZE = 500
+
+
+def _hash_key(key):
+    # Same hash as FileCache uses for its file names, so existing entries can be
+    # imported (FileCache does not store the keys themselves)
+    return hashlib.sha224(key.encode()).hexdigest()
+
+
+class SQLiteCache(BaseCache):
+    """
+    Cache stored in a SQLite database in WAL mode. Each thread uses its own
+    connection, so threads can read at the same time; each write is atomic.
+    """
+
+    def __init__(self, directory, filename=SQLITE_CACHE_FILENAME):
+        """
+        Args:
+            directory (str): cache directory; FileCache entries in it are imported
+            filename (str): name of the database file in `directory`
+        """
+        self.directory = directory
+        self.path = os.path.join(directory, filename)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            return connection
+        with self._lock:
+            # Every new connection makes sure the tables exist, in case the cache
+            # directory was cleared while the chef was running
+            os.makedirs(self.directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self.path, timeout=60, isolation_level=None, check_same_thread=False
+            )
+            self._setup(connection)
+            self._connections.append(connection)
+        self._local.connection = connection
+        return connection
+
+    def _setup(self, connection):
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL) WITHOUT ROWID"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS settings ("
+            " name TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL)"
+        )
+        migrated = connection.execute(
+            "SELECT value FROM settings WHERE name = 'filecache_migrated'"
+        ).fetchone()
+        if migrated is None:
+            self._migrate_file_cache(connection)
+
+    def _migrate_file_cache(self, connection):
+        """Import the entries a FileCache stored in the cache directory, once."""
+        count = 0
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for entry_key, value in _iter_file_cache(self.directory):
+                connection.execute(
+                    "INSERT OR IGNORE INTO entries (key, value) VALUES (?, ?)",
+                    (entry_key, value),
+                )
+                count += 1
+            connection.execute(
+                "INSERT OR REPLACE INTO settings (name, value)"
+                " VALUES ('filecache_migrated', '1')"
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        if count:
+            config.LOGGER.info(
+                "Imported {} entries of the file cache in {} into {}. The old cache "
+                "files are no longer used and can be deleted.".format(
+                    count, self.directory, self.path
+                )
+            )
+
+    def get(self, key):
+        row = (
+            self._connect()
+            .execute("SELECT value FROM entries WHERE key = ?", (_hash_key(key),))
+            .fetchone()
+        )
+        return row and bytes(row[0])
+
+    def get_many(self, keys):
+        """Look up several keys at once. Returns: dict of key -> value (or None)"""
+        hashed = {_hash_key(key): key for key in keys}
+        result = dict.fromkeys(keys)
+        connection = self._connect()
+        hashes = list(hashed)
+        for start in range(0, len(hashes), _BATCH_SIZE):
+            batch = hashes[start : start + _BATCH_SIZE]
+            rows = connection.execute(
+                "SELECT key, value FROM entries WHERE key IN ({})".format(
+                    ",".join("?" * len(batch))
+                ),
+                batch,
+            )
+            for entry_key, value in rows:
+                result[hashed[entry_key]] = bytes(value)
+        return result
+
+    def set(self, key, value, expires=None):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)",
+            (_hash_key(key), value),
+        )
+
+    def set_many(self, items):
+        """Store several (key, value) pairs in one transaction."""
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries (key, value) VALUES (?, ?)",
+                ((_hash_key(key), value) for key, value in items),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (_hash_key(key),))
+
+    def entries(self):
+        """Return a list of the (hashed key, value) of every entry in the cache."""
+        rows = self._connect().execute("SELECT key, value FROM entries").fetchall()
+        return [(entry_key, bytes(value)) for entry_key, value in rows]
+
+    def delete_entries(self, entry_keys):
+        """Delete the entries with the given hashed keys (see entries)."""
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "DELETE FROM entries WHERE key = ?",
+                ((entry_key,) for entry_key in entry_keys),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections = []
+            self._local = threading.local()
+
+
+def _iter_file_cache(directory):
+    """Yield the (hashed key, value) of the entries of a FileCache directory."""
+    for root, dirs, files in os.walk(directory):
+        for name in files:
+            # Entries are stored as <d>/<i>/<g>/<e>/<s>/<digest>, next to
+            # .lock files and the files of other caches
+            if len(name) != 56 or os.path.relpath(root, directory) != os.path.join(
+                *name[:5]
+            ):
+                continue
+            try:
+                with open(os.path.join(root, name), "rb") as fh:
+                    yield name, fh.read()
+            except OSError:
+                continue
+
+
+def iter_cache_entries(cache):
+    """
+    Yield the (hashed key, value) of every entry of a SQLiteCache or FileCache.
+    Raises NotImplementedError for other backends.
+    """
+    if isinstance(cache, SQLiteCache):
+        yield from cache.entries()
+    elif isinstance(cache, FileCache):
+        yield from _iter_file_cache(cache.directory)
+    else:
+        raise NotImplementedError(
+            "Cannot list the entries of a {}".format(type(cache).__name__)
+        )
+
+
+def delete_cache_entries(cache, entry_keys):
+    """Delete the entries with the given hashed keys (see iter_cache_entries)."""
+    if isinstance(cache, SQLiteCache):
+        cache.delete_entries(entry_keys)
+        return
+    for entry_key in entry_keys:
+        try:
+            os.remove(os.path.join(cache.directory, *entry_key[:5], entry_key))
+        except FileNotFoundError:
+            pass
+
+
+def get_cache_backend(directory, backend="sqlite", forever=True):
+    """
+    Return the cache backend named `backend` for the cache directory `directory`:
+    "sqlite" (SQLiteCache) or "file" (the cachecontrol FileCache used before).
+    `forever` is passed to FileCache: when False, the entries cachecontrol
+    invalidates are deleted, so responses follow their HTTP caching headers.
+    """
+    if backend == "sqlite":
+        return SQLiteCache(directory)
+    if backend == "file":
+        return FileCache(directory, forever=forever)
+    raise ValueError("Unknown file cache backend {!r}".format(backend))
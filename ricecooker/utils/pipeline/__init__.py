@@ -1,15 +1,21 @@
+import contextvars
 import mimetypes
 import os
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict
+from typing import Iterable
 from typing import Optional
+from typing import Tuple
+from typing import Union
 
 from ricecooker.utils.pipeline.context import FileMetadata
+from ricecooker.utils.pipeline.context import PipelineContext
 
 from .convert import ConversionStageHandler
 from .extract_metadata import ExtractMetadataStageHandler
 from .file_handler import CompositeHandler
 from .transfer import DownloadStageHandler
+from .workers import get_pipeline_threads
 
 # Do this to prevent import of broken Windows filetype registry that makes guesstype not work.
 # https://www.thecodingforums.com/threads/mimetypes-guess_type-broken-in-windows-on-py2-7-and-python-3-x.952693/
@@ -80,15 +86,14 @@ class FilePipeline(CompositeHandler):
         Execute the pipeline for a given file path.
         """
         # Merge the pipeline defaults with the per-call context; the caller wins.
-        context = {**self.default_context, **(context or {})}
+        context = PipelineContext({**self.default_context, **(context or {})})
         file_metadata_list = [FileMetadata(path=path)]
         for handler in self._children:
             updated_file_metadata_list = []
             for file_metadata in file_metadata_list:
                 if handler.should_handle(file_metadata.path):
                     # Pass in any context from the previous handler
-                    scoped_context = deepcopy(context)
-                    scoped_context.update(file_metadata.to_dict())
+                    scoped_context = context.updated(file_metadata.defined_fields())
                     # Execute the handler and get the new list of metadata
                     new_metadata_list = handler.execute(
                         file_metadata.path,
@@ -107,3 +112,39 @@ class FilePipeline(CompositeHandler):
                     updated_file_metadata_list.append(file_metadata)
             file_metadata_list = updated_file_metadata_list
         return file_metadata_list
+
+    def execute_many(
+        self,
+        paths_with_context: Iterable[Union[str, Tuple[str, Optional[Dict]]]],
+        skip_cache: Optional[bool] = False,
+        max_workers: Optional[int] = None,
+    ) -> list[list[FileMetadata]]:
+        """
+        Execute the pipeline for many paths in parallel.
+
+        `paths_with_context` holds paths or `(path, context)` pairs. A file
+        needed by several of them (e.g. a logo used by many nodes) is only
+        downloaded and converted once, the others wait for it. Returns the
+        result of `execute()` for each item, in order; raises the exception of
+        the first item that failed.
+        """
+        items = [
+            (item, None) if isinstance(item, str) else item
+            for item in paths_with_context
+        ]
+        if not items:
+            return []
+        max_workers = max_workers or min(len(items), get_pipeline_threads())
+        # Each item runs in a copy of the caller's context, so files that a
+        # handler produces while calling this are not waited for by its items
+        run_contexts = [contextvars.copy_context() for _ in items]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(
+                executor.map(
+                    lambda run_context, item: run_context.run(
+                        self.execute, item[0], context=item[1], skip_cache=skip_cache
+                    ),
+                    run_contexts,
+                    items,
+                )
+            )
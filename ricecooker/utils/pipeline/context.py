@@ -1,13 +1,23 @@
+import copy
+import sys
+from collections.abc import Mapping
 from dataclasses import asdict
 from dataclasses import dataclass
+from dataclasses import fields
 from typing import Optional
 from typing import Type
 
+# FileMetadata is created and merged for every file at every stage, so it is
+# slotted where dataclasses support it (Python 3.10+)
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
 
 class AutoDataClassMetaClass(type):
     def __new__(mcs, name: str, bases: tuple, namespace: dict) -> Type:
         cls = super().__new__(mcs, name, bases, namespace)
-        return dataclass(frozen=True)(cls)
+        cls = dataclass(frozen=True)(cls)
+        cls._field_names = tuple(f.name for f in fields(cls))
+        return cls
 
 
 @dataclass
@@ -46,7 +56,57 @@ def _recursive_update(target, source):
     return target
 
 
-@dataclass
+def _without_none(items):
+    return {k: v for k, v in items if v is not None}
+
+
+def _content_node_metadata_dict(value):
+    """Return a copy of `value` (ContentNodeMetadata or dict) as a dict."""
+    if isinstance(value, ContentNodeMetadata):
+        return asdict(value, dict_factory=_without_none)
+    return copy.deepcopy(value)
+
+
+class PipelineContext(Mapping):
+    """
+    Read-only context passed to the handlers of a FilePipeline.
+
+    Stages add the metadata of the file they produced with `updated`, which
+    returns a new context and leaves this one unchanged, so a context can be
+    shared by every file and stage without being copied for each of them.
+    Handlers must not modify the values (such as settings dicts) it holds.
+    """
+
+    __slots__ = ("_values",)
+
+    def __init__(self, values=None):
+        self._values = dict(values or {})
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __repr__(self):
+        return "PipelineContext({!r})".format(self._values)
+
+    def updated(self, values):
+        """Return a new context with `values` added to (or replacing) this one's."""
+        if not values:
+            return self
+        context = PipelineContext.__new__(PipelineContext)
+        context._values = {**self._values, **values}
+        return context
+
+
+@dataclass(**_SLOTS)
 class FileMetadata:
     filename: Optional[str] = None
     path: Optional[str] = None
@@ -58,20 +118,47 @@ class FileMetadata:
     preset: Optional[str] = None
     content_node_metadata: Optional[ContentNodeMetadata] = None
 
+    def defined_fields(self):
+        """Return the fields that are set, without copying their values. Returns: dict"""
+        return {
+            name: value
+            for name in _FILE_METADATA_FIELDS
+            if (value := getattr(self, name)) is not None
+        }
+
     def to_dict(self):
-        return asdict(
-            self, dict_factory=lambda x: {k: v for k, v in x if v is not None}
-        )
+        result = self.defined_fields()
+        if "content_node_metadata" in result:
+            result["content_node_metadata"] = _content_node_metadata_dict(
+                result["content_node_metadata"]
+            )
+        return result
 
     def merge(self, other):
         """
         Create a new FileMetadata object by the result of overwriting self
         fields with other fields when defined.
         """
-        new_dict = _recursive_update(self.to_dict(), other.to_dict())
-        return self.__class__(**new_dict)
+        values = {}
+        for name in _FILE_METADATA_FIELDS:
+            value = getattr(other, name)
+            if value is None:
+                value = getattr(self, name)
+            if name == "content_node_metadata" and value is not None:
+                # Content node metadata is merged key by key, as a dict
+                value = _recursive_update(
+                    _content_node_metadata_dict(self.content_node_metadata or {}),
+                    _content_node_metadata_dict(other.content_node_metadata or {}),
+                )
+            values[name] = value
+        return self.__class__(**values)
+
+
+_FILE_METADATA_FIELDS = tuple(f.name for f in fields(FileMetadata))
 
 
 class ContextMetadata(metaclass=AutoDataClassMetaClass):
     def to_dict(self):
-        return asdict(self)
+        # The instance is frozen and handlers only read their kwargs, so the
+        # values are not copied
+        return {name: getattr(self, name) for name in self._field_names}
@@ -644,6 +644,8 @@ class ImageConversionHandler(ExtensionMatchingHandler):
     A FileHandler that converts image files to supported formats.
     """
 
+    CPU_BOUND = True
+
     SUPPORTED_IMAGE_EXTENSIONS = {
         file_formats.PNG,
         file_formats.JPG,
@@ -710,6 +712,8 @@ class SubtitleConversionHandler(ExtensionMatchingHandler):
     A FileHandler that converts subtitle files to .vtt format.
     """
 
+    CPU_BOUND = True
+
     CONTEXT_CLASS = SubtitleContextMetadata
 
     EXTENSIONS = {file_formats.VTT} | set(
@@ -758,6 +762,8 @@ class SubtitleConversionHandler(ExtensionMatchingHandler):
 class DocumentConversionHandler(ExtensionMatchingHandler):
     """Convert article-style documents to KPUB via pandoc, then sanitize."""
 
+    CPU_BOUND = True
+
     EXTENSIONS = {"docx", "odt", "rtf", "md", "markdown"}
     HANDLED_EXCEPTIONS = [PandocConversionError]
 
@@ -2,29 +2,46 @@
 Utilities for handling file downloads from URLs
 """
 
+import contextvars
+import functools
+import hashlib
 import os
-import tempfile
 import threading
+import time
 from abc import ABC
 from abc import abstractmethod
+from concurrent.futures import Future
 from contextlib import contextmanager
+from dataclasses import replace
 from typing import ClassVar
 from typing import Dict
 from typing import get_type_hints
+from typing import Mapping
 from typing import Optional
 from typing import Type
 from typing import Union
 
 from ricecooker import config
-from ricecooker.utils.caching import get_cache_data
+from ricecooker.utils.caching import get_cache_data_many
 from ricecooker.utils.caching import set_cache_data
 from ricecooker.utils.paths import extract_path_ext
-from ricecooker.utils.storage import copy_file_to_storage
+from ricecooker.utils.run_report import get_run_report
+from ricecooker.utils.storage import get_storage_metadata
+from ricecooker.utils.storage import get_storage_temp_file
+from ricecooker.utils.storage import move_file_to_storage
 
 from .context import ContextMetadata
 from .context import FileMetadata
 from .exceptions import ExpectedFileException
 from .exceptions import InvalidFileException
+from .workers import run_in_process_pool
+from .workers import run_in_stage_pool
+
+
+@functools.lru_cache(maxsize=None)
+def _context_class_fields(context_class):
+    """Return the names of the fields of `context_class`, a ContextMetadata subclass."""
+    return frozenset(get_type_hints(context_class))
 
 
 class Handler(ABC):
@@ -63,23 +80,32 @@ class Handler(ABC):
 
 class DualModeTemporaryFile:
     """
-    A wrapper around NamedTemporaryFile that supports both writing to the filename and file handle writing.
+    A temporary file that supports both writing to the filename and file handle writing.
+
+    The temporary file is created in the storage directory, and the MD5 hash of
+    the data written through the file handle is computed as it is written, so
+    move_to_storage neither reads nor copies the file again.
     """
 
     def __init__(self, ext: Optional[str] = None):
-        self._handle = tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext}")
-        self._handle.close()
+        self._name = None
         self._write_handle = None
+        self._name = get_storage_temp_file(ext)
+        self._md5 = hashlib.md5()
+        self._written = 0
 
     @property
     def name(self):
-        return self._handle.name
+        return self._name
 
     def write(self, data):
         # Write to the file, reopening if needed
         if not self._write_handle:
             self._write_handle = open(self.name, "wb")
-        return self._write_handle.write(data)
+        written = self._write_handle.write(data)
+        self._md5.update(data)
+        self._written += memoryview(data).nbytes
+        return written
 
     def flush(self):
         if self._write_handle:
@@ -92,15 +118,48 @@ class DualModeTemporaryFile:
             # Read a byte from the file to assert we have written something
             return len(f.read(1)) > 0
 
-    def close(self):
+    def checksum(self):
+        """
+        Return the MD5 hash of the data written through the file handle, or None
+        if the file may also have been written to by name (e.g. by ffmpeg).
+        """
+        if not self._write_handle:
+            return None
+        self._write_handle.flush()
+        handle_stat = os.fstat(self._write_handle.fileno())
+        try:
+            path_stat = os.stat(self.name)
+        except OSError:
+            return None
+        if (handle_stat.st_dev, handle_stat.st_ino) != (
+            path_stat.st_dev,
+            path_stat.st_ino,
+        ) or path_stat.st_size != self._written:
+            return None
+        return self._md5.hexdigest()
+
+    def move_to_storage(self, ext: str) -> str:
+        """Move the file into storage and return its filename there."""
+        checksum = self.checksum()
+        self._close_write_handle()
+        filename = move_file_to_storage(self.name, ext=ext, checksum=checksum)
+        self._name = None
+        return filename
+
+    def _close_write_handle(self):
         if self._write_handle:
             self._write_handle.close()
             self._write_handle = None
 
+    def close(self):
+        self._close_write_handle()
+        if self._name is None:
+            return
         try:
-            os.unlink(self.name)
+            os.unlink(self._name)
         except OSError:
             pass
+        self._name = None
 
     def __enter__(self):
         return self
@@ -120,17 +179,24 @@ class FileHandler(Handler):
     # Subclasses can define this list to specify which exceptions should be caught and reported
     HANDLED_EXCEPTIONS = []
 
+    # Set to True in handlers whose handle_file is CPU-bound Python code, to run
+    # it in a worker process (see ricecooker.utils.pipeline.workers). The worker
+    # creates the handler from its class and init context, so handle_file must
+    # not depend on other state of the handler (such as its parent pipeline), and
+    # its arguments, result and exceptions must be picklable.
+    CPU_BOUND: ClassVar[bool] = False
+
     def __init__(self, **context):
         super().__init__()
         self._thread_local = threading.local()
         self._init_context = self._validate_init_context(context)
 
-    def _context_fields(self) -> set:
-        return set(get_type_hints(self.CONTEXT_CLASS).keys())
+    def _context_fields(self) -> frozenset:
+        return _context_class_fields(self.CONTEXT_CLASS)
 
     def _validate_init_context(self, context: Dict) -> Dict:
         """Reject init context keys that aren't ``CONTEXT_CLASS`` fields."""
-        # Skip get_type_hints on the no-arg path; also tolerates CONTEXT_CLASS=None.
+        # Also tolerates CONTEXT_CLASS=None.
         if not context:
             return context
         fields = self._context_fields()
@@ -152,10 +218,17 @@ class FileHandler(Handler):
         """Thread-safe output path setter."""
         self._thread_local.output_path = value
 
-    def _get_context(self, context: Optional[Dict] = None):
+    def _get_context(self, context: Optional[Mapping] = None):
         fields = self._context_fields()
-        merged = {**self._init_context, **(context or {})}
-        context = {k: v for k, v in merged.items() if k in fields}
+        context = context or {}
+        # Only the handler's fields are looked up, the call context wins
+        merged = {}
+        for name in fields:
+            if name in context:
+                merged[name] = context[name]
+            elif name in self._init_context:
+                merged[name] = self._init_context[name]
+        context = merged
         try:
             context = self.CONTEXT_CLASS(**context)
         except TypeError:
@@ -179,7 +252,7 @@ class FileHandler(Handler):
                     raise InvalidFileException(
                         f"File with extension {extension} failed to write (corrupted)."
                     )
-                filename = copy_file_to_storage(tempf.name, ext=extension)
+                filename = tempf.move_to_storage(extension)
                 self._output_path = config.get_storage_path(filename)
 
     @abstractmethod
@@ -225,6 +298,24 @@ class FileHandler(Handler):
     def cached_file_outdated(self, filename):
         return False
 
+    def cached_file_changed(self, path, validators, **kwargs) -> bool:
+        """
+        Check, in --revalidate mode, whether the source of a cached file changed
+        since it was cached. `validators` are the values handle_file recorded
+        with set_cache_validators (None if it did not record any).
+        Defaults to False, which means the cached file is used.
+        """
+        return False
+
+    def set_cache_validators(self, **validators):
+        """
+        Record values (e.g. the ETag of a download) to store in the cache entry of
+        the file being handled, for cached_file_changed to check on later runs.
+        """
+        self._thread_local.cache_validators = {
+            name: value for name, value in validators.items() if value is not None
+        }
+
     def get_file_kwargs(self, context: ContextMetadata) -> list[Dict]:
         """
         An overridable method to return a list of kwargs for the file handler.
@@ -244,13 +335,20 @@ class FileHandler(Handler):
         cached_files = []
         uncached_files = []
 
-        for kwargs in kwargs_list:
-            cache_key = self.get_cache_key(path, **kwargs)
-            file_metadata = get_cache_data(cache_key)
+        cache_keys = [self.get_cache_key(path, **kwargs) for kwargs in kwargs_list]
+        cache_data = {} if skip_cache else get_cache_data_many(cache_keys)
+
+        for kwargs, cache_key in zip(kwargs_list, cache_keys):
+            file_metadata = cache_data.get(cache_key)
+            validators = file_metadata and file_metadata.pop("validators", None)
             if (
                 file_metadata
                 and not skip_cache
                 and not self.cached_file_outdated(file_metadata["filename"])
+                and not (
+                    config.REVALIDATE
+                    and self.cached_file_changed(path, validators, **kwargs)
+                )
             ):
                 file_metadata["path"] = config.get_storage_path(
                     file_metadata["filename"]
@@ -261,6 +359,81 @@ class FileHandler(Handler):
 
         return cached_files, uncached_files
 
+    def _run_handle_file(self, path, kwargs):
+        """
+        Run handle_file on the worker thread of the stage's pool, or in a worker
+        process for CPU-bound handlers.
+        Returns: (FileMetadata, path of the file written to storage or None,
+                  cache validators recorded by handle_file or None)
+        """
+        if self.CPU_BOUND:
+            return run_in_process_pool(
+                _handle_file_in_process, type(self), self._init_context, path, kwargs
+            )
+        return self._handle_file_and_get_output(path, kwargs)
+
+    def _handle_file_and_get_output(self, path, kwargs):
+        """Run handle_file in this thread. Returns: see _run_handle_file"""
+        self._output_path = None
+        self._thread_local.cache_validators = None
+        try:
+            file_metadata = self.handle_file(path, **kwargs) or FileMetadata()
+            return (
+                file_metadata,
+                self._output_path,
+                self._thread_local.cache_validators,
+            )
+        finally:
+            self._output_path = None
+            self._thread_local.cache_validators = None
+
+    def _produce_file(self, path, kwargs, cache_key, report):
+        """Run handle_file for `path` with `kwargs` and cache the result. Returns: FileMetadata"""
+        if kwargs:
+            config.LOGGER.info(
+                f"\tInitiating {self.STAGE} for {path} with kwargs {kwargs}"
+            )
+        else:
+            config.LOGGER.info(f"\tInitiating {self.STAGE} for {path}")
+
+        start = time.monotonic()
+        try:
+            file_metadata, written_path, validators = run_in_stage_pool(
+                self.STAGE, self._run_handle_file, path, kwargs
+            )
+        except tuple(self.HANDLED_EXCEPTIONS) as e:
+            config.LOGGER.error(
+                f"\tFailed {self.STAGE} for {path} with kwargs {kwargs}"
+            )
+            raise ExpectedFileException(e) from e
+
+        output_path = written_path or path
+
+        file_metadata.filename = os.path.basename(output_path)
+
+        report.record_file(f"{self.STAGE} {path}", time.monotonic() - start)
+        if self.STAGE == "DOWNLOAD" and written_path:
+            stored = get_storage_metadata(file_metadata.filename)
+            if stored is not None:
+                report.count("bytes_downloaded", stored.size)
+
+        cache_data = file_metadata.to_dict()
+        if validators:
+            cache_data["validators"] = validators
+        set_cache_data(cache_key, cache_data)
+
+        file_metadata.path = output_path
+
+        if kwargs:
+            config.LOGGER.info(
+                f"\tCompleted {self.STAGE} for {path} with kwargs {kwargs} saved to {file_metadata.path}"
+            )
+        else:
+            config.LOGGER.info(
+                f"\tCompleted {self.STAGE} for {path} saved to {file_metadata.path}"
+            )
+        return file_metadata
+
     def execute(
         self,
         path: str,
@@ -271,50 +444,70 @@ class FileHandler(Handler):
         file_metadata_list, uncached_kwargs = self._get_cached_and_uncached_files(
             path, context, skip_cache
         )
+        report = get_run_report()
+        report.count("cache_hits", len(file_metadata_list))
+        report.count("cache_misses", len(uncached_kwargs))
 
         for kwargs in uncached_kwargs:
-            self._output_path = None
-            if kwargs:
+            cache_key = self.get_cache_key(path, **kwargs)
+            in_flight, is_producer = _start_in_flight(cache_key)
+            if not is_producer:
+                # Another thread is producing the same file: use its result
                 config.LOGGER.info(
-                    f"\tInitiating {self.STAGE} for {path} with kwargs {kwargs}"
+                    f"\tWaiting for {self.STAGE} of {path} already in progress"
                 )
+                file_metadata_list.append(replace(in_flight.result()))
+                continue
+            producing = _producing.set(_producing.get() | {cache_key})
+            try:
+                file_metadata = self._produce_file(path, kwargs, cache_key, report)
+            except BaseException as e:
+                in_flight.set_exception(e)
+                raise
             else:
-                config.LOGGER.info(f"\tInitiating {self.STAGE} for {path}")
+                in_flight.set_result(replace(file_metadata))
+            finally:
+                _producing.reset(producing)
+                _finish_in_flight(cache_key, in_flight)
+            file_metadata_list.append(file_metadata)
 
-            cache_key = self.get_cache_key(path, **kwargs)
+        return file_metadata_list
 
-            try:
-                file_metadata = self.handle_file(path, **kwargs) or FileMetadata()
-            except tuple(self.HANDLED_EXCEPTIONS) as e:
-                config.LOGGER.error(
-                    f"\tFailed {self.STAGE} for {path} with kwargs {kwargs}"
-                )
-                raise ExpectedFileException(e) from e
 
-            original_path = path
+# Cache key -> Future of the file being produced for it, so that threads
+# processing the same file at the same time wait for one of them
+_in_flight = {}
+_in_flight_lock = threading.Lock()
 
-            path = self._output_path or path
+# Cache keys produced by the current call chain. Nested work runs on the stage
+# pools' threads, which get the context of the thread that handed it over (see
+# workers.run_in_stage_pool), so this is followed across threads.
+_producing = contextvars.ContextVar("producing", default=frozenset())
 
-            file_metadata.filename = os.path.basename(path)
 
-            set_cache_data(cache_key, file_metadata.to_dict())
+def _start_in_flight(cache_key):
+    """Returns: (Future of the file for `cache_key`, True if the caller must produce it)"""
+    with _in_flight_lock:
+        if cache_key in _in_flight:
+            if cache_key not in _producing.get():
+                return _in_flight[cache_key], False
+            # The file is needed again while producing it (an archive that
+            # references itself): produce it again rather than wait forever
+            return Future(), True
+        in_flight = Future()
+        _in_flight[cache_key] = in_flight
+        return in_flight, True
 
-            file_metadata.path = path
 
-            self._output_path = None
+def _finish_in_flight(cache_key, in_flight):
+    with _in_flight_lock:
+        if _in_flight.get(cache_key) is in_flight:
+            del _in_flight[cache_key]
 
-            file_metadata_list.append(file_metadata)
 
-            if kwargs:
-                config.LOGGER.info(
-                    f"\tCompleted {self.STAGE} for {original_path} with kwargs {kwargs} saved to {file_metadata.path}"
-                )
-            else:
-                config.LOGGER.info(
-                    f"\tCompleted {self.STAGE} for {original_path} saved to {file_metadata.path}"
-                )
-
-        return file_metadata_list
+def _handle_file_in_process(handler_class, init_context, path, kwargs):
+    handler = handler_class(**init_context)
+    return handler._handle_file_and_get_output(path, kwargs)
 
 
 class ExtensionMatchingHandler(FileHandler):
@@ -5,6 +5,7 @@ import mimetypes
 import os
 import re
 import tempfile
+import threading
 from dataclasses import field
 from sys import platform
 from typing import Dict
@@ -25,12 +26,13 @@ from ricecooker import config
 from ricecooker.utils.caching import generate_key
 from ricecooker.utils.encodings import ext_from_data_uri_mimetype
 from ricecooker.utils.encodings import get_base64_data_uri
+from ricecooker.utils.hash_memo import get_memoized_hash
+from ricecooker.utils.host_limits import limit_download
 from ricecooker.utils.paths import extract_path_ext
 from ricecooker.utils.pipeline.exceptions import InvalidFileException
 from ricecooker.utils.references import neutralize_external_navigation
 from ricecooker.utils.singlefile import render_page
 from ricecooker.utils.singlefile import SingleFileRenderError
-from ricecooker.utils.storage import get_hash
 from ricecooker.utils.youtube import get_language_with_alpha2_fallback
 from ricecooker.utils.youtube import YouTubeResource
 
@@ -74,10 +76,11 @@ class DiskResourceHandler(FileHandler):
         return os.path.exists(self._normalize_path(path))
 
     def cached_file_outdated(self, filename):
-        path = config.get_storage_path(filename)
-        if not os.path.exists(config.get_storage_path(filename)):
+        # The stored file is only hashed again when its stat changed
+        try:
+            hash = get_memoized_hash(config.get_storage_path(filename))
+        except OSError:
             return True
-        hash = get_hash(path)
         return not hash or not filename.startswith(hash)
 
     def handle_file(self, path, default_ext=None):
@@ -154,17 +157,76 @@ class CatchAllWebResourceDownloadHandler(WebResourceHandler):
         Timeout,
     ]
 
+    def __init__(self, **context):
+        super().__init__(**context)
+        # URL -> whether it changed, so each URL is revalidated once per run
+        self._revalidated = {}
+        # URL -> answer to its conditional GET, when the file changed
+        self._revalidation_responses = {}
+        self._revalidated_lock = threading.Lock()
+
+    def cached_file_changed(self, path, validators, **kwargs):
+        """
+        Send a conditional GET for `path` with the ETag and Last-Modified of the
+        cached download: the cached file is used if the server answers 304.
+        Downloads cached without an ETag or Last-Modified are downloaded again.
+        A 200 answer is kept for handle_file to read, rather than sending a second GET.
+        """
+        with self._revalidated_lock:
+            if path in self._revalidated:
+                return self._revalidated[path]
+        headers = {}
+        if validators and validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators and validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+        changed = True
+        if headers:
+            try:
+                with limit_download(path):
+                    r = config.DOWNLOAD_SESSION.get(
+                        path, headers=headers, stream=True, timeout=(30, 60)
+                    )
+                changed = r.status_code != 304
+                if r.status_code == 200:
+                    with self._revalidated_lock:
+                        self._revalidation_responses[path] = r
+                else:
+                    r.close()
+            except tuple(self.HANDLED_EXCEPTIONS) as e:
+                config.LOGGER.warning(
+                    f"\tCould not revalidate {path}, downloading it again: {e}"
+                )
+        if not changed:
+            config.LOGGER.info(f"\tCached download of {path} is unchanged")
+        with self._revalidated_lock:
+            self._revalidated[path] = changed
+        return changed
+
     def handle_file(self, path, default_ext=None):
         # Use explicit timeout to prevent hanging downloads
         # (connection_timeout, read_timeout) - connection timeout for establishing connection,
         # read timeout for time between receiving data chunks (prevents stuck downloads)
-        r = config.DOWNLOAD_SESSION.get(path, stream=True, timeout=(30, 60))
-        original_filename = extract_filename_from_request(path, r)
-        default_ext = extract_path_ext(original_filename, default_ext=default_ext)
-        r.raise_for_status()
-        with self.write_file(default_ext) as fh:
-            for chunk in r.iter_content(chunk_size=8192):
-                fh.write(chunk)
+        with limit_download(path):
+            with self._revalidated_lock:
+                r = self._revalidation_responses.pop(path, None)
+            if r is None:
+                r = config.DOWNLOAD_SESSION.get(path, stream=True, timeout=(30, 60))
+            original_filename = extract_filename_from_request(path, r)
+            default_ext = extract_path_ext(original_filename, default_ext=default_ext)
+            r.raise_for_status()
+            # Stored with the cache entry, for --revalidate
+            self.set_cache_validators(
+                etag=r.headers.get("ETag"),
+                last_modified=r.headers.get("Last-Modified"),
+                content_length=r.headers.get("Content-Length"),
+            )
+            with self.write_file(default_ext) as fh:
+                for chunk in r.iter_content(chunk_size=8192):
+                    fh.write(chunk)
+        # The cache entry is now up to date for the rest of the run
+        with self._revalidated_lock:
+            self._revalidated[path] = False
         return FileMetadata(original_filename=original_filename)
 
 
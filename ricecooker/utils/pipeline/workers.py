@@ -0,0 +1,166 @@
+"""
+Worker pools the stages of the file pipeline run on.
+
+Downloads wait on the network while conversions (ffmpeg, Pillow, zip) and
+metadata extraction use the CPU, so each stage runs its handlers on its own
+pool of threads, sized by ``config.DOWNLOAD_WORKERS``,
+``config.CONVERT_WORKERS`` and ``config.METADATA_WORKERS``. The thread that runs
+the pipeline for a file hands each stage to its pool and waits for the result:
+downloads keep the network busy while files are being compressed, and no more
+conversions run at once than the conversion pool allows, whatever the number
+of threads processing nodes.
+
+Handlers doing pure-Python work (image verification, subtitle parsing, zip
+building) would still take turns on the GIL, so handlers marked ``CPU_BOUND``
+run their ``handle_file`` in a pool of ``config.PROCESS_WORKERS`` worker
+processes instead (see run_in_process_pool).
+"""
+
+import concurrent.futures
+import contextvars
+import multiprocessing
+import pickle
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from ricecooker import config
+
+# Stage -> name of the config setting with the size of its pool
+STAGE_WORKERS = {
+    "DOWNLOAD": "DOWNLOAD_WORKERS",
+    "CONVERT": "CONVERT_WORKERS",
+    "EXTRACT_METADATA": "METADATA_WORKERS",
+}
+
+# config settings the worker processes take from the chef's process on every call
+PROCESS_SETTINGS = ("STORAGE_DIRECTORY",)
+
+_pools = {}  # stage -> (size, ThreadPoolExecutor)
+_pools_lock = threading.Lock()
+_current = threading.local()  # stage run by the current worker thread
+_process_pool = (None, None)  # (size, ProcessPoolExecutor)
+_in_worker_process = False
+
+
+def _get_pool(stage):
+    setting = STAGE_WORKERS.get(stage)
+    if setting is None:
+        return None
+    size = max(1, getattr(config, setting))
+    with _pools_lock:
+        current_size, pool = _pools.get(stage, (None, None))
+        if current_size != size:
+            # The setting changed (e.g. --convert-workers): new work goes to a
+            # pool of the new size, the old pool finishes what it was given
+            if pool is not None:
+                pool.shutdown(wait=False)
+            pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=size,
+                thread_name_prefix="ricecooker-{}".format(stage.lower()),
+            )
+            _pools[stage] = (size, pool)
+        return pool
+
+
+def _run_as_stage(stage, function, args, kwargs):
+    _current.stage = stage
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _current.stage = None
+
+
+def run_in_stage_pool(stage, function, *args, **kwargs):
+    """
+    Call `function(*args, **kwargs)` on the worker pool of `stage` and return
+    its result (or raise its exception). Stages without a pool, and work a
+    stage's handler starts for the same stage (e.g. the files of an archive
+    converted while converting the archive), run in the calling thread. The
+    worker thread runs the call in a copy of the caller's context variables.
+    """
+    if getattr(_current, "stage", None) == stage:
+        return function(*args, **kwargs)
+    pool = _get_pool(stage)
+    if pool is None:
+        return function(*args, **kwargs)
+    context = contextvars.copy_context()
+    return pool.submit(
+        context.run, _run_as_stage, stage, function, args, kwargs
+    ).result()
+
+
+def get_pipeline_threads():
+    """Return how many threads should process nodes so every stage pool can be kept busy."""
+    return max(
+        config.TASK_THREADS,
+        sum(max(1, getattr(config, setting)) for setting in STAGE_WORKERS.values()),
+    )
+
+
+def _init_worker_process():
+    global _in_worker_process
+    _in_worker_process = True
+
+
+def _get_process_pool():
+    global _process_pool
+    size = config.PROCESS_WORKERS
+    with _pools_lock:
+        current_size, pool = _process_pool
+        if current_size != size:
+            if pool is not None:
+                pool.shutdown(wait=False)
+            pool = None
+            if size:
+                # Worker processes are spawned rather than forked: forking a
+                # process running many threads can copy locks that are held
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker_process,
+                )
+            _process_pool = (size, pool)
+        return pool
+
+
+def _reset_process_pool(pool):
+    global _process_pool
+    with _pools_lock:
+        if _process_pool[1] is pool:
+            _process_pool = (None, None)
+
+
+def _run_with_settings(settings, function, args):
+    for name, value in settings.items():
+        setattr(config, name, value)
+    return function(*args)
+
+
+def run_in_process_pool(function, *args):
+    """
+    Call `function(*args)` in one of the config.PROCESS_WORKERS worker
+    processes and return its result (or raise its exception). The function,
+    its arguments and its result must be picklable. The call runs in the
+    calling thread instead when the process pool is disabled
+    (PROCESS_WORKERS=0), in a worker process, or when the call cannot be pickled.
+    """
+    pool = None if _in_worker_process else _get_process_pool()
+    if pool is None:
+        return function(*args)
+    call = ({name: getattr(config, name) for name in PROCESS_SETTINGS}, function, args)
+    try:
+        pickle.dumps(call)
+    except (pickle.PicklingError, AttributeError, TypeError):
+        return function(*args)
+    try:
+        return pool.submit(_run_with_settings, *call).result()
+    except BrokenProcessPool:
+        # A worker process died (e.g. killed for using too much memory): start
+        # a new pool for the next calls and run this one here
+        config.LOGGER.warning(
+            "\tA worker process died, running {} in this process".format(
+                getattr(function, "__name__", function)
+            )
+        )
+        _reset_process_pool(pool)
+        return function(*args)
@@ -0,0 +1,131 @@
+"""
+Local index of files that have been confirmed to exist on a Studio server.
+
+Checking whether a file is already on Studio costs one HEAD request per file,
+which adds up to hours of round trips on large channels that are re-run
+unchanged. The index remembers every file that a HEAD request (or a successful
+upload) confirmed, per Studio host, so later runs can skip the request until
+the entry is older than ``config.REMOTE_INDEX_TTL`` seconds.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+from ricecooker import config
+
+
+class RemoteFileIndex(object):
+    """
+    SQLite-backed set of ``(host, filename)`` pairs known to exist on Studio,
+    along with the file size reported by the server (when known).
+    """
+
+    def __init__(self, path, ttl=None):
+        """
+        Args:
+            path (str): location of the SQLite database file
+            ttl (int): seconds a confirmation stays valid (default config.REMOTE_INDEX_TTL)
+        """
+        self.path = path
+        self.ttl = config.REMOTE_INDEX_TTL if ttl is None else ttl
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS remote_files ("
+                " host TEXT NOT NULL,"
+                " filename TEXT NOT NULL,"
+                " size INTEGER,"
+                " confirmed_at REAL NOT NULL,"
+                " PRIMARY KEY (host, filename))"
+            )
+            self._connection.commit()
+
+    def _fetch(self, host, filename):
+        with self._lock:
+            return self._connection.execute(
+                "SELECT size, confirmed_at FROM remote_files"
+                " WHERE host = ? AND filename = ?",
+                (host, filename),
+            ).fetchone()
+
+    def contains(self, host, filename):
+        """Return True if `filename` was confirmed on `host` within the TTL."""
+        row = self._fetch(host, filename)
+        return row is not None and time.time() - row[1] < self.ttl
+
+    def get_size(self, host, filename):
+        """Return the recorded size of a confirmed file, or None if unknown or expired."""
+        row = self._fetch(host, filename)
+        if row is None or time.time() - row[1] >= self.ttl:
+            return None
+        return row[0]
+
+    def add(self, host, filename, size=None):
+        """Record that `filename` is present on `host` as of now."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO remote_files (host, filename, size, confirmed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (host, filename, size, time.time()),
+            )
+            self._connection.commit()
+
+    def remove(self, host, filename):
+        """Forget `filename` on `host`, e.g. after the server reported it missing."""
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM remote_files WHERE host = ? AND filename = ?",
+                (host, filename),
+            )
+            self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+_remote_index = None
+_remote_index_lock = threading.Lock()
+
+
+def get_remote_index():
+    """Return the shared RemoteFileIndex stored at ``config.REMOTE_INDEX_PATH``."""
+    global _remote_index
+    with _remote_index_lock:
+        if _remote_index is None or _remote_index.path != config.REMOTE_INDEX_PATH:
+            _remote_index = RemoteFileIndex(config.REMOTE_INDEX_PATH)
+        return _remote_index
+
+
+def is_confirmed_remote(filename):
+    """Return True if the index says `filename` is on the current Studio host.
+
+    Always returns False when ``config.RECHECK_REMOTE`` is set (--recheck-remote),
+    forcing a fresh check against the server.
+    """
+    if config.RECHECK_REMOTE:
+        return False
+    return get_remote_index().contains(config.DOMAIN, filename)
+
+
+def get_confirmed_remote_size(filename):
+    """Like is_confirmed_remote, but return the recorded file size (or None)."""
+    if config.RECHECK_REMOTE:
+        return None
+    return get_remote_index().get_size(config.DOMAIN, filename)
+
+
+def confirm_remote(filename, size=None):
+    """Record that `filename` is present on the current Studio host."""
+    get_remote_index().add(config.DOMAIN, filename, size=size)
+
+
+def forget_remote(filename):
+    """Drop `filename` from the index after the current Studio host reported it missing."""
+    get_remote_index().remove(config.DOMAIN, filename)
@@ -0,0 +1,307 @@
+"""
+Resumable, chunked uploads of large files to Studio's storage backend.
+
+A file is normally uploaded with a single PUT to the URL returned by Studio's
+upload_url endpoint, so one dropped connection restarts the whole transfer.
+When Studio reports that its storage accepts resumable uploads (``resumable``
+in the upload_url response, or ``config.RESUMABLE_UPLOADS``), files of at least
+``config.RESUMABLE_UPLOAD_THRESHOLD`` bytes are instead sent through a
+resumable upload session (the protocol used by Google Cloud Storage):
+
+    1. POST to the upload URL with ``x-goog-resumable: start`` opens a session,
+       whose URL is returned in the ``Location`` header.
+    2. Each part is PUT to the session URL with a
+       ``Content-Range: bytes <first>-<last>/<total>`` header. The server
+       answers 308 (with a ``Range`` header of the bytes it has) until the
+       last part, which is answered with 200 or 201.
+    3. A PUT with an empty body and ``Content-Range: bytes */<total>`` asks the
+       server how many bytes it has received.
+
+The last part carries the MD5 of the whole file in ``x-goog-hash``, and the
+hash the server reports for the finished object is checked against it.
+
+Each part is retried with exponential backoff. The session URL and the number
+of bytes the server confirmed are saved in ``config.UPLOAD_SESSIONS_DIRECTORY``
+so a restarted chef continues partial uploads instead of starting them over.
+"""
+
+import base64
+import io
+import json
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from requests.exceptions import RequestException
+
+from ricecooker import config
+from ricecooker.utils.bandwidth import throttle_upload
+
+
+class ResumableUploadNotSupported(Exception):
+    """Raised when the storage server refuses to open a resumable session."""
+
+    pass
+
+
+class UploadChecksumError(Exception):
+    """Raised when the uploaded object does not have the MD5 of the file."""
+
+    pass
+
+
+class UploadSessionStore(object):
+    """
+    Saves the resumable session of each file being uploaded, as a small JSON
+    file ``<directory>/<key>.json``, until the upload completes. Keys are
+    ``<Studio host>/<filename>`` (see ResumableUpload.key).
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or config.UPLOAD_SESSIONS_DIRECTORY
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Return the saved session of `key` as a dict, or None."""
+        try:
+            with open(self._path(key)) as session_file:
+                return json.load(session_file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, session):
+        with self._lock:
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as session_file:
+                json.dump(session, session_file)
+            os.replace(tmp_path, path)
+
+    def remove(self, key):
+        with self._lock:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+class ResumableUpload(object):
+    """
+    Uploads the file at `path` to `upload_url` in parts of `chunk_size` bytes.
+
+    Attributes:
+        filename (str): storage filename of the file
+        key (str): key of the saved session: the Studio host and the filename
+        offset (int): number of bytes confirmed by the server so far
+    """
+
+    MAX_BACKOFF = 60  # seconds
+    SESSION_TTL = 6 * 24 * 60 * 60  # storage sessions expire after a week
+
+    def __init__(
+        self,
+        filename,
+        path,
+        upload_url,
+        headers=None,
+        session=None,
+        store=None,
+        chunk_size=None,
+        max_attempts=None,
+        backoff=None,
+        size=None,
+        checksum=None,
+        domain=None,
+    ):
+        """
+        Args:
+            filename (str): storage filename of the file
+            path (str): local path of the file
+            upload_url (str): upload URL returned by Studio
+            headers (dict): headers sent when opening the session, e.g. Content-Type (optional)
+            session (requests.Session): session used for requests (default config.SESSION)
+            store (UploadSessionStore): where progress is saved (optional)
+            chunk_size (int): bytes per part (default config.RESUMABLE_UPLOAD_CHUNK_SIZE)
+            max_attempts (int): attempts per part (default config.RESUMABLE_UPLOAD_ATTEMPTS)
+            backoff (float): seconds to wait after the first failed attempt (optional)
+            size (int): size of the file, if already known (optional)
+            checksum (str): hex MD5 of the file, checked against the uploaded object (optional)
+            domain (str): Studio the file is uploaded for (default config.DOMAIN)
+        """
+        self.filename = filename
+        # Session URLs are only valid against the Studio they were opened for
+        host = urlparse(domain or config.DOMAIN).netloc.replace(":", "_")
+        self.key = os.path.join(host, filename)
+        self.path = path
+        self.upload_url = upload_url
+        self.headers = headers or {}
+        self.session = session or config.SESSION
+        self.store = store or UploadSessionStore()
+        self.chunk_size = chunk_size or config.RESUMABLE_UPLOAD_CHUNK_SIZE
+        self.max_attempts = max_attempts or config.RESUMABLE_UPLOAD_ATTEMPTS
+        self.backoff = config.RESUMABLE_UPLOAD_BACKOFF if backoff is None else backoff
+        self.size = os.path.getsize(path) if size is None else size
+        self.checksum = checksum
+        self.session_url = None
+        self.offset = 0
+
+    def upload(self):
+        """
+        Upload the file, continuing a saved session if there is one.
+        Raises ResumableUploadNotSupported if the server cannot open a session,
+        RequestException if a part still fails after all attempts and
+        UploadChecksumError if the uploaded object does not match the file.
+        Returns: None
+        """
+        if not self._resume_session():
+            self._start_session()
+        with open(self.path, "rb") as file_obj:
+            while self.offset < self.size:
+                file_obj.seek(self.offset)
+                data = file_obj.read(self.chunk_size)
+                self._send_part(data)
+        self.store.remove(self.key)
+
+    def _resume_session(self):
+        saved = self.store.get(self.key)
+        if (
+            not saved
+            or saved.get("size") != self.size
+            or time.time() - saved.get("created", 0) > self.SESSION_TTL
+        ):
+            return False
+        self.session_url = saved["session_url"]
+        self.offset = saved.get("offset", 0)
+        try:
+            self._query_offset()
+        except RequestException:
+            self.store.remove(self.key)
+            self.session_url, self.offset = None, 0
+            return False
+        config.LOGGER.info(
+            "\tResuming upload of {} at {}/{} bytes".format(
+                self.filename, self.offset, self.size
+            )
+        )
+        return True
+
+    def _start_session(self):
+        headers = dict(self.headers, **{"x-goog-resumable": "start"})
+        response = self.session.post(self.upload_url, headers=headers, data=b"")
+        session_url = response.headers.get("Location")
+        if response.status_code not in (200, 201) or not session_url:
+            raise ResumableUploadNotSupported(
+                "Could not open resumable upload for {}, response code: {}".format(
+                    self.filename, response.status_code
+                )
+            )
+        self.session_url = session_url
+        self.offset = 0
+        self.store.remove(self.key)  # forget any expired session
+        self._save()
+
+    def _save(self):
+        saved = self.store.get(self.key) or {}
+        self.store.save(
+            self.key,
+            {
+                "session_url": self.session_url,
+                "size": self.size,
+                "offset": self.offset,
+                "created": saved.get("created", time.time()),
+            },
+        )
+
+    def _md5_header(self):
+        return "md5=" + base64.b64encode(bytes.fromhex(self.checksum)).decode()
+
+    def _check_uploaded_hash(self, response):
+        """Compare the MD5 the server reports for the finished object with the file's."""
+        hashes = dict(
+            value.strip().split("=", 1)
+            for value in response.headers.get("x-goog-hash", "").split(",")
+            if "=" in value
+        )
+        if (
+            self.checksum
+            and "md5" in hashes
+            and hashes["md5"] != self._md5_header()[4:]
+        ):
+            self.store.remove(self.key)
+            raise UploadChecksumError(
+                "Error uploading file {}: the uploaded object has MD5 {}".format(
+                    self.filename, hashes["md5"]
+                )
+            )
+
+    def _update_offset(self, response):
+        """Update the offset from a response to a part or status request."""
+        if response.status_code in (200, 201):
+            self._check_uploaded_hash(response)
+            self.offset = self.size
+        elif response.status_code == 308:
+            # Range header is missing when the server has no bytes yet
+            byte_range = response.headers.get("Range")
+            self.offset = int(byte_range.split("-")[-1]) + 1 if byte_range else 0
+        else:
+            raise RequestException(
+                "Error uploading file {}, response code: {} - {}".format(
+                    self.filename, response.status_code, response.text
+                )
+            )
+        self._save()
+
+    def _query_offset(self):
+        response = self.session.put(
+            self.session_url,
+            headers={"Content-Range": "bytes */{}".format(self.size)},
+            data=b"",
+        )
+        self._update_offset(response)
+
+    def _send_part(self, data):
+        last = self.offset + len(data) - 1
+        headers = {
+            "Content-Range": "bytes {}-{}/{}".format(self.offset, last, self.size)
+        }
+        if self.checksum and last + 1 == self.size:
+            # Lets the server reject a finished object that does not match
+            headers["x-goog-hash"] = self._md5_header()
+        for attempt in range(self.max_attempts):
+            try:
+                response = self.session.put(
+                    self.session_url,
+                    headers=headers,
+                    data=throttle_upload(io.BytesIO(data), len(data)),
+                )
+                if response.status_code < 500 and response.status_code != 429:
+                    self._update_offset(response)
+                    return
+                error = RequestException(
+                    "Server error uploading file {}, response code: {}".format(
+                        self.filename, response.status_code
+                    )
+                )
+            except (RequestException, OSError) as e:
+                error = e
+            if attempt + 1 == self.max_attempts:
+                break
+            delay = min(self.MAX_BACKOFF, self.backoff * 2**attempt)
+            config.LOGGER.warning(
+                "\tUpload of {} failed at byte {} ({}), retrying in {}s".format(
+                    self.filename, self.offset, error, delay
+                )
+            )
+            time.sleep(delay)
+            try:
+                # The server may have received part of the data before failing
+                self._query_offset()
+                return
+            except (RequestException, OSError):
+                pass
+        raise error
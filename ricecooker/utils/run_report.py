@@ -0,0 +1,198 @@
+"""
+Machine-readable report of a chef run, to track performance between runs.
+
+``uploadchannel`` times each phase of the run (construct_channel,
+process_tree_files, get_file_diff, upload_files, add_nodes, commit) and the
+pipeline and ChannelManager count bytes, files and cache hits as they go. At
+the end of the run the report is saved as JSON in ``config.RUN_REPORTS_DIR``
+and, if ``config.PROMETHEUS_TEXTFILE`` is set, as a Prometheus textfile for
+the node_exporter textfile collector.
+"""
+
+import heapq
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from ricecooker import config
+
+
+class RunReport(object):
+    """
+    Phase timings, counters and the slowest files and nodes of one run.
+    All methods are safe to call from several threads.
+    """
+
+    COUNTERS = (
+        "bytes_downloaded",
+        "bytes_uploaded",
+        "files_processed",
+        "files_uploaded",
+        "nodes_processed",
+        "nodes_skipped",
+        "cache_hits",
+        "cache_misses",
+        "storage_files_removed",
+        "storage_bytes_freed",
+    )
+
+    def __init__(self, slowest_count=None):
+        """
+        Args:
+            slowest_count (int): number of slowest files and nodes to keep (default config.RUN_REPORT_SLOWEST)
+        """
+        self.run_id = datetime.now().strftime("%Y-%m-%d__%H%M%S")
+        self.started = time.time()
+        self.slowest_count = slowest_count or config.RUN_REPORT_SLOWEST
+        self.phases = {}
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self._slowest = {"files": [], "nodes": []}  # min-heaps of (seconds, name)
+        self.download_hosts = {}  # host -> downloads and seconds waited for host limits
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        """Time the block as phase `name`; repeated phases add up."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + elapsed
+
+    def count(self, counter, amount=1):
+        with self._lock:
+            self.counters[counter] += amount
+
+    def record_host_wait(self, host, seconds):
+        """Record that a download from `host` waited `seconds` for the host's limits."""
+        with self._lock:
+            stats = self.download_hosts.setdefault(
+                host, {"downloads": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+            )
+            stats["downloads"] += 1
+            stats["wait_seconds"] += seconds
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], seconds)
+
+    def _record_slow(self, kind, name, seconds):
+        with self._lock:
+            heap = self._slowest[kind]
+            if len(heap) < self.slowest_count:
+                heapq.heappush(heap, (seconds, name))
+            elif seconds > heap[0][0]:
+                heapq.heapreplace(heap, (seconds, name))
+
+    def record_file(self, name, seconds):
+        """Record that processing the file `name` took `seconds`."""
+        self._record_slow("files", name, seconds)
+
+    def record_node(self, name, seconds):
+        """Record that processing the node `name` took `seconds`."""
+        self._record_slow("nodes", name, seconds)
+
+    def to_dict(self):
+        with self._lock:
+            counters = dict(self.counters)
+            phases = dict(self.phases)
+            slowest = {
+                kind: [
+                    {"name": name, "seconds": round(seconds, 3)}
+                    for seconds, name in sorted(heap, reverse=True)
+                ]
+                for kind, heap in self._slowest.items()
+            }
+            download_hosts = {
+                host: {
+                    "downloads": stats["downloads"],
+                    "wait_seconds": round(stats["wait_seconds"], 3),
+                    "max_wait_seconds": round(stats["max_wait_seconds"], 3),
+                }
+                for host, stats in self.download_hosts.items()
+            }
+        lookups = counters["cache_hits"] + counters["cache_misses"]
+        processing_time = phases.get("process_tree_files")
+        upload_time = phases.get("upload_files")
+        return {
+            "run_id": self.run_id,
+            "wall_time": round(time.time() - self.started, 3),
+            "phases": {name: round(seconds, 3) for name, seconds in phases.items()},
+            "counters": counters,
+            "cache_hit_rate": counters["cache_hits"] / lookups if lookups else None,
+            "files_per_second": (
+                counters["files_processed"] / processing_time
+                if processing_time
+                else None
+            ),
+            "uploads_per_second": (
+                counters["files_uploaded"] / upload_time if upload_time else None
+            ),
+            "slowest_files": slowest["files"],
+            "slowest_nodes": slowest["nodes"],
+            "download_hosts": download_hosts,
+        }
+
+    def save(self, directory=None, prometheus_path=None):
+        """
+        Write the report as JSON to `directory` (default config.RUN_REPORTS_DIR)
+        and, if `prometheus_path` (default config.PROMETHEUS_TEXTFILE) is set,
+        as a Prometheus textfile. Returns: path of the JSON report
+        """
+        report = self.to_dict()
+        directory = directory or config.RUN_REPORTS_DIR
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, "run_{}.json".format(self.run_id))
+        with open(path, "w") as report_file:
+            json.dump(report, report_file, indent=2)
+        prometheus_path = prometheus_path or config.PROMETHEUS_TEXTFILE
+        if prometheus_path:
+            write_prometheus_textfile(report, prometheus_path)
+        return path
+
+
+def write_prometheus_textfile(report, path):
+    """Write the numbers of a RunReport dict to `path` in the Prometheus text format."""
+    lines = [
+        "# HELP ricecooker_phase_seconds Wall time of each phase of the last run.",
+        "# TYPE ricecooker_phase_seconds gauge",
+    ]
+    for name, seconds in sorted(report["phases"].items()):
+        lines.append('ricecooker_phase_seconds{{phase="{}"}} {}'.format(name, seconds))
+    for name, value in sorted(report["counters"].items()):
+        lines.append("# TYPE ricecooker_{}_total counter".format(name))
+        lines.append("ricecooker_{}_total {}".format(name, value))
+    if report["download_hosts"]:
+        lines.append("# TYPE ricecooker_download_wait_seconds gauge")
+        for host, stats in sorted(report["download_hosts"].items()):
+            lines.append(
+                'ricecooker_download_wait_seconds{{host="{}"}} {}'.format(
+                    host, stats["wait_seconds"]
+                )
+            )
+    for name in ("wall_time", "cache_hit_rate", "files_per_second"):
+        if report[name] is not None:
+            lines.append("# TYPE ricecooker_{} gauge".format(name))
+            lines.append("ricecooker_{} {}".format(name, report[name]))
+    # Write then rename, so the collector never reads a half-written file
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as textfile:
+        textfile.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+_run_report = RunReport()
+
+
+def start_run_report():
+    """Start a new RunReport for the run that is starting and return it."""
+    global _run_report
+    _run_report = RunReport()
+    return _run_report
+
+
+def get_run_report():
+    """Return the RunReport of the current run."""
+    return _run_report
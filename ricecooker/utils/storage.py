@@ -1,9 +1,59 @@
+import errno
 import hashlib
+import os
 import shutil
+import tempfile
+import threading
+from collections import namedtuple
 
 from ricecooker import config
 from ricecooker.utils.paths import extract_path_ext
 
+# Size, checksum, extension and modification time of a file in storage/
+StorageMetadata = namedtuple(
+    "StorageMetadata", ["size", "checksum", "extension", "mtime"]
+)
+
+# (storage directory, filename) -> StorageMetadata, filled once per file so that
+# File.size, to_dict and uploads do not stat the same file again and again
+_storage_metadata = {}
+_storage_metadata_lock = threading.Lock()
+
+
+def record_storage_metadata(filename, path=None):
+    """
+    Stat `filename` in storage (at `path`, if already known) and remember its metadata.
+    Raises OSError if the file is not in storage.
+    Returns: StorageMetadata
+    """
+    stat = os.stat(path or config.get_storage_path(filename))
+    checksum, _, extension = filename.partition(".")
+    metadata = StorageMetadata(stat.st_size, checksum, extension, stat.st_mtime)
+    with _storage_metadata_lock:
+        _storage_metadata[(config.STORAGE_DIRECTORY, filename)] = metadata
+    return metadata
+
+
+def get_storage_metadata(filename):
+    """
+    Return the StorageMetadata of `filename`, or None if it is not in storage.
+    Only the first lookup of a file that did not enter storage through
+    copy_file_to_storage touches the disk.
+    """
+    metadata = _storage_metadata.get((config.STORAGE_DIRECTORY, filename))
+    if metadata is not None:
+        return metadata
+    try:
+        return record_storage_metadata(filename)
+    except OSError:
+        return None
+
+
+def forget_storage_metadata(filename):
+    """Drop the recorded metadata of `filename`, e.g. after it was removed from storage."""
+    with _storage_metadata_lock:
+        _storage_metadata.pop((config.STORAGE_DIRECTORY, filename), None)
+
 
 def get_hash(filepath):
     file_hash = hashlib.md5()
@@ -13,19 +63,90 @@ def get_hash(filepath):
     return file_hash.hexdigest()
 
 
-def copy_file_to_storage(srcfilename, ext=None):
+# Prefix of the temporary files written in storage/ before they are moved to
+# their final name (storage garbage collection leaves them alone)
+STORAGE_TEMP_PREFIX = ".ingest-"
+
+
+def get_storage_temp_file(ext=None):
     """
-    Copy `srcfilename` (filepath) to destination.
-    :rtype: None
+    Create an empty temporary file in the storage directory, on the same file
+    system as the files in storage, so it can be moved there without a copy.
+    Returns: path of the temporary file
+    """
+    os.makedirs(config.STORAGE_DIRECTORY, exist_ok=True)
+    fd, path = tempfile.mkstemp(
+        suffix=".{}".format(ext) if ext else "",
+        prefix=STORAGE_TEMP_PREFIX,
+        dir=config.STORAGE_DIRECTORY,
+    )
+    os.close(fd)
+    return path
+
+
+def move_file_to_storage(srcfilename, ext=None, checksum=None):
+    """
+    Move `srcfilename` (filepath) into storage. The file is only hashed when its
+    MD5 `checksum` is not given, and it is renamed rather than copied, except
+    across file systems.
+    Returns: filename in storage
     """
     if ext is None:
         ext = extract_path_ext(srcfilename)
+    if checksum is None:
+        checksum = get_hash(srcfilename)
+    filename = "{}.{}".format(checksum, ext)
+    storage_path = config.get_storage_path(filename)
+    try:
+        os.replace(srcfilename, storage_path)
+    except OSError as e:
+        if e.errno == errno.EXDEV:
+            _copy_into_place(srcfilename, storage_path)
+            os.remove(srcfilename)
+        elif not os.path.exists(storage_path):
+            raise
+        # Otherwise the same contents are already in storage (e.g. the file is
+        # open on Windows, which cannot replace it)
+    record_storage_metadata(filename, path=storage_path)
+    return filename
 
-    hash = get_hash(srcfilename)
-    filename = "{}.{}".format(hash, ext)
+
+def _copy_into_place(srcfilename, destination):
+    # Copy next to the destination first, so the destination is never partly written
+    fd, temp_path = tempfile.mkstemp(
+        prefix=STORAGE_TEMP_PREFIX, dir=os.path.dirname(destination)
+    )
     try:
-        shutil.copy(srcfilename, config.get_storage_path(filename))
-    except shutil.SameFileError:
-        return filename
+        with open(srcfilename, "rb") as fsrc, os.fdopen(fd, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst, 2097152)
+        os.replace(temp_path, destination)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
 
-    return filename
+
+def copy_file_to_storage(srcfilename, ext=None):
+    """
+    Copy `srcfilename` (filepath) to storage, hashing it while it is copied.
+    Returns: filename in storage
+    """
+    if ext is None:
+        ext = extract_path_ext(srcfilename)
+
+    temp_path = get_storage_temp_file(ext)
+    try:
+        file_hash = hashlib.md5()
+        with open(srcfilename, "rb") as fobj, open(temp_path, "wb") as fdst:
+            for chunk in iter(lambda: fobj.read(2097152), b""):
+                file_hash.update(chunk)
+                fdst.write(chunk)
+        return move_file_to_storage(temp_path, ext=ext, checksum=file_hash.hexdigest())
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
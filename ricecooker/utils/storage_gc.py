@@ -0,0 +1,197 @@
+"""
+Garbage collection of the storage/ directory and of the file cache.
+
+Every processed file stays in storage/ for good: raw downloads before they were
+compressed, images before they were converted, archives that were rebuilt with
+different settings. ``collect_storage_garbage`` marks the files used by the tree
+of the last run (they are always kept) and the files the file cache points to,
+removes every other file, and then removes the cached files the tree does not
+use, least recently used first, until storage/ fits in ``config.STORAGE_BUDGET``
+bytes. Cache entries pointing at removed (or missing) files are deleted in the
+same pass, so the next run processes those files again.
+
+Run it with ``ricecooker storage gc`` or at the end of a chef run with ``--gc-storage``.
+"""
+
+import json
+import os
+import re
+import time
+from collections import namedtuple
+
+from ricecooker import config
+from ricecooker.utils import caching
+from ricecooker.utils.hash_memo import get_hash_memo
+from ricecooker.utils.metadata_cache import delete_cache_entries
+from ricecooker.utils.metadata_cache import iter_cache_entries
+from ricecooker.utils.storage import forget_storage_metadata
+from ricecooker.utils.storage import STORAGE_TEMP_PREFIX
+
+# Files in storage are named <md5 of the contents>.<extension>
+STORAGE_FILENAME_RE = re.compile(r"[0-9a-f]{32}\.[0-9a-z]+")
+
+StorageGCResult = namedtuple(
+    "StorageGCResult",
+    ["files_removed", "bytes_freed", "cache_entries_removed", "bytes_kept"],
+)
+
+# Seconds after which a temporary file left in storage by an interrupted run is removed
+TEMP_FILE_MAX_AGE = 24 * 60 * 60
+
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(size):
+    """Parse a size in bytes with an optional K, M, G or T suffix, e.g. "50G"."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)B?\s*", str(size).upper())
+    if match is None:
+        raise ValueError("Invalid size {!r}".format(size))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2)])
+
+
+def get_tree_filenames(tree_path):
+    """Return the set of storage filenames used in the tree archive `tree_path`."""
+    with open(tree_path) as tree_file:
+        tree = json.load(tree_file)
+    filenames = set()
+    stack = [tree]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, str):
+            # Files of nodes are listed by filename, question images are
+            # referenced in the question text
+            filenames.update(STORAGE_FILENAME_RE.findall(value))
+    return filenames
+
+
+def _cached_filename(value):
+    try:
+        value = value.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+    try:
+        file_metadata = json.loads(value)
+    except json.JSONDecodeError:
+        return value
+    if isinstance(file_metadata, dict):
+        return file_metadata.get("filename")
+    return None
+
+
+def _iter_storage_files():
+    """Yield the (filename, path, size, last used time) of the files in storage."""
+    recent = time.time() - TEMP_FILE_MAX_AGE
+    for root, dirs, files in os.walk(config.STORAGE_DIRECTORY):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith(STORAGE_TEMP_PREFIX) and stat.st_mtime > recent:
+                # A file still being written by a running chef
+                continue
+            yield name, path, stat.st_size, max(stat.st_atime, stat.st_mtime)
+
+
+def _get_cached_filenames():
+    """Return a dict of filename -> hashed keys of the cache entries pointing at it."""
+    cached = {}
+    for entry_key, value in iter_cache_entries(caching.FILECACHE):
+        filename = _cached_filename(value)
+        if filename:
+            cached.setdefault(filename, []).append(entry_key)
+    return cached
+
+
+def _remove_files(files):
+    for filename, path, size in files:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        forget_storage_metadata(filename)
+    get_hash_memo().forget([path for filename, path, size in files])
+
+
+def collect_storage_garbage(tree_paths, budget=None, dry_run=False):
+    """
+    Remove the files in storage that the trees in `tree_paths` do not use (see
+    the module docstring), along with the cache entries pointing at them.
+    Args:
+        tree_paths (list of str): tree archives whose files must be kept
+        budget (int): bytes storage may use (default config.STORAGE_BUDGET, 0 for no limit)
+        dry_run (bool): only report what would be removed
+    Returns: StorageGCResult
+    """
+    budget = config.STORAGE_BUDGET if budget is None else budget
+    keep = set()
+    for tree_path in tree_paths:
+        keep.update(get_tree_filenames(tree_path))
+
+    cached = _get_cached_filenames()
+    stored = set()
+    remove = []
+    evictable = []
+    total_size = 0
+    for filename, path, size, last_used in _iter_storage_files():
+        stored.add(filename)
+        if filename in keep:
+            total_size += size
+        elif filename in cached:
+            total_size += size
+            evictable.append((last_used, filename, path, size))
+        else:
+            remove.append((filename, path, size))
+
+    if budget:
+        evictable.sort()
+        for last_used, filename, path, size in evictable:
+            if total_size <= budget:
+                break
+            remove.append((filename, path, size))
+            total_size -= size
+
+    removed = set(filename for filename, path, size in remove)
+    stale_entries = [
+        entry_key
+        for filename, entry_keys in cached.items()
+        if filename in removed or filename not in stored
+        for entry_key in entry_keys
+    ]
+
+    if not dry_run:
+        _remove_files(remove)
+        delete_cache_entries(caching.FILECACHE, stale_entries)
+        # Also drops the hashes of deleted source files outside of storage
+        get_hash_memo().prune()
+
+    result = StorageGCResult(
+        files_removed=len(remove),
+        bytes_freed=sum(size for filename, path, size in remove),
+        cache_entries_removed=len(stale_entries),
+        bytes_kept=total_size,
+    )
+    config.LOGGER.info(
+        "{} {} files ({} bytes) from storage and {} cache entries, {} bytes kept".format(
+            "Would remove" if dry_run else "Removed",
+            result.files_removed,
+            result.bytes_freed,
+            result.cache_entries_removed,
+            result.bytes_kept,
+        )
+    )
+    return result
+
+
+def get_latest_tree_archive():
+    """Return the path of the tree archive saved by the last chef run, or None."""
+    if not os.path.exists(config.DATA_PATH):
+        return None
+    with open(config.DATA_PATH) as data_file:
+        chef_data = json.load(data_file)
+    return chef_data.get("tree_archives", {}).get("current")
@@ -0,0 +1,87 @@
+"""
+Serialization of the JSON payloads sent to and received from the Studio API.
+
+Payloads are serialized with orjson when it is installed (``pip install orjson``)
+and with the standard library json module otherwise. Request bodies of at least
+``config.STUDIO_GZIP_THRESHOLD`` bytes are sent with ``Content-Encoding: gzip``.
+Whether a Studio server accepts compressed bodies is found out on the first
+large request: if the server answers 415 Unsupported Media Type, the payload is
+sent again uncompressed, and so are later requests to that server. Other errors
+are returned as they are, since the server may already have applied the
+request (add_nodes and commit_channel are not idempotent).
+"""
+
+import gzip
+import json
+import threading
+
+from ricecooker import config
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+
+def dumps(obj):
+    """Serialize `obj` to JSON. Returns: bytes"""
+    if orjson is not None and config.STUDIO_USE_ORJSON:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+
+def loads(data):
+    """Parse JSON from `data` (bytes or str)."""
+    if orjson is not None and config.STUDIO_USE_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def loads_response(response):
+    """Parse the JSON body of `response` without decoding it to a str first."""
+    return loads(response.content)
+
+
+# Studio host -> True/False once it is known whether it accepts gzip bodies
+_gzip_support = {}
+_gzip_support_lock = threading.Lock()
+
+# Response to a compressed body meaning the server did not read it
+GZIP_REJECTED_STATUS = 415
+
+
+def post(url, payload):
+    """
+    POST `payload` (an object to serialize, or already serialized bytes) to
+    `url` on config.SESSION, gzip-compressing it when it is large enough and
+    the server is not known to reject compressed bodies.
+    Returns: requests.Response
+    """
+    body = payload if isinstance(payload, bytes) else dumps(payload)
+    host = config.DOMAIN
+    threshold = config.STUDIO_GZIP_THRESHOLD
+    if not threshold or len(body) < threshold or _gzip_support.get(host) is False:
+        return config.SESSION.post(url, data=body)
+
+    response = config.SESSION.post(
+        url,
+        data=gzip.compress(body, compresslevel=config.STUDIO_GZIP_LEVEL),
+        headers={"Content-Encoding": "gzip"},
+    )
+    if response.status_code < 400:
+        with _gzip_support_lock:
+            _gzip_support.setdefault(host, True)
+    if host in _gzip_support or response.status_code != GZIP_REJECTED_STATUS:
+        return response
+
+    # Unknown server that refused the compressed body: try again uncompressed
+    plain_response = config.SESSION.post(url, data=body)
+    if plain_response.status_code < 400:
+        config.LOGGER.info(
+            "\t{} does not accept compressed requests, sending them uncompressed".format(
+                host
+            )
+        )
+        with _gzip_support_lock:
+            _gzip_support[host] = False
+    return plain_response
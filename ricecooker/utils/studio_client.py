@@ -0,0 +1,159 @@
+"""
+HTTP client for the requests ricecooker makes to Studio (``config.SESSION``).
+
+StudioSession is a ``requests.Session`` that:
+  - keeps a connection pool as large as the number of worker threads, so
+    threads never wait for a free connection,
+  - retries connection errors, and 5xx errors of idempotent requests, with
+    exponential backoff,
+  - waits and retries when the server answers 429 or 503, honouring the
+    ``Retry-After`` header,
+  - limits the number of concurrent requests to each host, halving the limit
+    when the host throttles and raising it again while requests go through.
+"""
+
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrency(object):
+    """
+    Limit on concurrent requests that is halved each time the server throttles
+    a request and raised by one after `increase_after` requests in a row that
+    were not throttled, between 1 and `max_limit`.
+    """
+
+    def __init__(self, max_limit, increase_after=20):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.increase_after = increase_after
+        self._in_flight = 0
+        self._successes = 0
+        self._condition = threading.Condition()
+
+    def resize(self, max_limit):
+        """Change the largest allowed limit, e.g. after the worker count changed."""
+        with self._condition:
+            self.max_limit = max_limit
+            self.limit = max_limit
+            self._condition.notify_all()
+
+    def acquire(self):
+        """Block until one more request may be sent."""
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, throttled=False):
+        """Free the slot of a finished request, adapting the limit."""
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                self._successes = 0
+                self.limit = max(1, self.limit // 2)
+            else:
+                self._successes += 1
+                if self._successes >= self.increase_after:
+                    self._successes = 0
+                    self.limit = min(self.max_limit, self.limit + 1)
+            self._condition.notify_all()
+
+
+class StudioSession(requests.Session):
+    """
+    requests.Session for Studio with a sized connection pool, retries and
+    adaptive per-host concurrency (see the module docstring).
+    """
+
+    THROTTLE_STATUSES = (429, 503)
+    MAX_RETRY_AFTER = 120  # seconds
+
+    def __init__(self, pool_size=10, max_retries=3, backoff_factor=0.5):
+        """
+        Args:
+            pool_size (int): connections kept per host, and most concurrent requests
+            max_retries (int): retries of a failed or throttled request
+            backoff_factor (float): first retry delay in seconds, doubled on each retry
+        """
+        super(StudioSession, self).__init__()
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        self.configure_pool(pool_size)
+
+    def configure_pool(self, pool_size):
+        """Size the connection pool and concurrency limit for `pool_size` workers."""
+        self.pool_size = pool_size
+        retry = Retry(
+            total=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            # 429 and 503 are retried by request() for every method
+            status_forcelist=(500, 502, 504),
+            allowed_methods=frozenset(["GET", "HEAD", "OPTIONS", "DELETE"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_maxsize=pool_size, max_retries=retry)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        with self._limiters_lock:
+            for limiter in self._limiters.values():
+                limiter.resize(pool_size)
+
+    def _limiter(self, url):
+        host = urlparse(url).netloc
+        with self._limiters_lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveConcurrency(self.pool_size)
+            return self._limiters[host]
+
+    def _retry_delay(self, response, attempt):
+        delay = self.backoff_factor * 2**attempt
+        retry_after = response.headers.get("Retry-After")
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after).timestamp()
+                    delay = retry_at - time.time()
+                except (TypeError, ValueError):
+                    pass
+        return min(self.MAX_RETRY_AFTER, max(0, delay))
+
+    def request(self, method, url, *args, **kwargs):
+        limiter = self._limiter(url)
+        data = kwargs.get("data")
+        # File-like bodies are consumed by the first attempt and cannot be resent
+        replayable = data is None or isinstance(data, (bytes, str, dict, list))
+        attempt = 0
+        while True:
+            limiter.acquire()
+            throttled = False
+            try:
+                response = super(StudioSession, self).request(
+                    method, url, *args, **kwargs
+                )
+                throttled = response.status_code in self.THROTTLE_STATUSES
+            finally:
+                limiter.release(throttled=throttled)
+            if not throttled or not replayable or attempt >= self.max_retries:
+                return response
+            delay = self._retry_delay(response, attempt)
+            LOGGER.warning(
+                "{} throttled {} {} ({}), retrying in {:.1f}s".format(
+                    urlparse(url).netloc, method, url, response.status_code, delay
+                )
+            )
+            time.sleep(delay)
+            attempt += 1
@@ -0,0 +1,119 @@
+import copy
+from unittest.mock import patch
+
+import pytest
+
+from ricecooker.utils.pipeline import FilePipeline
+from ricecooker.utils.pipeline.context import ContentNodeMetadata
+from ricecooker.utils.pipeline.context import FileMetadata
+from ricecooker.utils.pipeline.context import PipelineContext
+from ricecooker.utils.pipeline.convert import ConversionStageHandler
+from ricecooker.utils.pipeline.convert import SubtitleContextMetadata
+from ricecooker.utils.pipeline.file_handler import FileHandler
+from ricecooker.utils.pipeline.file_handler import Handler
+
+
+def test_file_metadata_merge_overwrites_defined_fields():
+    first = FileMetadata(
+        path="a.pdf",
+        language="en",
+        content_node_metadata=ContentNodeMetadata(
+            title="Title", extra_fields={"options": {"a": 1}}
+        ),
+    )
+    second = FileMetadata(
+        path="b.pdf",
+        preset="document",
+        content_node_metadata={
+            "kind": "document",
+            "extra_fields": {"options": {"b": 2}},
+        },
+    )
+    merged = first.merge(second)
+
+    assert merged.path == "b.pdf"
+    assert merged.language == "en"
+    assert merged.preset == "document"
+    assert merged.content_node_metadata == {
+        "title": "Title",
+        "kind": "document",
+        "extra_fields": {"options": {"a": 1, "b": 2}},
+    }
+    # neither input is modified
+    assert first.content_node_metadata.extra_fields == {"options": {"a": 1}}
+    assert second.content_node_metadata["extra_fields"] == {"options": {"b": 2}}
+    assert first.path == "a.pdf"
+
+
+def test_file_metadata_to_dict_skips_unset_fields():
+    metadata = FileMetadata(
+        filename="abc.pdf", content_node_metadata=ContentNodeMetadata(kind="document")
+    )
+    assert metadata.to_dict() == {
+        "filename": "abc.pdf",
+        "content_node_metadata": {"kind": "document"},
+    }
+    assert metadata.defined_fields()["content_node_metadata"] is (
+        metadata.content_node_metadata
+    )
+
+
+def test_pipeline_context_is_copied_on_update():
+    settings = {"crf": 32}
+    context = PipelineContext({"video_settings": settings})
+    updated = context.updated({"language": "en"})
+
+    assert dict(updated) == {"video_settings": settings, "language": "en"}
+    assert "language" not in context
+    assert updated["video_settings"] is settings
+    assert context.updated({}) is context
+    with pytest.raises(TypeError):
+        context["language"] = "en"
+
+
+def test_context_metadata_to_dict_does_not_copy_values():
+    context = SubtitleContextMetadata(language="en", subtitle_format="srt")
+    assert context.to_dict() == {"language": "en", "subtitle_format": "srt"}
+
+
+class _SubtitleHandler(FileHandler):
+    CONTEXT_CLASS = SubtitleContextMetadata
+
+    def should_handle(self, path):
+        return True
+
+    def handle_file(self, path, **kwargs):
+        return None
+
+
+class _StubStage(Handler):
+    """Stage doing the context work of a FileHandler, without any file I/O."""
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def should_handle(self, path):
+        return True
+
+    def execute(self, path, context=None, skip_cache=False):
+        self.handler.get_file_kwargs(self.handler._get_context(context))
+        return [FileMetadata(path=path, preset="document")]
+
+
+def test_pipeline_does_not_deepcopy_contexts():
+    """The timing of this loop is measured by resources/scripts/benchmark_pipeline_overhead.py"""
+    stages = [_StubStage(_SubtitleHandler()) for _ in range(3)]
+    pipeline = FilePipeline(
+        children=stages, default_context={"video_settings": {"crf": 32}}
+    )
+    with patch.object(copy, "deepcopy", wraps=copy.deepcopy) as deepcopy:
+        for i in range(5):
+            pipeline.execute("file-{}.pdf".format(i), context={"language": "en"})
+    deepcopy.assert_not_called()
+
+
+def test_file_pipeline_accepts_stage_handlers():
+    # The default stages still compose with the read-only context
+    pipeline = FilePipeline(children=[ConversionStageHandler(children=[])])
+    assert pipeline.execute("file.unknownext") == [FileMetadata(path="file.unknownext")]
@@ -1,9 +1,15 @@
+import errno
+import hashlib
+import os
 import shutil
 import threading
+import time
+import uuid
 from unittest.mock import patch
 
 import pytest
 
+from ricecooker import config
 from ricecooker.utils.pipeline import FilePipeline
 from ricecooker.utils.pipeline.context import FileMetadata
 from ricecooker.utils.pipeline.convert import ConversionStageHandler
@@ -12,6 +18,7 @@ from ricecooker.utils.pipeline.exceptions import InvalidFileException
 from ricecooker.utils.pipeline.extract_metadata import ExtractMetadataStageHandler
 from ricecooker.utils.pipeline.file_handler import FileHandler
 from ricecooker.utils.pipeline.transfer import DownloadStageHandler
+from ricecooker.utils.pipeline.workers import run_in_stage_pool
 
 
 class TestFileHandler(FileHandler):
@@ -43,6 +50,60 @@ def test_write_file_with_exception_still_checks_file_not_empty():
             raise RuntimeError("This exception should be caught by try/finally")
 
 
+def test_write_file_hashes_while_writing():
+    handler = TestFileHandler()
+    data = b"0123456789" * 100000
+
+    with patch("ricecooker.utils.storage.get_hash") as get_hash:
+        with handler.write_file("txt") as fh:
+            temp_path = fh.name
+            fh.write(data[:500000])
+            fh.write(memoryview(data)[500000:])
+    get_hash.assert_not_called()
+
+    assert os.path.basename(handler._output_path) == (
+        hashlib.md5(data).hexdigest() + ".txt"
+    )
+    with open(handler._output_path, "rb") as f:
+        assert f.read() == data
+    # The temporary file was moved into storage
+    assert os.path.dirname(temp_path) == os.path.abspath(config.STORAGE_DIRECTORY)
+    assert not os.path.exists(temp_path)
+
+
+def test_write_file_hashes_files_written_by_name():
+    handler = TestFileHandler()
+
+    with handler.write_file("txt") as fh:
+        with open(fh.name, "wb") as f:
+            f.write(b"written by name")
+
+    assert os.path.basename(handler._output_path) == (
+        hashlib.md5(b"written by name").hexdigest() + ".txt"
+    )
+
+
+def test_write_file_falls_back_to_copy_across_devices():
+    handler = TestFileHandler()
+    replace = os.replace
+
+    def cross_device_replace(src, dst):
+        if not os.path.basename(src).startswith(".ingest-") or os.path.dirname(
+            src
+        ) == os.path.dirname(dst):
+            return replace(src, dst)
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    with patch("ricecooker.utils.storage.os.replace", cross_device_replace):
+        with handler.write_file("txt") as fh:
+            temp_path = fh.name
+            fh.write(b"copied")
+
+    with open(handler._output_path, "rb") as f:
+        assert f.read() == b"copied"
+    assert not os.path.exists(temp_path)
+
+
 class ThreadRaceTestHandler(FileHandler):
     def __init__(self):
         super().__init__()
@@ -163,3 +224,86 @@ def test_file_pipeline_execute_context_overrides_default_context(video_file):
 
     assert mock_compress.called
     assert mock_compress.call_args.kwargs["crf"] == 24
+
+
+class SlowCountingHandler(FileHandler):
+    """Writes the path it is given to storage, slowly, counting its calls."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def should_handle(self, path: str) -> bool:
+        return path.startswith("coalesce-test://")
+
+    def handle_file(self, path, **kwargs):
+        with self.lock:
+            self.calls.append(path)
+        time.sleep(0.1)
+        with self.write_file("txt") as fh:
+            fh.write(path.encode("utf-8"))
+
+
+def test_execute_many_coalesces_identical_files():
+    handler = SlowCountingHandler()
+    pipeline = FilePipeline(children=[DownloadStageHandler(children=[handler])])
+    run = uuid.uuid4().hex
+    shared = "coalesce-test://{}/logo".format(run)
+    other = "coalesce-test://{}/other".format(run)
+    paths = [shared, (other, {}), shared, shared]
+
+    results = pipeline.execute_many(paths, skip_cache=True, max_workers=4)
+
+    assert sorted(handler.calls) == [shared, other]
+    assert [len(result) for result in results] == [1, 1, 1, 1]
+    for path, result in zip([shared, other, shared, shared], results):
+        with open(result[0].path) as fh:
+            assert fh.read() == path
+    # every item gets its own metadata object
+    assert results[0][0] is not results[2][0]
+    assert results[0][0].filename == results[2][0].filename
+
+
+def test_execute_many_raises_first_failure():
+    pipeline = FilePipeline(children=[DownloadStageHandler(children=[])])
+    with pytest.raises(InvalidFileException):
+        pipeline.execute_many(["missing://a", "missing://b"])
+    assert pipeline.execute_many([]) == []
+
+
+class ReenteringHandler(FileHandler):
+    """Needs its own file again while producing it, from another stage's pool."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    def should_handle(self, path: str) -> bool:
+        return path.startswith("reenter-test://")
+
+    def handle_file(self, path, **kwargs):
+        self.calls += 1
+        if self.calls == 1:
+            # Runs on a thread of the CONVERT pool, not the producing thread
+            run_in_stage_pool("CONVERT", self.execute, path, skip_cache=True)
+        with self.write_file("txt") as fh:
+            fh.write(path.encode("utf-8"))
+
+
+def test_execute_reentering_own_file_from_another_pool_does_not_wait():
+    handler = ReenteringHandler()
+    pipeline = FilePipeline(children=[DownloadStageHandler(children=[handler])])
+    path = "reenter-test://{}".format(uuid.uuid4().hex)
+    result = []
+
+    thread = threading.Thread(
+        target=lambda: result.append(pipeline.execute(path, skip_cache=True)),
+        daemon=True,
+    )
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert handler.calls == 2
+    assert len(result) == 1
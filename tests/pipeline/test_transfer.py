@@ -17,6 +17,7 @@ from ricecooker.utils.pipeline.context import FileMetadata
 from ricecooker.utils.pipeline.exceptions import InvalidFileException
 from ricecooker.utils.pipeline.file_handler import FileHandler
 from ricecooker.utils.pipeline.transfer import Base64FileHandler
+from ricecooker.utils.pipeline.transfer import CatchAllWebResourceDownloadHandler
 from ricecooker.utils.pipeline.transfer import DiskResourceHandler
 from ricecooker.utils.pipeline.transfer import DownloadStageHandler
 from ricecooker.utils.pipeline.transfer import (
@@ -642,3 +643,58 @@ def test_default_pipeline_renders_html_and_downloads_other_sources():
         assert pipeline.should_handle("https://spa.example/") is True
         # A non-HTML resource still routes to a default download handler.
         assert pipeline.should_handle("https://example.com/x.pdf") is True
+
+
+def _fake_download(content, status_code=200, headers=None):
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    response.iter_content.return_value = [content]
+    return response
+
+
+def test_download_revalidation_reuses_unchanged_files():
+    url = "https://example.com/revalidate/unchanged.pdf"
+    headers = {"ETag": '"v1"', "Last-Modified": "Wed, 01 Jan 2025 00:00:00 GMT"}
+    get = MagicMock(return_value=_fake_download(b"version 1", headers=headers))
+    with patch.object(config.DOWNLOAD_SESSION, "get", get):
+        first = CatchAllWebResourceDownloadHandler().execute(url, skip_cache=True)[0]
+
+    get = MagicMock(return_value=_fake_download(b"", status_code=304))
+    with (
+        patch.object(config.DOWNLOAD_SESSION, "get", get),
+        patch("ricecooker.config.REVALIDATE", True),
+    ):
+        handler = CatchAllWebResourceDownloadHandler()
+        second = handler.execute(url)[0]
+        # Each URL is only revalidated once per run
+        handler.execute(url)
+
+    assert second.path == first.path
+    get.assert_called_once()
+    assert get.call_args.kwargs["headers"] == {
+        "If-None-Match": '"v1"',
+        "If-Modified-Since": "Wed, 01 Jan 2025 00:00:00 GMT",
+    }
+
+
+def test_download_revalidation_downloads_changed_files():
+    url = "https://example.com/revalidate/changed.pdf"
+    get = MagicMock(return_value=_fake_download(b"version 1", headers={"ETag": "1"}))
+    with patch.object(config.DOWNLOAD_SESSION, "get", get):
+        first = CatchAllWebResourceDownloadHandler().execute(url, skip_cache=True)[0]
+
+    get = MagicMock(return_value=_fake_download(b"version 2", headers={"ETag": "2"}))
+    with (
+        patch.object(config.DOWNLOAD_SESSION, "get", get),
+        patch("ricecooker.config.REVALIDATE", True),
+    ):
+        handler = CatchAllWebResourceDownloadHandler()
+        second = handler.execute(url)[0]
+        # Later references in the same run use the refreshed download
+        third = handler.execute(url)[0]
+
+    assert second.path != first.path
+    assert third.path == second.path
+    with open(second.path, "rb") as f:
+        assert f.read() == b"version 2"
+    # The answer to the conditional request is the download
+    assert get.call_count == 1
@@ -0,0 +1,118 @@
+import os
+import threading
+import time
+from unittest.mock import patch
+
+from ricecooker import config
+from ricecooker.utils.pipeline.context import FileMetadata
+from ricecooker.utils.pipeline.convert import ConversionStageHandler
+from ricecooker.utils.pipeline.file_handler import FileHandler
+from ricecooker.utils.pipeline.workers import get_pipeline_threads
+from ricecooker.utils.pipeline.workers import run_in_process_pool
+from ricecooker.utils.pipeline.workers import run_in_stage_pool
+
+
+class ConcurrencyTrackingHandler(FileHandler):
+    """Records the threads it runs on and how many of its calls overlap."""
+
+    def __init__(self):
+        super().__init__()
+        self.threads = set()
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def should_handle(self, path: str) -> bool:
+        return path.startswith("stage-test://")
+
+    def handle_file(self, path, **kwargs):
+        with self.lock:
+            self.threads.add(threading.current_thread().name)
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self.lock:
+            self.running -= 1
+        self._output_path = "/storage/{}.txt".format(path.split("/")[-1])
+        return FileMetadata(original_filename="file.txt")
+
+
+def test_stage_runs_on_its_pool_with_limited_concurrency():
+    handler = ConcurrencyTrackingHandler()
+    stage = ConversionStageHandler(children=[handler])
+    results = {}
+
+    def convert(i):
+        results[i] = stage.execute("stage-test://{}".format(i), skip_cache=True)
+
+    with patch.object(config, "CONVERT_WORKERS", 2):
+        threads = [threading.Thread(target=convert, args=(i,)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert handler.max_running == 2
+    assert all(name.startswith("ricecooker-convert") for name in handler.threads)
+    # the output path written on the worker thread reaches the caller
+    assert {i: r[0].path for i, r in results.items()} == {
+        i: "/storage/{}.txt".format(i) for i in range(6)
+    }
+
+
+def test_nested_work_of_the_same_stage_runs_inline():
+    def outer():
+        # would wait forever for the only worker if it was submitted to the pool
+        return run_in_stage_pool("CONVERT", threading.current_thread)
+
+    with patch.object(config, "CONVERT_WORKERS", 1):
+        inner_thread = run_in_stage_pool("CONVERT", outer)
+    assert inner_thread.name.startswith("ricecooker-convert")
+    assert run_in_stage_pool("CUSTOM", threading.current_thread) is (
+        threading.current_thread()
+    )
+
+
+def test_pipeline_threads_keep_every_pool_busy():
+    with patch.multiple(
+        config,
+        TASK_THREADS=5,
+        DOWNLOAD_WORKERS=8,
+        CONVERT_WORKERS=2,
+        METADATA_WORKERS=2,
+    ):
+        assert get_pipeline_threads() == 12
+
+
+class ProcessIdHandler(FileHandler):
+    """CPU-bound handler writing the id of the process it runs in to storage."""
+
+    CPU_BOUND = True
+
+    def should_handle(self, path: str) -> bool:
+        return True
+
+    def handle_file(self, path, **kwargs):
+        with self.write_file("txt") as fh:
+            fh.write(str(os.getpid()).encode("utf-8"))
+        return FileMetadata(original_filename=str(os.getpid()))
+
+
+def test_cpu_bound_handler_runs_in_worker_process():
+    stage = ConversionStageHandler(children=[ProcessIdHandler()])
+    with patch.object(config, "PROCESS_WORKERS", 1):
+        result = stage.execute("process-test://file", skip_cache=True)[0]
+    worker_pid = result.original_filename
+    assert worker_pid != str(os.getpid())
+    # the file the worker wrote is in this process's storage directory
+    assert result.path == config.get_storage_path(result.filename)
+    with open(result.path) as fh:
+        assert fh.read() == worker_pid
+
+
+def test_process_pool_falls_back_to_calling_thread():
+    with patch.object(config, "PROCESS_WORKERS", 0):
+        assert run_in_process_pool(os.getpid) == os.getpid()
+    # lambdas cannot be sent to another process
+    with patch.object(config, "PROCESS_WORKERS", 1):
+        assert run_in_process_pool(lambda: os.getpid()) == os.getpid()
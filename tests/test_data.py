@@ -8,6 +8,7 @@ from le_utils.constants import content_kinds
 
 from ricecooker.classes.nodes import ChannelNode
 from ricecooker.classes.nodes import TopicNode
+from ricecooker.classes.questions import InputQuestion
 from ricecooker.exceptions import InvalidNodeException
 from ricecooker.exceptions import InvalidQuestionException
 
@@ -71,6 +72,12 @@ def test_validate(
     pytest.raises(InvalidQuestionException, exercise_invalid_question.validate)
 
 
+def test_invalid_question_message_describes_question():
+    question = InputQuestion("question_2", "Question 2", ["Answer"])
+    with pytest.raises(InvalidQuestionException, match="'source_id': 'question_2'"):
+        question.validate()
+
+
 """ *********** ALT DOMAIN TESTS *********** """
 
 
@@ -40,6 +40,8 @@ from ricecooker.exceptions import FileNotFoundException
 from ricecooker.utils.audio import AudioCompressionError
 from ricecooker.utils.pipeline.convert import PDFValidationHandler
 from ricecooker.utils.pipeline.exceptions import InvalidFileException
+from ricecooker.utils.storage import copy_file_to_storage
+from ricecooker.utils.storage import get_storage_metadata
 from ricecooker.utils.videos import VideoCompressionError
 from ricecooker.utils.zip import create_predictable_zip
 
@@ -74,6 +76,21 @@ def test_size_missing_storage_file_raises_descriptive_error():
     assert storage_path in str(exc_info.value)
 
 
+def test_size_uses_metadata_recorded_when_copied_to_storage(tmp_path):
+    source = tmp_path / "source.pdf"
+    source.write_bytes(b"%PDF-1.4 metadata")
+    filename = copy_file_to_storage(str(source))
+    metadata = get_storage_metadata(filename)
+    assert metadata.size == 17
+    assert metadata.checksum == filename.split(".")[0]
+    assert metadata.extension == "pdf"
+
+    with patch("ricecooker.utils.storage.os.stat") as stat:
+        assert File(filename=filename).size == 17
+        assert File(filename=filename, preset="document").to_dict()["size"] == 17
+    stat.assert_not_called()
+
+
 @pytest.fixture
 def mock_filecache():
     """
@@ -1537,6 +1554,35 @@ def test_studiofile_validation_failure(mock_get_storage_url):
         assert studio_file._validated is False
 
 
+@patch("ricecooker.config.get_storage_url")
+def test_studiofile_validation_uses_remote_index(mock_get_storage_url, tmp_path):
+    """A StudioFile confirmed by an earlier run is validated without a HEAD request"""
+    checksum = "indexed123hash456"
+    ext = "mp4"
+    preset = format_presets.VIDEO_HIGH_RES
+    mock_get_storage_url.return_value = f"https://storage.example.com/{checksum}.{ext}"
+
+    with (
+        patch("ricecooker.config.REMOTE_INDEX_PATH", str(tmp_path / "index.sqlite3")),
+        patch("ricecooker.config.DOWNLOAD_SESSION") as mock_session,
+    ):
+        mock_response = MagicMock()
+        mock_response.headers = {"Content-Length": "2048"}
+        mock_session.head.return_value = mock_response
+
+        StudioFile(checksum=checksum, ext=ext, preset=preset).validate()
+        studio_file = StudioFile(checksum=checksum, ext=ext, preset=preset)
+        studio_file.validate()
+
+        assert studio_file._validated is True
+        assert studio_file.size == 2048
+        mock_session.head.assert_called_once()
+
+        with patch("ricecooker.config.RECHECK_REMOTE", True):
+            StudioFile(checksum=checksum, ext=ext, preset=preset).validate()
+        assert mock_session.head.call_count == 2
+
+
 def test_studiofile_str_representation():
     """Test StudioFile string representation"""
     checksum = "str123test456"
@@ -13,7 +13,10 @@ from le_utils.constants.licenses import CC_BY_SA
 from le_utils.constants.licenses import PUBLIC_DOMAIN
 from le_utils.constants.licenses import SPECIAL_PERMISSIONS
 
+from ricecooker import config
 from ricecooker.classes.licenses import get_license
+from ricecooker.classes.licenses import get_shared_license
+from ricecooker.classes.nodes import TopicNode
 
 """ *********** LICENSE FIXTURES *********** """
 
@@ -107,3 +110,23 @@ def test_license_serilizibility(license_objects, special_license):
 
         same_attributes = _compare_licence_objects(licence_orig, license_copy)
         assert same_attributes, "License attributes not the same after serizlize"
+
+
+def test_truncating_nodes_leaves_shared_licenses_unchanged():
+    holder = "h" * (config.MAX_COPYRIGHT_HOLDER_LENGTH + 10)
+    first = TopicNode("t1", "T1", license=CC_BY, copyright_holder=holder)
+    second = TopicNode("t2", "T2", license=CC_BY, copyright_holder=holder)
+    shared = first.license
+    assert second.license is shared
+
+    first.truncate_fields()
+
+    assert len(first.license.copyright_holder) == config.MAX_COPYRIGHT_HOLDER_LENGTH
+    assert shared.copyright_holder == holder
+    assert second.license.copyright_holder == holder
+    assert get_shared_license(CC_BY, holder, None).copyright_holder == holder
+
+
+def test_truncated_returns_license_that_fits():
+    license = get_license(CC_BY, copyright_holder="Demo Holdings")
+    assert license.truncated() is license
@@ -1,7 +1,12 @@
 """Tests for tree construction"""
 
+import json
 import os
+import pickle
+import shutil
 import tempfile
+import threading
+import time
 import uuid
 from unittest.mock import MagicMock
 from unittest.mock import mock_open
@@ -9,6 +14,7 @@ from unittest.mock import patch
 
 import pytest
 from le_utils.constants import content_kinds
+from le_utils.constants import exercises
 from le_utils.constants import file_types
 from le_utils.constants import format_presets
 from le_utils.constants import licenses
@@ -31,17 +37,26 @@ from ricecooker.classes.nodes import ContentNode
 from ricecooker.classes.nodes import CustomNavigationChannelNode
 from ricecooker.classes.nodes import CustomNavigationNode
 from ricecooker.classes.nodes import DocumentNode
+from ricecooker.classes.nodes import ExerciseNode
 from ricecooker.classes.nodes import Node
 from ricecooker.classes.nodes import RemoteContentNode
 from ricecooker.classes.nodes import SlideshowNode
 from ricecooker.classes.nodes import TopicNode
 from ricecooker.classes.nodes import TreeNode
+from ricecooker.classes.questions import SingleSelectQuestion
 from ricecooker.exceptions import FileNotFoundException
 from ricecooker.exceptions import InvalidNodeException
+from ricecooker.managers.journal import TreeJournal
+from ricecooker.managers.scheduler import TaskGraph
 from ricecooker.managers.tree import ChannelManager
+from ricecooker.managers.tree import ChunkSizer
 from ricecooker.managers.tree import InsufficientStorageException
+from ricecooker.managers.tree import UploadScheduler
+from ricecooker.utils import studio_api
 from ricecooker.utils.jsontrees import build_tree_from_json
 from ricecooker.utils.pipeline import FilePipeline
+from ricecooker.utils.run_report import start_run_report
+from ricecooker.utils.storage import get_storage_metadata
 from ricecooker.utils.zip import create_predictable_zip
 
 """ *********** TOPIC FIXTURES *********** """
@@ -1127,9 +1142,7 @@ def test_add_nodes_skips_invalid_nodes(channel):
     # Mock the session post response
     mock_response = MagicMock()
     mock_response.status_code = 200
-    mock_response._content = '{"root_ids": {"valid_hex": "new_root_id"}}'.encode(
-        "utf-8"
-    )
+    mock_response.content = '{"root_ids": {"valid_hex": "new_root_id"}}'.encode("utf-8")
 
     # Call add_nodes
     with patch("ricecooker.config.SESSION.post", return_value=mock_response):
@@ -1206,6 +1219,269 @@ def test_add_nodes_handles_server_error(channel):
     assert manager.failed_node_builds["root_id"]["content"] == b"Server error"
 
 
+def test_add_nodes_sends_subtrees_concurrently_in_order(channel):
+    """add_nodes creates independent subtrees in parallel, keeping children in order."""
+    for i in range(3):
+        topic = TopicNode("topic-{}".format(i), "Topic {}".format(i))
+        for j in range(15):
+            topic.add_child(TopicNode("sub-{}-{}".format(i, j), "Sub {}".format(j)))
+        channel.add_child(topic)
+
+    manager = ChannelManager(channel)
+    manager.node_count_dict = {"upload_count": 0, "total_count": 48}
+    for node in [channel] + channel.children:
+        for child in node.children:
+            child.valid = True
+
+    lock = threading.Lock()
+    state = {"in_flight": 0, "max_in_flight": 0}
+    posted = {}
+
+    def post(url, data=None):
+        payload = json.loads(data)
+        with lock:
+            state["in_flight"] += 1
+            state["max_in_flight"] = max(state["max_in_flight"], state["in_flight"])
+        time.sleep(0.02)
+        node_ids = [child["node_id"] for child in payload["content_data"]]
+        with lock:
+            state["in_flight"] -= 1
+            posted.setdefault(payload["root_id"], []).extend(node_ids)
+        response = MagicMock()
+        response.status_code = 200
+        response.content = json.dumps(
+            {"root_ids": {node_id: "root-" + node_id for node_id in node_ids}}
+        ).encode("utf-8")
+        return response
+
+    with (
+        patch("ricecooker.config.ADD_NODES_THREADS", 2),
+        patch("ricecooker.config.SESSION.post", side_effect=post),
+    ):
+        manager.add_nodes("channel-root", channel)
+
+    assert not manager.failed_node_builds
+    assert manager.node_count_dict["upload_count"] == 48
+    assert 1 < state["max_in_flight"] <= 2
+    assert posted["channel-root"] == [t.get_node_id().hex for t in channel.children]
+    for topic in channel.children:
+        assert posted["root-" + topic.get_node_id().hex] == [
+            child.get_node_id().hex for child in topic.children
+        ]
+
+
+def _topic_channel(channel, count):
+    for i in range(count):
+        topic = TopicNode("topic-{}".format(i), "Topic {}".format(i))
+        topic.valid = True
+        channel.add_child(topic)
+    manager = ChannelManager(channel)
+    manager.node_count_dict = {"upload_count": 0, "total_count": count}
+    return manager
+
+
+def _add_nodes_response(payload, status_code=200):
+    response = MagicMock()
+    response.status_code = status_code
+    response.reason = "Gateway Timeout"
+    response.content = json.dumps(
+        {"root_ids": {c["node_id"]: "root" for c in payload["content_data"]}}
+    ).encode("utf-8")
+    return response
+
+
+def test_chunk_sizer_adapts_to_latency_and_errors():
+    sizer = ChunkSizer(max_bytes=100 * 1024)
+    sizer.record_success(latency=0.5)
+    assert sizer.max_bytes == 100 * 1024 + ChunkSizer.INCREASE_BYTES
+    sizer.record_success(latency=ChunkSizer.TARGET_LATENCY + 1)
+    assert sizer.max_bytes == (100 * 1024 + ChunkSizer.INCREASE_BYTES) // 2
+    for _ in range(20):
+        sizer.record_failure()
+    assert sizer.max_bytes == ChunkSizer.MIN_BYTES
+
+
+def test_add_nodes_chunks_by_payload_bytes(channel):
+    manager = _topic_channel(channel, 12)
+    topic_size = len(studio_api.dumps(channel.children[0].to_dict()))
+    manager._chunk_sizer.max_bytes = topic_size * 5 - 1
+    manager._chunk_sizer.INCREASE_BYTES = 0
+    chunk_sizes = []
+
+    def post(url, data=None):
+        payload = json.loads(data)
+        chunk_sizes.append(len(payload["content_data"]))
+        return _add_nodes_response(payload)
+
+    with patch("ricecooker.config.SESSION.post", side_effect=post):
+        manager.add_nodes("channel-root", channel)
+
+    assert chunk_sizes == [4, 4, 4]  # five topics never fit in the budget
+    assert manager.node_count_dict["upload_count"] == 12
+    assert not manager._node_payloads
+
+
+def test_add_nodes_shrinks_and_retries_failed_chunks(channel):
+    manager = _topic_channel(channel, 4)
+    chunk_sizes = []
+
+    def post(url, data=None):
+        payload = json.loads(data)
+        chunk_sizes.append(len(payload["content_data"]))
+        status_code = 502 if len(payload["content_data"]) > 2 else 200
+        return _add_nodes_response(payload, status_code=status_code)
+
+    with patch("ricecooker.config.SESSION.post", side_effect=post):
+        manager.add_nodes("channel-root", channel)
+
+    assert chunk_sizes == [4, 2, 2]
+    assert not manager.failed_node_builds
+    assert manager.node_count_dict["upload_count"] == 4
+
+
+@pytest.mark.parametrize("status_code", [500, 504])
+def test_add_nodes_does_not_resend_chunks_studio_may_have_created(channel, status_code):
+    manager = _topic_channel(channel, 4)
+    chunk_sizes = []
+
+    def post(url, data=None):
+        payload = json.loads(data)
+        chunk_sizes.append(len(payload["content_data"]))
+        return _add_nodes_response(payload, status_code=status_code)
+
+    with patch("ricecooker.config.SESSION.post", side_effect=post):
+        manager.add_nodes("channel-root", channel)
+
+    assert chunk_sizes == [4]
+    assert "channel-root" in manager.failed_node_builds
+
+
+def test_tree_journal_finds_latest_unfinished_run(tmp_path):
+    journal = TreeJournal("channel", run_id="run-1", directory=str(tmp_path))
+    journal.start("studio-root")
+    journal.record({"node-a": "root-a"})
+    journal.finish()
+    assert TreeJournal.latest("channel", directory=str(tmp_path)) is None
+
+    journal = TreeJournal("channel", run_id="run-2", directory=str(tmp_path))
+    journal.start("studio-root-2")
+    journal.record({"node-b": "root-b"})
+    with open(journal.path, "a") as journal_file:
+        journal_file.write('{"node_id": "node-c", "ro')  # run died mid-write
+
+    resumed = TreeJournal.latest("channel", directory=str(tmp_path))
+    assert resumed.run_id == "run-2"
+    assert resumed.root_id == "studio-root-2"
+    assert resumed.root_ids == {"node-b": "root-b"}
+
+
+def test_add_nodes_resume_skips_created_subtrees(channel, tmp_path):
+    manager = _topic_channel(channel, 4)
+    for topic in channel.children[:2]:
+        child = TopicNode(topic.source_id + "-sub", "Sub")
+        child.valid = True
+        topic.add_child(child)
+    journal = TreeJournal("channel", run_id="run", directory=str(tmp_path))
+    journal.start("channel-root")
+    journal.record({channel.children[0].get_node_id().hex: "root-0"})
+    journal.record({channel.children[0].children[0].get_node_id().hex: "root-0-0"})
+    journal.record({channel.children[1].get_node_id().hex: "root-1"})
+    manager.journal = journal
+    posted = []
+
+    def post(url, data=None):
+        payload = json.loads(data)
+        posted.append(payload["root_id"])
+        return _add_nodes_response(payload)
+
+    with patch("ricecooker.config.SESSION.post", side_effect=post):
+        manager.add_nodes("channel-root", channel)
+
+    # Only the unconfirmed child of topic 1 and topics 2 and 3 are sent
+    assert sorted(posted) == ["channel-root", "root-1"]
+    assert manager.node_count_dict["upload_count"] == 6
+    assert len(TreeJournal("channel", "run", str(tmp_path)).root_ids) == 6
+
+
+def test_add_nodes_resume_keeps_created_subtrees_when_retrying(channel, tmp_path):
+    manager = _topic_channel(channel, 4)
+    child = TopicNode("topic-0-sub", "Sub")
+    child.valid = True
+    channel.children[0].add_child(child)
+    journal = TreeJournal("channel", run_id="run", directory=str(tmp_path))
+    journal.start("channel-root")
+    journal.record({channel.children[0].get_node_id().hex: "root-0"})
+    manager.journal = journal
+    posted = []
+
+    def post(url, data=None):
+        payload = json.loads(data)
+        posted.append((payload["root_id"], len(payload["content_data"])))
+        status_code = 502 if len(payload["content_data"]) > 2 else 200
+        return _add_nodes_response(payload, status_code=status_code)
+
+    with patch("ricecooker.config.SESSION.post", side_effect=post):
+        manager.add_nodes("channel-root", channel)
+
+    # The child of the topic confirmed by the journal is still sent
+    assert ("root-0", 1) in posted
+    assert ("channel-root", 3) in posted
+    assert manager.node_count_dict["upload_count"] == 5
+
+
+def _drain(scheduler):
+    order = []
+    while True:
+        filename = scheduler.next()
+        if filename is None:
+            return order
+        order.append(filename)
+        scheduler.done(filename)
+
+
+def test_upload_scheduler_orders_by_size():
+    sizes = {"thumb.png": 10, "big.mp4": 1000, "doc.pdf": 50, "huge.mp4": 5000}
+
+    largest_first = UploadScheduler(sizes, large_size=500, order="largest-first")
+    assert _drain(largest_first) == ["huge.mp4", "big.mp4", "doc.pdf", "thumb.png"]
+
+    mixed = UploadScheduler(sizes, large_size=500, order="mixed")
+    assert _drain(mixed) == ["huge.mp4", "big.mp4", "thumb.png", "doc.pdf"]
+
+
+def test_upload_scheduler_caps_large_uploads():
+    sizes = {"a.mp4": 1000, "b.mp4": 900, "c.mp4": 800, "thumb.png": 10}
+    scheduler = UploadScheduler(sizes, max_large=2, large_size=500)
+
+    assert scheduler.next() == "a.mp4"
+    assert scheduler.next() == "b.mp4"
+    # Both large slots are taken, so small files go first
+    assert scheduler.next() == "thumb.png"
+    waiting = []
+    worker = threading.Thread(target=lambda: waiting.append(scheduler.next()))
+    worker.start()
+    worker.join(0.1)
+    assert worker.is_alive()
+    scheduler.done("a.mp4")
+    worker.join(1)
+    assert waiting == ["c.mp4"]
+
+
+def test_upload_files_stops_when_storage_runs_out(channel):
+    manager = ChannelManager(channel)
+    manager.file_map = {
+        "{}.png".format(i): MagicMock(size=10, skip_upload=False) for i in range(20)
+    }
+
+    with patch.object(
+        manager, "do_file_upload", side_effect=InsufficientStorageException("full")
+    ) as upload:
+        with pytest.raises(InsufficientStorageException):
+            manager.upload_files(list(manager.file_map))
+
+    assert upload.call_count <= config.TASK_THREADS
+
+
 def test_file_upload_insufficient_storage(channel):
     """Test that do_file_upload raises InsufficientStorageException on 412 response."""
     # Create a manager
@@ -1245,6 +1521,60 @@ def test_file_upload_insufficient_storage(channel):
             manager.do_file_upload(filename)
 
 
+@pytest.mark.parametrize("resumable", [True, False])
+def test_file_upload_large_file_is_resumable(channel, tmp_path, resumable):
+    """do_file_upload sends files above RESUMABLE_UPLOAD_THRESHOLD in resumable parts,
+    if Studio says its storage supports resumable uploads."""
+    manager = ChannelManager(channel)
+    filename = "large_file.mp4"
+    storage_path = tmp_path / filename
+    storage_path.write_bytes(b"x" * 100)
+    file_data = MagicMock()
+    file_data.skip_upload = False
+    file_data.size = 100
+    file_data.checksum = "abcdef1234567890"
+    file_data.original_filename = None
+    file_data.get_filename.return_value = filename
+    file_data.extension = "mp4"
+    manager.file_map = {filename: file_data}
+    url_response = MagicMock()
+    url_response.status_code = 200
+    url_response.json.return_value = {
+        "uploadURL": "https://storage/upload",
+        "mimetype": "video/mp4",
+        "might_skip": False,
+        "resumable": resumable,
+    }
+    put_response = MagicMock()
+    put_response.status_code = 200
+
+    with (
+        patch("ricecooker.config.RESUMABLE_UPLOAD_THRESHOLD", 50),
+        patch(
+            "ricecooker.config.get_existing_storage_path",
+            return_value=str(storage_path),
+        ),
+        patch("ricecooker.config.SESSION.post", return_value=url_response),
+        patch("ricecooker.config.SESSION.put", return_value=put_response) as put,
+        patch("ricecooker.managers.tree.ResumableUpload") as resumable_upload,
+        patch("ricecooker.managers.tree.confirm_remote") as confirm,
+        patch("ricecooker.managers.tree.forget_remote") as forget,
+    ):
+        manager.do_file_upload(filename)
+
+    if resumable:
+        resumable_upload.assert_called_once()
+        assert resumable_upload.call_args.kwargs["checksum"] == "abcdef1234567890"
+        resumable_upload.return_value.upload.assert_called_once()
+        put.assert_not_called()
+    else:
+        # A signed URL for a single PUT: no session is opened on it
+        resumable_upload.assert_not_called()
+        put.assert_called_once()
+    confirm.assert_called_once_with(filename, size=100)
+    forget.assert_called_once_with(filename)
+
+
 def test_file_upload_missing_storage_raises_descriptive_error(channel):
     """do_file_upload reports a cache/storage mismatch instead of a bare FileNotFoundError."""
     manager = ChannelManager(channel)
@@ -1302,9 +1632,7 @@ def test_add_nodes_checks_both_failed_files_and_validity(channel):
     # Mock the session post response
     mock_response = MagicMock()
     mock_response.status_code = 200
-    mock_response._content = '{"root_ids": {"valid-hex": "new-root-id"}}'.encode(
-        "utf-8"
-    )
+    mock_response.content = '{"root_ids": {"valid-hex": "new-root-id"}}'.encode("utf-8")
 
     # Call add_nodes
     with patch("ricecooker.config.SESSION.post", return_value=mock_response):
@@ -1426,3 +1754,495 @@ def test_create_initial_tree_deduplicates_reused_node(channel, document):
     t1, t2 = _place_under_two_topics(channel, document)
     create_initial_tree(channel)
     assert t1.children[0].get_node_id() != t2.children[0].get_node_id()
+
+
+""" *********** TREE TRAVERSAL TESTS *********** """
+
+
+def _build_deep_tree(channel, depth):
+    parent = channel
+    for i in range(depth):
+        topic = TopicNode("deep-{}".format(i), "Deep {}".format(i))
+        parent.add_child(topic)
+        parent = topic
+    return parent
+
+
+def test_walk_orders(channel):
+    t1, t2 = TopicNode("t1", "T1"), TopicNode("t2", "T2")
+    channel.add_child(t1)
+    channel.add_child(t2)
+    child = TopicNode("t1a", "T1a")
+    t1.add_child(child)
+    assert [(d, n.source_id) for d, n in channel.walk()] == [
+        (0, channel.source_id),
+        (1, "t1"),
+        (2, "t1a"),
+        (1, "t2"),
+    ]
+    assert [n.source_id for _, n in channel.walk(post_order=True)] == [
+        "t1a",
+        "t1",
+        "t2",
+        channel.source_id,
+    ]
+
+
+def test_count_cache_invalidated_by_tree_changes(channel):
+    topic = TopicNode("t1", "T1")
+    channel.add_child(topic)
+    assert channel.count() == 1
+    topic.add_child(TopicNode("t1a", "T1a"))
+    assert channel.count() == 2
+    topic.children = []
+    assert channel.count() == 1
+    assert channel.copy().count() == 1
+
+
+def test_count_cache_invalidated_by_children_list_changes(channel):
+    topic = TopicNode("t1", "T1")
+    channel.add_child(topic)
+    assert channel.count() == 1
+    # Chefs may change the children lists directly instead of using add_child
+    topic.children.append(TopicNode("t1a", "T1a"))
+    assert channel.count() == 2
+    topic.children.insert(0, TopicNode("t1b", "T1b"))
+    topic.children += [TopicNode("t1c", "T1c")]
+    assert channel.count() == 4
+    topic.children.remove(topic.children[0])
+    del topic.children[0]
+    assert channel.count() == 2
+    channel.children.pop()
+    assert channel.count() == 0
+    assert pickle.loads(pickle.dumps(channel)).count() == 0
+
+
+def test_deep_tree_does_not_recurse(channel):
+    leaf = _build_deep_tree(channel, 2000)
+    manager = ChannelManager(channel)
+    assert channel.count() == 2000
+    assert channel.get_topic_count() == 2001
+    assert len(manager.gather_tree_recur([], channel)) == 2001
+    manager.deduplicate_shared_nodes()
+    manager.truncate_fields(channel)
+    assert leaf.node_id is not None
+    assert leaf.gather_ancestor_metadata() is not None
+    assert channel.get_json_tree()["children"][0]["source_id"] == "deep-0"
+    assert channel.copy().count() == 2000
+
+
+def test_precomputed_node_ids_match_lazy_ones(channel):
+    leaf = _build_deep_tree(channel, 5)
+    lazy_leaf = _build_deep_tree(
+        ChannelNode(channel.source_id, channel.source_domain, "Copy", language="en"), 5
+    )
+    ChannelManager(channel).truncate_fields(channel)
+    assert leaf.node_id == lazy_leaf.get_node_id()
+
+
+def test_empty_metadata_fields_are_lists_on_use(channel):
+    node = TopicNode("t1", "T1")
+    channel.add_child(node)
+    assert node.to_dict()["grade_levels"] == []
+    node.tags.append("tag")
+    node.extra_fields["options"] = {}
+    assert node.tags == ["tag"]
+    assert node.to_dict()["tags"] == ["tag"]
+    assert json.loads(node.to_dict()["extra_fields"]) == {"options": {}}
+
+
+def test_nodes_keep_custom_attributes_when_copied():
+    node = TopicNode("t1", "T1", categories=[subjects.MATHEMATICS])
+    node.custom_attribute = "value"
+    clone = node.copy()
+    assert clone.custom_attribute == "value"
+    assert clone.categories == [subjects.MATHEMATICS]
+    assert clone.title == "T1"
+
+
+def test_nodes_share_license_objects():
+    def document(source_id, copyright_holder):
+        return DocumentNode(
+            source_id,
+            source_id,
+            license=licenses.CC_BY,
+            copyright_holder=copyright_holder,
+        )
+
+    assert document("a", "LE").license is document("b", "LE").license
+    assert document("c", "Other").license is not document("d", "LE").license
+
+
+def test_check_for_files_failed_describes_file(channel):
+    failed = DocumentFile("", language="fr")
+    failed.error = "Download failed"
+    with (
+        patch.object(config, "FAILED_FILES", [failed]),
+        patch.object(config.LOGGER, "warning") as warning,
+    ):
+        ChannelManager(channel).check_for_files_failed()
+    assert "'language': 'fr'" in warning.call_args[0][0]
+
+
+""" *********** INCREMENTAL REBUILD TESTS *********** """
+
+
+def _build_document_channel(document_path):
+    channel = ChannelNode("incremental", "incremental.example.com", "C", language="en")
+    topic = TopicNode("topic", "Topic")
+    channel.add_child(topic)
+    topic.add_child(
+        DocumentNode(
+            "document",
+            "Document",
+            licenses.CC_BY,
+            copyright_holder="Learning Equality",
+            files=[DocumentFile(document_path)],
+        )
+    )
+    return channel
+
+
+def _save_tree(manager, tree_path):
+    with open(tree_path, "w") as tree_file:
+        json.dump(manager.channel.get_json_tree(), tree_file)
+    manager.save_input_fingerprints(tree_path)
+
+
+def test_incremental_skips_unchanged_nodes(tmp_path):
+    document_path = os.path.join(
+        os.path.dirname(__file__), "testcontent", "samples", "41568-pdf.pdf"
+    )
+    tree_path = str(tmp_path / "run.json")
+    first_run = ChannelManager(_build_document_channel(document_path))
+    first_files = first_run.process_tree()
+    _save_tree(first_run, tree_path)
+
+    report = start_run_report()
+    second_run = ChannelManager(_build_document_channel(document_path))
+    second_run.start_incremental(tree_path)
+    with patch.object(DocumentFile, "process_file") as process_file:
+        second_files = second_run.process_tree()
+    process_file.assert_not_called()
+    assert sorted(second_files) == sorted(first_files)
+    # the channel and the topic have no files and are skipped too
+    assert report.counters["nodes_skipped"] == 3
+
+
+def test_incremental_processes_changed_nodes(tmp_path):
+    samples = os.path.join(os.path.dirname(__file__), "testcontent", "samples")
+    tree_path = str(tmp_path / "run.json")
+    first_run = ChannelManager(
+        _build_document_channel(os.path.join(samples, "41568-pdf.pdf"))
+    )
+    first_run.process_tree()
+    _save_tree(first_run, tree_path)
+
+    report = start_run_report()
+    second_run = ChannelManager(
+        _build_document_channel(os.path.join(samples, "sample_doc_with_toc.pdf"))
+    )
+    second_run.start_incremental(tree_path)
+    files = second_run.process_tree()
+    assert report.counters["nodes_skipped"] == 2
+    assert get_storage_metadata(files[0]) is not None
+
+
+def test_incremental_processes_files_edited_in_place(tmp_path):
+    samples = os.path.join(os.path.dirname(__file__), "testcontent", "samples")
+    document_path = str(tmp_path / "document.pdf")
+    shutil.copy(os.path.join(samples, "41568-pdf.pdf"), document_path)
+    tree_path = str(tmp_path / "run.json")
+    first_run = ChannelManager(_build_document_channel(document_path))
+    first_run.process_tree()
+    _save_tree(first_run, tree_path)
+
+    shutil.copy(os.path.join(samples, "sample_doc_with_toc.pdf"), document_path)
+    report = start_run_report()
+    second_run = ChannelManager(_build_document_channel(document_path))
+    second_run.start_incremental(tree_path)
+    second_run.process_tree()
+    # The document keeps its path but is processed again
+    assert report.counters["nodes_skipped"] == 2
+
+
+def test_incremental_matches_files_by_identity(tmp_path):
+    samples = os.path.join(os.path.dirname(__file__), "testcontent", "samples")
+
+    def build_channel():
+        channel = _build_document_channel(os.path.join(samples, "41568-pdf.pdf"))
+        document = channel.children[0].children[0]
+        document.set_thumbnail(os.path.join(samples, "thumbnail.png"))
+        return channel
+
+    tree_path = str(tmp_path / "run.json")
+    first_run = ChannelManager(build_channel())
+    first_run.process_tree()
+    _save_tree(first_run, tree_path)
+    with open(tree_path) as tree_file:
+        tree = json.load(tree_file)
+    recorded_files = tree["children"][0]["children"][0]["files"]
+    assert len(recorded_files) == 2
+    # The order of the files in the tree archive does not matter
+    recorded_files.reverse()
+    with open(tree_path, "w") as tree_file:
+        json.dump(tree, tree_file)
+
+    report = start_run_report()
+    second_run = ChannelManager(build_channel())
+    second_run.start_incremental(tree_path)
+    second_run.process_tree()
+    assert report.counters["nodes_skipped"] == 3
+    document = second_run.channel.children[0].children[0]
+    assert [f.filename for f in document.files] == [
+        f.filename for f in first_run.channel.children[0].children[0].files
+    ]
+
+
+def test_incremental_processes_nodes_when_compress_settings_change(tmp_path):
+    document_path = os.path.join(
+        os.path.dirname(__file__), "testcontent", "samples", "41568-pdf.pdf"
+    )
+    tree_path = str(tmp_path / "run.json")
+    with patch.object(config, "FILE_PIPELINE", FilePipeline()):
+        first_run = ChannelManager(_build_document_channel(document_path))
+        first_run.process_tree()
+        _save_tree(first_run, tree_path)
+
+    compress = FilePipeline(
+        default_context={
+            "video_settings": {"crf": 32, "max_height": 480},
+            "audio_settings": {"bit_rate": 96},
+        }
+    )
+    report = start_run_report()
+    with patch.object(config, "FILE_PIPELINE", compress):
+        second_run = ChannelManager(_build_document_channel(document_path))
+        second_run.start_incremental(tree_path)
+        second_run.process_tree()
+    # Only the channel and the topic, which have no files, are skipped
+    assert report.counters["nodes_skipped"] == 2
+
+
+def test_incremental_processes_every_node_with_update(tmp_path):
+    document_path = os.path.join(
+        os.path.dirname(__file__), "testcontent", "samples", "41568-pdf.pdf"
+    )
+    tree_path = str(tmp_path / "run.json")
+    first_run = ChannelManager(_build_document_channel(document_path))
+    first_run.process_tree()
+    _save_tree(first_run, tree_path)
+
+    report = start_run_report()
+    second_run = ChannelManager(_build_document_channel(document_path))
+    second_run.start_incremental(tree_path)
+    with patch.object(config, "UPDATE", True):
+        second_run.process_tree()
+    assert report.counters["nodes_skipped"] == 0
+
+
+def test_incremental_without_previous_tree(tmp_path):
+    manager = ChannelManager(_build_document_channel("unused.pdf"))
+    manager.start_incremental(str(tmp_path / "missing.json"))
+    assert manager.previous_tree is None
+
+
+""" *********** TASK SCHEDULING TESTS *********** """
+
+
+def test_task_graph_runs_dependencies_first():
+    finished = []
+    lock = threading.Lock()
+
+    def task(name, seconds):
+        time.sleep(seconds)
+        with lock:
+            finished.append(name)
+        return name
+
+    graph = TaskGraph()
+    graph.add("slow", task, "slow", 0.2)
+    graph.add("fast", task, "fast", 0)
+    graph.add("after-slow", task, "after-slow", 0, depends_on=["slow"])
+    graph.add("last", task, "last", 0, depends_on=["slow", "fast"])
+    results = dict(graph.run(max_workers=4))
+
+    assert results == {name: name for name in ("slow", "fast", "after-slow", "last")}
+    # independent tasks do not wait for the slow one
+    assert finished[0] == "fast"
+    assert finished.index("after-slow") > finished.index("slow")
+    assert finished.index("last") > finished.index("slow")
+
+
+def test_task_graph_stops_on_error():
+    def fail():
+        raise ValueError("failed")
+
+    dependent = MagicMock()
+    graph = TaskGraph()
+    graph.add("fail", fail)
+    graph.add("dependent", dependent, depends_on=["fail"])
+    with pytest.raises(ValueError):
+        list(graph.run(max_workers=2))
+    dependent.assert_not_called()
+    with pytest.raises(ValueError):
+        graph.add("unknown", dependent, depends_on=["missing"])
+
+
+def test_process_tree_generates_tiled_thumbnail_after_descendants(channel):
+    topic = TopicNode("tiled-topic", "Tiled", derive_thumbnail=True)
+    channel.add_child(topic)
+    documents = [
+        DocumentNode(
+            "tiled-document-{}".format(i),
+            "Document",
+            licenses.CC_BY,
+            copyright_holder="Learning Equality",
+        )
+        for i in range(4)
+    ]
+    for document in documents:
+        topic.add_child(document)
+    processed = []
+
+    def process_node(node):
+        if node is not topic:
+            time.sleep(0.05)
+        processed.append(node)
+        return {}
+
+    manager = ChannelManager(channel)
+    with patch.object(manager, "process_node", side_effect=process_node):
+        manager.process_tree()
+    assert processed.index(topic) > max(processed.index(d) for d in documents)
+
+
+def test_process_tree_processes_exercise_questions_once(channel):
+    exercise = ExerciseNode(
+        "scheduled-exercise",
+        "Exercise",
+        license=licenses.CC_BY,
+        copyright_holder="Learning Equality",
+        exercise_data={"mastery_model": exercises.M_OF_N, "m": 2, "n": 3},
+    )
+    questions = [
+        SingleSelectQuestion("scheduled-{}".format(i), "1 + {}?".format(i), "2", ["2"])
+        for i in range(3)
+    ]
+    for question in questions:
+        exercise.add_question(question)
+    channel.add_child(exercise)
+
+    manager = ChannelManager(channel)
+    with patch.object(
+        SingleSelectQuestion,
+        "process_question",
+        autospec=True,
+        return_value=[],
+    ) as process_question:
+        manager.process_tree()
+    assert process_question.call_count == len(questions)
+    assert all(question._processed for question in questions)
+    assert exercise._files_processed
+
+
+""" *********** STREAMING UPLOAD TESTS *********** """
+
+
+def _mock_node_with_files(*filenames):
+    node = MagicMock()
+    node.questions = []
+    node.files = []
+    for filename in filenames:
+        node_file = MagicMock()
+        node_file.get_filename.return_value = filename
+        node.files.append(node_file)
+    return node
+
+
+def test_stream_uploads_files_as_nodes_are_processed(channel):
+    manager = ChannelManager(channel)
+    uploaded = []
+
+    def check_file_exists(filename):
+        return filename == "exists.png"
+
+    with (
+        patch.object(manager, "check_file_exists", side_effect=check_file_exists),
+        patch.object(manager, "do_file_upload", side_effect=uploaded.append),
+    ):
+        manager.start_upload_stream(max_pending=1)
+        manager.process_node(_mock_node_with_files("a.mp4", "exists.png"))
+        manager.process_node(_mock_node_with_files("a.mp4", "b.pdf"))
+        manager.wait_for_uploads()
+
+    assert sorted(uploaded) == ["a.mp4", "b.pdf"]  # each file uploaded once
+    assert sorted(manager.uploaded_files) == ["a.mp4", "b.pdf"]
+    assert set(manager.file_map) == {"a.mp4", "b.pdf", "exists.png"}
+    assert manager._upload_queue is None
+
+
+def test_stream_uploads_reraises_insufficient_storage(channel):
+    manager = ChannelManager(channel)
+
+    with (
+        patch.object(manager, "check_file_exists", return_value=False),
+        patch.object(
+            manager,
+            "do_file_upload",
+            side_effect=InsufficientStorageException("out of space"),
+        ),
+    ):
+        manager.start_upload_stream()
+        manager.process_node(_mock_node_with_files("a.mp4"))
+        with pytest.raises(InsufficientStorageException):
+            manager.wait_for_uploads()
+
+
+def test_upload_tree_waits_for_streamed_uploads(channel):
+    manager = ChannelManager(channel)
+    manager.root_id, manager.channel_id = "root", "channel"
+
+    with (
+        patch.object(manager, "check_file_exists", return_value=False),
+        patch.object(manager, "do_file_upload"),
+        patch.object(manager, "add_nodes"),
+        patch.object(manager, "commit_channel", return_value=("channel", "link")),
+    ):
+        manager.start_upload_stream()
+        manager.process_node(_mock_node_with_files("a.mp4"))
+        manager.upload_tree()
+
+    assert manager.uploaded_files == ["a.mp4"]
+    assert manager._upload_queue is None
+
+
+def test_check_file_exists_skips_head_for_indexed_files(channel, tmp_path):
+    manager = ChannelManager(channel)
+    head_response = MagicMock()
+    head_response.status_code = 200
+    head_response.headers = {"Content-Length": "100"}
+
+    with (
+        patch("ricecooker.config.REMOTE_INDEX_PATH", str(tmp_path / "index.sqlite3")),
+        patch(
+            "ricecooker.config.DOWNLOAD_SESSION.head", return_value=head_response
+        ) as mock_head,
+    ):
+        assert manager.check_file_exists("abc.mp4")
+        assert manager.check_file_exists("abc.mp4")
+        assert mock_head.call_count == 1
+
+        with patch("ricecooker.config.RECHECK_REMOTE", True):
+            assert manager.check_file_exists("abc.mp4")
+        assert mock_head.call_count == 2
+
+        head_response.status_code = 404
+        assert not manager.check_file_exists("missing.mp4")
+
+        # A file removed from Studio is dropped from the index on recheck
+        with patch("ricecooker.config.RECHECK_REMOTE", True):
+            assert not manager.check_file_exists("abc.mp4")
+        head_response.status_code = 200
+        assert manager.check_file_exists("abc.mp4")
+        assert mock_head.call_count == 5
@@ -0,0 +1,37 @@
+import io
+from unittest.mock import patch
+
+from ricecooker.utils.bandwidth import get_upload_limiter
+from ricecooker.utils.bandwidth import RateLimiter
+from ricecooker.utils.bandwidth import throttle_upload
+from ricecooker.utils.bandwidth import ThrottledReader
+
+
+def test_rate_limiter_paces_reads():
+    with (
+        patch("ricecooker.utils.bandwidth.time.monotonic", return_value=0.0),
+        patch("ricecooker.utils.bandwidth.time.sleep") as sleep,
+    ):
+        limiter = RateLimiter(rate=1000)
+        limiter.consume(1000)  # the first second of data goes right away
+        sleep.assert_not_called()
+        limiter.consume(500)
+        sleep.assert_called_once_with(0.5)
+
+
+def test_throttled_reader_reports_remaining_length():
+    limiter = RateLimiter(rate=10**9)
+    reader = ThrottledReader(io.BytesIO(b"0123456789"), limiter, 10)
+    assert len(reader) == 10
+    assert reader.read(4) == b"0123"
+    assert len(reader) == 6
+
+
+def test_uploads_are_not_throttled_by_default():
+    file_obj = io.BytesIO(b"data")
+    with patch("ricecooker.config.UPLOAD_BANDWIDTH_LIMIT", None):
+        assert get_upload_limiter() is None
+        assert throttle_upload(file_obj, 4) is file_obj
+    with patch("ricecooker.config.UPLOAD_BANDWIDTH_LIMIT", 1000):
+        assert isinstance(throttle_upload(file_obj, 4), ThrottledReader)
+        assert get_upload_limiter() is get_upload_limiter()
@@ -0,0 +1,78 @@
+import hashlib
+import os
+from unittest.mock import patch
+
+import pytest
+
+from ricecooker.utils.hash_memo import FileHashMemo
+
+
+@pytest.fixture
+def memo(tmp_path):
+    return FileHashMemo(str(tmp_path / "hashes.sqlite3"))
+
+
+def _write(path, data, mtime_ns):
+    with open(path, "wb") as f:
+        f.write(data)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_hash_memo_skips_hashing_unchanged_files(memo, tmp_path):
+    path = str(tmp_path / "video.mp4")
+    _write(path, b"video", 1_000_000_000)
+
+    with patch(
+        "ricecooker.utils.hash_memo.get_hash", wraps=lambda p: "hash"
+    ) as get_hash:
+        assert memo.get_hash(path) == "hash"
+        assert memo.get_hash(path) == "hash"
+    assert get_hash.call_count == 1
+
+
+def test_hash_memo_rehashes_when_stat_changes(memo, tmp_path):
+    path = str(tmp_path / "video.mp4")
+    _write(path, b"video", 1_000_000_000)
+    assert memo.get_hash(path) == hashlib.md5(b"video").hexdigest()
+
+    # Same size, new modification time
+    _write(path, b"audio", 2_000_000_000)
+    assert memo.get_hash(path) == hashlib.md5(b"audio").hexdigest()
+
+    # Same modification time, new size
+    _write(path, b"longer audio", 2_000_000_000)
+    assert memo.get_hash(path) == hashlib.md5(b"longer audio").hexdigest()
+
+
+def test_hash_memo_persists_between_instances(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    _write(path, b"video", 1_000_000_000)
+    memo = FileHashMemo(str(tmp_path / "hashes.sqlite3"))
+    memo.get_hash(path)
+    memo.close()
+
+    with patch("ricecooker.utils.hash_memo.get_hash") as get_hash:
+        memo = FileHashMemo(str(tmp_path / "hashes.sqlite3"))
+        assert memo.get_hash(path) == hashlib.md5(b"video").hexdigest()
+    get_hash.assert_not_called()
+
+
+def test_hash_memo_missing_file(memo, tmp_path):
+    with pytest.raises(OSError):
+        memo.get_hash(str(tmp_path / "missing.mp4"))
+
+
+def test_hash_memo_forget_and_prune(memo, tmp_path):
+    kept = str(tmp_path / "kept.mp4")
+    removed = str(tmp_path / "removed.mp4")
+    deleted = str(tmp_path / "deleted.mp4")
+    for path in (kept, removed, deleted):
+        _write(path, b"video", 1_000_000_000)
+        memo.get_hash(path)
+
+    memo.forget([removed])
+    os.remove(deleted)
+    assert memo.prune() == 1
+
+    rows = memo._connection.execute("SELECT path FROM file_hashes").fetchall()
+    assert rows == [(kept,)]
@@ -0,0 +1,84 @@
+import threading
+import time
+from unittest.mock import patch
+
+from ricecooker.utils.host_limits import HostLimit
+from ricecooker.utils.host_limits import HostLimiter
+from ricecooker.utils.run_report import start_run_report
+
+
+def test_host_limit_caps_concurrent_downloads():
+    limit = HostLimit(max_concurrent=2)
+    running = []
+    most_running = []
+    lock = threading.Lock()
+
+    def download():
+        with limit.acquire():
+            with lock:
+                running.append(1)
+                most_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+    threads = [threading.Thread(target=download) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(most_running) == 2
+
+
+def test_host_limit_spaces_out_requests():
+    now = [100.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    with (
+        patch("ricecooker.utils.host_limits.time.monotonic", lambda: now[0]),
+        patch("ricecooker.utils.host_limits.time.sleep", sleep),
+    ):
+        limit = HostLimit(requests_per_second=2, burst=2)
+        waits = []
+        for _ in range(4):
+            with limit.acquire() as waited:
+                waits.append(waited)
+
+    # The burst starts right away, then one request every half second
+    assert waits == [0, 0, 0.5, 0.5]
+    assert sleeps == [0.5, 0.5]
+
+
+def test_host_limiter_selects_limits_by_domain_pattern():
+    limiter = HostLimiter(
+        {"*.partner.org": {"max_concurrent": 1}, "cdn.example.com": {}},
+        default_limits={"max_concurrent": 8},
+    )
+
+    partner = limiter.get_limit("https://files.partner.org/a.mp4")
+    assert partner.max_concurrent == 1
+    # Hosts matching the same pattern are limited separately
+    assert limiter.get_limit("https://www.partner.org/b.mp4") is not partner
+    assert limiter.get_limit("https://files.partner.org/c.mp4") is partner
+    assert limiter.get_limit("https://cdn.example.com/d.mp4") is None
+    assert limiter.get_limit("https://other.org/e.mp4").max_concurrent == 8
+    assert limiter.get_limit("relative/path.png") is None
+
+
+def test_host_limiter_records_wait_times_in_run_report():
+    report = start_run_report()
+    limiter = HostLimiter({"*": {"max_concurrent": 1}})
+
+    with limiter.limit("https://Files.Partner.org/a.mp4"):
+        pass
+    with limiter.limit("https://files.partner.org/b.mp4"):
+        pass
+
+    hosts = report.to_dict()["download_hosts"]
+    assert hosts["files.partner.org"]["downloads"] == 2
+    assert hosts["files.partner.org"]["wait_seconds"] >= 0
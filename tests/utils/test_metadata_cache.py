@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+from cachecontrol.caches.file_cache import FileCache
+
+from ricecooker.utils.metadata_cache import get_cache_backend
+from ricecooker.utils.metadata_cache import SQLiteCache
+
+
+def test_sqlite_cache_get_set_delete(tmp_path):
+    cache = SQLiteCache(str(tmp_path))
+    assert cache.get("DOWNLOAD:a.mp4") is None
+
+    cache.set("DOWNLOAD:a.mp4", b'{"filename": "abc.mp4"}')
+    assert cache.get("DOWNLOAD:a.mp4") == b'{"filename": "abc.mp4"}'
+
+    cache.delete("DOWNLOAD:a.mp4")
+    assert cache.get("DOWNLOAD:a.mp4") is None
+
+
+def test_sqlite_cache_batched_lookups(tmp_path):
+    cache = SQLiteCache(str(tmp_path))
+    cache.set_many(("key {}".format(i), bytes([i % 256])) for i in range(1200))
+
+    keys = ["key {}".format(i) for i in range(0, 1200, 2)] + ["missing"]
+    values = cache.get_many(keys)
+
+    assert values["missing"] is None
+    assert values["key 600"] == bytes([600 % 256])
+    assert len(values) == len(keys)
+
+
+def test_sqlite_cache_persists_between_instances(tmp_path):
+    cache = SQLiteCache(str(tmp_path))
+    cache.set("key", b"value")
+    cache.close()
+
+    assert SQLiteCache(str(tmp_path)).get("key") == b"value"
+
+
+def test_sqlite_cache_imports_file_cache_entries(tmp_path):
+    file_cache = FileCache(str(tmp_path), forever=True)
+    file_cache.set("DOWNLOAD:a.mp4", b'{"filename": "abc.mp4"}')
+    file_cache.set("GRAPHIE: b", b"def.graphie")
+
+    cache = SQLiteCache(str(tmp_path))
+    assert cache.get("DOWNLOAD:a.mp4") == b'{"filename": "abc.mp4"}'
+    assert cache.get("GRAPHIE: b") == b"def.graphie"
+
+    # The import only happens once: entries written later by an older ricecooker
+    # version are not picked up again
+    cache.delete("GRAPHIE: b")
+    cache.close()
+    assert SQLiteCache(str(tmp_path)).get("GRAPHIE: b") is None
+
+
+def test_sqlite_cache_concurrent_threads(tmp_path):
+    cache = SQLiteCache(str(tmp_path))
+    errors = []
+
+    def worker(n):
+        try:
+            for i in range(50):
+                key = "thread {} key {}".format(n, i)
+                cache.set(key, key.encode())
+                assert cache.get(key) == key.encode()
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert cache.get("thread 7 key 49") == b"thread 7 key 49"
+
+
+def test_get_cache_backend(tmp_path):
+    assert isinstance(get_cache_backend(str(tmp_path)), SQLiteCache)
+    assert isinstance(get_cache_backend(str(tmp_path), "file"), FileCache)
+    assert get_cache_backend(str(tmp_path), "file").forever
+    assert not get_cache_backend(str(tmp_path), "file", forever=False).forever
+    with pytest.raises(ValueError):
+        get_cache_backend(str(tmp_path), "redis")
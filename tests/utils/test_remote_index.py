@@ -0,0 +1,42 @@
+from unittest.mock import patch
+
+from ricecooker.utils.remote_index import RemoteFileIndex
+
+
+def test_remote_index_records_confirmed_files(tmp_path):
+    index = RemoteFileIndex(str(tmp_path / "index.sqlite3"), ttl=60)
+    assert not index.contains("https://studio", "abc.mp4")
+
+    index.add("https://studio", "abc.mp4", size=10)
+
+    assert index.contains("https://studio", "abc.mp4")
+    assert index.get_size("https://studio", "abc.mp4") == 10
+    # Confirmations are per host
+    assert not index.contains("https://other-studio", "abc.mp4")
+
+
+def test_remote_index_persists_between_instances(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    index = RemoteFileIndex(path, ttl=60)
+    index.add("https://studio", "abc.mp4")
+    index.close()
+
+    assert RemoteFileIndex(path, ttl=60).contains("https://studio", "abc.mp4")
+
+
+def test_remote_index_entries_expire_after_ttl(tmp_path):
+    index = RemoteFileIndex(str(tmp_path / "index.sqlite3"), ttl=60)
+    with patch("ricecooker.utils.remote_index.time.time", return_value=1000.0):
+        index.add("https://studio", "abc.mp4", size=10)
+    with patch("ricecooker.utils.remote_index.time.time", return_value=1059.0):
+        assert index.contains("https://studio", "abc.mp4")
+    with patch("ricecooker.utils.remote_index.time.time", return_value=1060.0):
+        assert not index.contains("https://studio", "abc.mp4")
+        assert index.get_size("https://studio", "abc.mp4") is None
+
+
+def test_remote_index_remove(tmp_path):
+    index = RemoteFileIndex(str(tmp_path / "index.sqlite3"), ttl=60)
+    index.add("https://studio", "abc.mp4")
+    index.remove("https://studio", "abc.mp4")
+    assert not index.contains("https://studio", "abc.mp4")
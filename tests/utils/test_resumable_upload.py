@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+import pytest
+import requests
+from requests.exceptions import RequestException
+
+from ricecooker.utils.resumable_upload import ResumableUpload
+from ricecooker.utils.resumable_upload import ResumableUploadNotSupported
+from ricecooker.utils.resumable_upload import UploadChecksumError
+from ricecooker.utils.resumable_upload import UploadSessionStore
+
+
+class StorageHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        storage = self.server.storage
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if (
+            not storage.supports_resumable
+            or self.headers.get("x-goog-resumable") != "start"
+        ):
+            return self._respond(405)
+        session_id = str(len(storage.received))
+        storage.received[session_id] = bytearray()
+        location = "http://{}:{}/session/{}".format(
+            *self.server.server_address, session_id
+        )
+        self._respond(201, {"Location": location})
+
+    def do_PUT(self):
+        storage = self.server.storage
+        session_id = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        received = storage.received.get(session_id)
+        if received is None:
+            return self._respond(404)
+        byte_range, total = self.headers["Content-Range"][6:].split("/")
+        if byte_range != "*":
+            first = int(byte_range.split("-")[0])
+            storage.parts.append((session_id, first))
+            if storage.fail_parts:
+                storage.fail_parts -= 1
+                return self._respond(503)
+            if first == len(received):
+                received.extend(body)
+        if len(received) == int(total):
+            storage.final_hashes.append(self.headers.get("x-goog-hash"))
+            if storage.corrupt:
+                received[0] ^= 0xFF
+            md5 = base64.b64encode(hashlib.md5(received).digest()).decode()
+            return self._respond(200, {"x-goog-hash": "crc32c=AAAAAA==,md5=" + md5})
+        headers = {"Range": "bytes=0-{}".format(len(received) - 1)}
+        self._respond(308, headers if received else None)
+
+
+class StorageServer(object):
+    """Local stand-in for a storage backend that supports resumable sessions."""
+
+    def __init__(self):
+        self.received = {}  # session id -> bytearray
+        self.parts = []  # (session id, first byte) of every part received
+        self.fail_parts = 0  # answer this many upcoming parts with a 503
+        self.supports_resumable = True
+        self.corrupt = False  # flip a byte of the finished object
+        self.final_hashes = []  # x-goog-hash header of each last part
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), StorageHandler)
+        self.httpd.storage = self
+        self.url = "http://{}:{}/upload".format(*self.httpd.server_address)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def storage_server():
+    server = StorageServer()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def large_file(tmp_path):
+    path = tmp_path / "abc123.mp4"
+    path.write_bytes(bytes(range(256)) * 40)  # 10240 bytes
+    return str(path)
+
+
+SESSION_KEY = os.path.join("studio.example.com", "abc123.mp4")
+
+
+def _upload(storage_server, large_file, store, **kwargs):
+    kwargs.setdefault("chunk_size", 4096)
+    kwargs.setdefault("domain", "https://studio.example.com")
+    with open(large_file, "rb") as f:
+        kwargs.setdefault("checksum", hashlib.md5(f.read()).hexdigest())
+    kwargs.setdefault("backoff", 0)
+    return ResumableUpload(
+        "abc123.mp4",
+        large_file,
+        storage_server.url,
+        headers={"Content-Type": "video/mp4"},
+        session=requests.Session(),
+        store=store,
+        **kwargs,
+    )
+
+
+def test_resumable_upload_sends_file_in_parts(storage_server, large_file, tmp_path):
+    store = UploadSessionStore(str(tmp_path / "sessions"))
+
+    _upload(storage_server, large_file, store).upload()
+
+    with open(large_file, "rb") as f:
+        assert storage_server.received["0"] == f.read()
+    assert storage_server.parts == [("0", 0), ("0", 4096), ("0", 8192)]
+    assert store.get(SESSION_KEY) is None
+    # Only the last part carries the MD5 of the whole file
+    md5 = hashlib.md5(storage_server.received["0"]).digest()
+    assert storage_server.final_hashes == ["md5=" + base64.b64encode(md5).decode()]
+
+
+def test_resumable_upload_retries_failed_parts(storage_server, large_file, tmp_path):
+    store = UploadSessionStore(str(tmp_path / "sessions"))
+    storage_server.fail_parts = 2
+
+    _upload(storage_server, large_file, store).upload()
+
+    assert len(storage_server.received["0"]) == 10240
+    assert storage_server.parts[:3] == [("0", 0), ("0", 0), ("0", 0)]
+
+
+def test_resumable_upload_resumes_saved_session(storage_server, large_file, tmp_path):
+    store = UploadSessionStore(str(tmp_path / "sessions"))
+    upload = _upload(storage_server, large_file, store, max_attempts=1)
+    upload._start_session()
+    with open(large_file, "rb") as f:
+        upload._send_part(f.read(4096))
+    storage_server.fail_parts = 1
+    with pytest.raises(RequestException):
+        upload.upload()
+    assert store.get(SESSION_KEY)["offset"] == 4096
+
+    # A restarted chef continues the same session from the confirmed offset
+    _upload(storage_server, large_file, store).upload()
+
+    assert list(storage_server.received) == ["0"]
+    assert len(storage_server.received["0"]) == 10240
+    assert storage_server.parts == [("0", 0), ("0", 4096), ("0", 4096), ("0", 8192)]
+    assert store.get(SESSION_KEY) is None
+
+
+def test_resumable_upload_restarts_expired_session(
+    storage_server, large_file, tmp_path
+):
+    store = UploadSessionStore(str(tmp_path / "sessions"))
+    store.save(
+        SESSION_KEY,
+        {
+            "session_url": storage_server.url.replace("upload", "session/gone"),
+            "size": 10240,
+            "offset": 4096,
+            "created": time.time(),
+        },
+    )
+
+    _upload(storage_server, large_file, store).upload()
+
+    assert len(storage_server.received["0"]) == 10240
+
+
+def test_resumable_upload_keeps_sessions_of_each_studio_apart(
+    storage_server, large_file, tmp_path
+):
+    store = UploadSessionStore(str(tmp_path / "sessions"))
+    upload = _upload(storage_server, large_file, store, max_attempts=1)
+    upload._start_session()
+    with open(large_file, "rb") as f:
+        upload._send_part(f.read(4096))
+
+    # Uploading the same file to another Studio opens a session of its own
+    _upload(
+        storage_server, large_file, store, domain="https://other.example.com:8080"
+    ).upload()
+
+    assert list(storage_server.received) == ["0", "1"]
+    assert len(storage_server.received["1"]) == 10240
+    assert store.get(SESSION_KEY)["offset"] == 4096
+    assert store.get(os.path.join("other.example.com_8080", "abc123.mp4")) is None
+
+
+def test_resumable_upload_not_supported(storage_server, large_file, tmp_path):
+    storage_server.supports_resumable = False
+    store = UploadSessionStore(str(tmp_path / "sessions"))
+
+    with pytest.raises(ResumableUploadNotSupported):
+        _upload(storage_server, large_file, store).upload()
+
+
+def test_resumable_upload_checks_uploaded_md5(storage_server, large_file, tmp_path):
+    storage_server.corrupt = True
+    store = UploadSessionStore(str(tmp_path / "sessions"))
+
+    with pytest.raises(UploadChecksumError):
+        _upload(storage_server, large_file, store).upload()
+    assert store.get(SESSION_KEY) is None
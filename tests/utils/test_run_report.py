@@ -0,0 +1,62 @@
+import json
+from unittest.mock import patch
+
+from ricecooker.utils.run_report import get_run_report
+from ricecooker.utils.run_report import RunReport
+from ricecooker.utils.run_report import start_run_report
+
+
+def test_run_report_times_phases_and_counts():
+    report = RunReport(slowest_count=2)
+    with patch("ricecooker.utils.run_report.time.monotonic", side_effect=[0, 2, 5, 6]):
+        with report.phase("process_tree_files"):
+            pass
+        with report.phase("process_tree_files"):
+            pass
+    report.count("files_processed", 6)
+    report.count("cache_hits", 3)
+    report.count("cache_misses")
+
+    result = report.to_dict()
+
+    assert result["phases"] == {"process_tree_files": 3}
+    assert result["files_per_second"] == 2
+    assert result["cache_hit_rate"] == 0.75
+    assert result["uploads_per_second"] is None
+
+
+def test_run_report_keeps_slowest_files_and_nodes():
+    report = RunReport(slowest_count=2)
+    for name, seconds in [("a", 1), ("b", 5), ("c", 3), ("d", 0.5)]:
+        report.record_file(name, seconds)
+    report.record_node("topic", 2)
+
+    result = report.to_dict()
+
+    assert [f["name"] for f in result["slowest_files"]] == ["b", "c"]
+    assert result["slowest_nodes"] == [{"name": "topic", "seconds": 2}]
+
+
+def test_run_report_saves_json_and_prometheus_textfile(tmp_path):
+    report = RunReport()
+    with report.phase("add_nodes"):
+        report.count("bytes_uploaded", 1024)
+    textfile = tmp_path / "ricecooker.prom"
+
+    path = report.save(directory=str(tmp_path), prometheus_path=str(textfile))
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved["counters"]["bytes_uploaded"] == 1024
+    assert "add_nodes" in saved["phases"]
+    metrics = textfile.read_text()
+    assert 'ricecooker_phase_seconds{phase="add_nodes"}' in metrics
+    assert "# TYPE ricecooker_bytes_uploaded_total counter" in metrics
+    assert "ricecooker_bytes_uploaded_total 1024" in metrics
+
+
+def test_start_run_report_resets_the_current_report():
+    get_run_report().count("files_uploaded")
+    report = start_run_report()
+    assert get_run_report() is report
+    assert report.counters["files_uploaded"] == 0
@@ -0,0 +1,36 @@
+import hashlib
+import os
+
+from ricecooker import config
+from ricecooker.utils.storage import copy_file_to_storage
+from ricecooker.utils.storage import move_file_to_storage
+
+
+def test_copy_file_to_storage_keeps_source(tmp_path):
+    source = tmp_path / "video.mp4"
+    source.write_bytes(b"video")
+
+    filename = copy_file_to_storage(str(source))
+
+    assert filename == hashlib.md5(b"video").hexdigest() + ".mp4"
+    with open(config.get_storage_path(filename), "rb") as f:
+        assert f.read() == b"video"
+    assert source.read_bytes() == b"video"
+    # No temporary file is left in storage
+    assert not [
+        name
+        for name in os.listdir(config.STORAGE_DIRECTORY)
+        if name.startswith(".ingest-")
+    ]
+
+
+def test_move_file_to_storage_uses_given_checksum(tmp_path):
+    source = tmp_path / "audio.mp3"
+    source.write_bytes(b"audio")
+
+    filename = move_file_to_storage(str(source), checksum="f" * 32)
+
+    assert filename == "f" * 32 + ".mp3"
+    assert os.path.exists(config.get_storage_path(filename))
+    assert not source.exists()
+    os.remove(config.get_storage_path(filename))
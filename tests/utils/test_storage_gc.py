@@ -0,0 +1,145 @@
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from ricecooker import config
+from ricecooker.cli import main
+from ricecooker.utils.metadata_cache import SQLiteCache
+from ricecooker.utils.run_report import RunReport
+from ricecooker.utils.storage_gc import collect_storage_garbage
+from ricecooker.utils.storage_gc import get_tree_filenames
+from ricecooker.utils.storage_gc import parse_size
+
+TREE_FILE = "a" * 32 + ".mp4"
+QUESTION_IMAGE = "b" * 32 + ".png"
+CACHED_OLD = "c" * 32 + ".mp4"
+CACHED_NEW = "d" * 32 + ".mp4"
+UNUSED = "e" * 32 + ".zip"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache"))
+    with (
+        patch("ricecooker.config.STORAGE_DIRECTORY", str(tmp_path / "storage")),
+        patch("ricecooker.utils.caching.FILECACHE", cache),
+    ):
+        for mtime, filename in enumerate(
+            [TREE_FILE, QUESTION_IMAGE, CACHED_OLD, CACHED_NEW, UNUSED]
+        ):
+            path = config.get_storage_path(filename)
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+            os.utime(path, (mtime, mtime))
+        cache.set("DOWNLOAD:video.mp4", json.dumps({"filename": CACHED_OLD}).encode())
+        cache.set("CONVERT:video.mp4", json.dumps({"filename": CACHED_NEW}).encode())
+        cache.set("CONVERT:tree.mp4", json.dumps({"filename": TREE_FILE}).encode())
+        cache.set("GRAPHIE: missing", b"f" * 32 + b".graphie")
+        tree_path = str(tmp_path / "tree.json")
+        with open(tree_path, "w") as f:
+            json.dump(
+                {
+                    "title": "Channel",
+                    "children": [
+                        {"files": [{"filename": TREE_FILE}]},
+                        {
+                            "questions": [
+                                {
+                                    "question": "![](${☣ CONTENTSTORAGE}/"
+                                    + QUESTION_IMAGE
+                                    + ")"
+                                }
+                            ]
+                        },
+                    ],
+                },
+                f,
+            )
+        yield cache, tree_path
+
+
+def _in_storage(filename):
+    return os.path.exists(config.get_storage_path(filename))
+
+
+def test_get_tree_filenames(storage):
+    cache, tree_path = storage
+    assert get_tree_filenames(tree_path) == {TREE_FILE, QUESTION_IMAGE}
+
+
+def test_gc_removes_unreferenced_files_and_stale_cache_entries(storage):
+    cache, tree_path = storage
+    with patch("ricecooker.utils.storage_gc.get_hash_memo") as get_hash_memo:
+        result = collect_storage_garbage([tree_path], budget=0)
+    memo = get_hash_memo.return_value
+
+    assert not _in_storage(UNUSED)
+    assert all(_in_storage(f) for f in [TREE_FILE, QUESTION_IMAGE, CACHED_OLD])
+    assert result.files_removed == 1
+    # The memoized hash of the removed file is dropped with it
+    assert memo.forget.call_args.args[0] == [config.get_storage_path(UNUSED)]
+    memo.prune.assert_called_once()
+    assert result.bytes_freed == 100
+    assert result.bytes_kept == 400
+    # The entry pointing at a file missing from storage is pruned
+    assert result.cache_entries_removed == 1
+    assert cache.get("GRAPHIE: missing") is None
+    assert cache.get("DOWNLOAD:video.mp4") is not None
+
+
+def test_gc_evicts_least_recently_used_cached_files_over_budget(storage):
+    cache, tree_path = storage
+    collect_storage_garbage([tree_path], budget=300)
+
+    assert not _in_storage(CACHED_OLD)
+    assert _in_storage(CACHED_NEW)
+    assert cache.get("DOWNLOAD:video.mp4") is None
+    assert cache.get("CONVERT:video.mp4") is not None
+
+    # Files of the tree are kept even when they do not fit in the budget
+    collect_storage_garbage([tree_path], budget=1)
+    assert _in_storage(TREE_FILE) and _in_storage(QUESTION_IMAGE)
+    assert not _in_storage(CACHED_NEW)
+    assert cache.get("CONVERT:tree.mp4") is not None
+
+
+def test_gc_dry_run_removes_nothing(storage):
+    cache, tree_path = storage
+    result = collect_storage_garbage([tree_path], budget=1, dry_run=True)
+
+    assert result.files_removed == 3
+    assert all(
+        _in_storage(f)
+        for f in [TREE_FILE, QUESTION_IMAGE, CACHED_OLD, CACHED_NEW, UNUSED]
+    )
+    assert cache.get("GRAPHIE: missing") is not None
+
+
+def test_parse_size():
+    assert parse_size("1024") == 1024
+    assert parse_size("50G") == 50 * 1024**3
+    assert parse_size("1.5k") == 1536
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_gc_counters_are_run_report_counters():
+    report = RunReport()
+    report.count("storage_files_removed", 2)
+    report.count("storage_bytes_freed", 200)
+    assert report.to_dict()["counters"]["storage_bytes_freed"] == 200
+
+
+def test_storage_gc_command(storage):
+    cache, tree_path = storage
+    main(["storage", "gc", "--tree", tree_path, "--budget", "1", "--dry-run"])
+    assert _in_storage(UNUSED)
+
+    main(["storage", "gc", "--tree", tree_path])
+    assert not _in_storage(UNUSED)
+    assert _in_storage(CACHED_OLD)
+
+    with pytest.raises(SystemExit):
+        main(["storage"])
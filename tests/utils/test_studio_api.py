@@ -0,0 +1,85 @@
+import gzip
+import json
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import pytest
+
+from ricecooker import config
+from ricecooker.utils import studio_api
+
+
+@pytest.fixture(autouse=True)
+def reset_gzip_support():
+    studio_api._gzip_support.clear()
+    yield
+    studio_api._gzip_support.clear()
+
+
+def _response(status_code):
+    response = MagicMock()
+    response.status_code = status_code
+    response.content = b'{"ok": true}'
+    return response
+
+
+def test_dumps_and_loads_round_trip():
+    payload = {"title": "Título", "ids": [1, 2]}
+    assert isinstance(studio_api.dumps(payload), bytes)
+    assert studio_api.loads(studio_api.dumps(payload)) == payload
+    assert studio_api.loads_response(_response(200)) == {"ok": True}
+
+
+def test_post_sends_small_payloads_uncompressed():
+    with (
+        patch("ricecooker.config.STUDIO_GZIP_THRESHOLD", 1024),
+        patch("ricecooker.config.SESSION.post", return_value=_response(200)) as post,
+    ):
+        studio_api.post("https://studio/api", {"a": 1})
+
+    post.assert_called_once_with("https://studio/api", data=studio_api.dumps({"a": 1}))
+
+
+def test_post_compresses_large_payloads():
+    payload = {"data": "x" * 2048}
+    with (
+        patch("ricecooker.config.STUDIO_GZIP_THRESHOLD", 1024),
+        patch("ricecooker.config.SESSION.post", return_value=_response(200)) as post,
+    ):
+        studio_api.post("https://studio/api", payload)
+
+    kwargs = post.call_args.kwargs
+    assert kwargs["headers"] == {"Content-Encoding": "gzip"}
+    assert json.loads(gzip.decompress(kwargs["data"])) == payload
+    assert studio_api._gzip_support[config.DOMAIN] is True
+
+
+def test_post_falls_back_when_server_rejects_compressed_bodies():
+    payload = {"data": "x" * 2048}
+    with (
+        patch("ricecooker.config.STUDIO_GZIP_THRESHOLD", 1024),
+        patch(
+            "ricecooker.config.SESSION.post",
+            side_effect=[_response(415), _response(200), _response(200)],
+        ) as post,
+    ):
+        assert studio_api.post("https://studio/api", payload).status_code == 200
+        studio_api.post("https://studio/api", payload)
+
+    assert "headers" in post.call_args_list[0].kwargs
+    # The payload is resent uncompressed, and so are later payloads
+    assert "headers" not in post.call_args_list[1].kwargs
+    assert "headers" not in post.call_args_list[2].kwargs
+
+
+def test_post_does_not_resend_payloads_after_server_errors():
+    payload = {"data": "x" * 2048}
+    with (
+        patch("ricecooker.config.STUDIO_GZIP_THRESHOLD", 1024),
+        patch("ricecooker.config.SESSION.post", return_value=_response(500)) as post,
+    ):
+        assert studio_api.post("https://studio/api", payload).status_code == 500
+
+    # The server may have applied the request: it is not sent a second time
+    post.assert_called_once()
+    assert config.DOMAIN not in studio_api._gzip_support
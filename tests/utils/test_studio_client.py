@@ -0,0 +1,88 @@
+import io
+import threading
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import requests
+
+from ricecooker.utils.studio_client import AdaptiveConcurrency
+from ricecooker.utils.studio_client import StudioSession
+
+
+def _response(status_code, headers=None):
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+def test_studio_session_sizes_pool_to_workers():
+    session = StudioSession(pool_size=32)
+    assert session.get_adapter("https://studio.example.com")._pool_maxsize == 32
+    session.configure_pool(8)
+    assert session.get_adapter("https://studio.example.com")._pool_maxsize == 8
+
+
+def test_studio_session_honors_retry_after():
+    session = StudioSession(pool_size=4)
+    responses = [_response(429, {"Retry-After": "2"}), _response(200)]
+    with (
+        patch.object(requests.Session, "request", side_effect=responses) as request,
+        patch("ricecooker.utils.studio_client.time.sleep") as sleep,
+    ):
+        response = session.post("https://studio.example.com/api", data=b"{}")
+
+    assert response.status_code == 200
+    assert request.call_count == 2
+    sleep.assert_called_once_with(2.0)
+    # The host throttled, so fewer requests are sent to it at once
+    assert session._limiter("https://studio.example.com/").limit == 2
+
+
+def test_studio_session_gives_up_after_max_retries():
+    session = StudioSession(pool_size=4, max_retries=2)
+    with (
+        patch.object(
+            requests.Session, "request", return_value=_response(503)
+        ) as request,
+        patch("ricecooker.utils.studio_client.time.sleep") as sleep,
+    ):
+        response = session.get("https://studio.example.com/api")
+
+    assert response.status_code == 503
+    assert request.call_count == 3
+    assert [c.args[0] for c in sleep.call_args_list] == [0.5, 1.0]
+
+
+def test_studio_session_does_not_resend_file_bodies():
+    session = StudioSession(pool_size=4)
+    with patch.object(
+        requests.Session, "request", return_value=_response(503)
+    ) as request:
+        response = session.put("https://storage.example.com/f", data=io.BytesIO(b"x"))
+
+    assert response.status_code == 503
+    assert request.call_count == 1
+
+
+def test_adaptive_concurrency_backs_off_and_recovers():
+    limiter = AdaptiveConcurrency(max_limit=8, increase_after=2)
+    limiter.acquire()
+    limiter.release(throttled=True)
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 6
+
+
+def test_adaptive_concurrency_blocks_at_limit():
+    limiter = AdaptiveConcurrency(max_limit=1)
+    limiter.acquire()
+    acquired = threading.Event()
+    waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+    waiter.start()
+    assert not acquired.wait(0.1)
+    limiter.release()
+    assert acquired.wait(1)
+    waiter.join()